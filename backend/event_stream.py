@@ -0,0 +1,143 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import instance_manager
+from traffic_collector import traffic_collector
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two collections while at least one client is subscribed
+EVENT_INTERVAL = int(os.getenv("EVENT_INTERVAL", "5"))
+EVENT_HEARTBEAT = 15
+SUBSCRIBER_QUEUE_SIZE = 100
+
+Event = Tuple[str, Dict]
+
+def format_event(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+class EventHub:
+    """
+    Single producer for the Server-Sent Events stream. One loop collects instance status
+    (one systemctl call) and client sessions/rates (from the traffic collector, whose
+    per-instance totals are kept up to date as it samples) and fans
+    the differences out to every subscriber, so N open dashboards cost one collection.
+    The loop does nothing while nobody is subscribed.
+
+    Events: snapshot, instance_status, instance_removed, client_connected,
+    client_disconnected, traffic, resync (the subscriber fell behind and must reload).
+    """
+    def __init__(self, interval: int = EVENT_INTERVAL):
+        self.interval = interval
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._instances: Dict[str, Dict] = {}
+        self._clients: Dict[Tuple[str, str], Dict] = {}
+        self._last_collect = 0.0
+        self._collect_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Starts the producer; must be called from the running event loop."""
+        if self._task:
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if self._subscribers:
+                await self._refresh()
+
+    async def _refresh(self):
+        async with self._collect_lock:
+            try:
+                events = await asyncio.to_thread(self._collect)
+            except Exception as e:
+                logger.error(f"Event collection failed: {e}")
+                return
+            for event in events:
+                self._broadcast(event)
+
+    def _collect(self) -> List[Event]:
+        """Reads the current state and returns the events describing what changed."""
+        instances = instance_manager.get_all_instances()
+        clients = {}
+        for entry in traffic_collector.get_rates():
+            if entry["connected"]:
+                clients[(entry["instance_name"], entry["client_name"])] = entry
+
+        totals = {s["instance_name"]: s for s in traffic_collector.get_instance_stats()}
+
+        events: List[Event] = []
+        states = {}
+        for inst in instances:
+            stats = totals.get(inst.name) if inst.status == "running" else None
+            states[inst.id] = {
+                "id": inst.id,
+                "name": inst.name,
+                "status": inst.status,
+                "connected_clients": stats["connected_clients"] if stats else 0,
+                "rx_rate": stats["rx_rate"] if stats else 0.0,
+                "tx_rate": stats["tx_rate"] if stats else 0.0,
+            }
+            previous = self._instances.get(inst.id)
+            if not previous or (previous["status"], previous["connected_clients"]) != (inst.status, states[inst.id]["connected_clients"]):
+                events.append(("instance_status", states[inst.id]))
+        for instance_id in self._instances.keys() - states.keys():
+            events.append(("instance_removed", {"id": instance_id}))
+
+        for key in clients.keys() - self._clients.keys():
+            events.append(("client_connected", {"instance_name": key[0], "client_name": key[1]}))
+        for key in self._clients.keys() - clients.keys():
+            events.append(("client_disconnected", {"instance_name": key[0], "client_name": key[1]}))
+
+        events.append(("traffic", {
+            "instances": {s["name"]: {"rx_rate": s["rx_rate"], "tx_rate": s["tx_rate"]} for s in states.values()},
+            "clients": list(clients.values()),
+        }))
+
+        self._instances = states
+        self._clients = clients
+        self._last_collect = time.monotonic()
+        return events
+
+    def _broadcast(self, event: Event):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer: drop its backlog and tell it to reload
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(("resync", {}))
+
+    def snapshot(self) -> Dict:
+        return {
+            "instances": list(self._instances.values()),
+            "clients": list(self._clients.values()),
+        }
+
+    async def stream(self) -> AsyncIterator[str]:
+        """SSE body for one subscriber: a snapshot, then events as they happen."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        if time.monotonic() - self._last_collect > self.interval:
+            await self._refresh()
+        self._subscribers.add(queue)
+        try:
+            yield f"retry: {self.interval * 1000}\n\n"
+            yield format_event("snapshot", self.snapshot())
+            while True:
+                try:
+                    event, data = await asyncio.wait_for(queue.get(), timeout=EVENT_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield format_event(event, data)
+        finally:
+            self._subscribers.discard(queue)
+
+event_hub = EventHub()
@@ -1,17 +1,20 @@
+import io
+import csv
 import json
 import os
 import re
-import subprocess
 import logging
 from typing import List, Dict, Optional
 from ipaddress import ip_network, AddressValueError
 from pydantic import BaseModel, validator
+import metrics
 import ip_manager
 import instance_manager
+from traffic_accounting import traffic_accounting
 
 logger = logging.getLogger(__name__)
 
-DATA_DIR = "/opt/vpn-manager/backend/data"
+DATA_DIR = os.getenv("DATA_DIR", "/opt/vpn-manager/backend/data")
 GROUPS_FILE = os.path.join(DATA_DIR, "groups.json")
 RULES_FILE = os.path.join(DATA_DIR, "rules.json")
 
@@ -126,6 +129,14 @@ def delete_group(group_id: str):
     _save_rules(rules)
     apply_firewall_rules()
 
+def _normalize_member_identifier(client_identifier: str, instance_name: str) -> str:
+    """Sanitize the client_identifier to prevent duplicate prefixes, e.g. "inst_inst_client"."""
+    correct_identifier = client_identifier
+    prefix_to_check = f"{instance_name}_"
+    while correct_identifier.startswith(prefix_to_check + instance_name):
+        correct_identifier = correct_identifier[len(prefix_to_check):]
+    return correct_identifier
+
 def add_member_to_group(group_id: str, client_identifier: str, subnet_info: Dict[str, str]):
     """
     client_identifier: e.g., "server_client1"
@@ -137,12 +148,7 @@ def add_member_to_group(group_id: str, client_identifier: str, subnet_info: Dict
         raise ValueError("Group not found")
 
     instance_name = subnet_info["instance_name"]
-    
-    # Sanitize the client_identifier to prevent duplicate prefixes, e.g. "inst_inst_client"
-    correct_identifier = client_identifier
-    prefix_to_check = f"{instance_name}_"
-    while correct_identifier.startswith(prefix_to_check + instance_name):
-        correct_identifier = correct_identifier[len(prefix_to_check):]
+    correct_identifier = _normalize_member_identifier(client_identifier, instance_name)
     
     if instance_name != group.instance_id:
         raise ValueError(f"Client does not belong to instance {group.instance_id}")
@@ -176,6 +182,57 @@ def remove_member_from_group(group_id: str, client_identifier: str, instance_nam
         
         apply_firewall_rules()
 
+def update_group_members(group_id: str, add: List[str], remove: List[str], subnet_info: Dict[str, str]) -> Dict:
+    """
+    Adds and removes many members in one transaction: static IPs are allocated in a
+    single allocator pass, groups.json is written once and the firewall is compiled once.
+    If any allocation fails, the addresses allocated by this call are released and nothing is saved.
+    """
+    groups = _load_groups()
+    group = next((g for g in groups if g.id == group_id), None)
+    if not group:
+        raise ValueError("Group not found")
+
+    instance_name = subnet_info["instance_name"]
+    if instance_name != group.instance_id:
+        raise ValueError(f"Client does not belong to instance {group.instance_id}")
+
+    to_add = []
+    for identifier in add:
+        identifier = _normalize_member_identifier(identifier, instance_name)
+        if identifier not in group.members and identifier not in to_add:
+            to_add.append(identifier)
+    to_remove = [m for m in dict.fromkeys(remove) if m in group.members]
+    overlap = set(to_add) & set(to_remove)
+    if overlap:
+        raise ValueError(f"Client presenti sia in aggiunta che in rimozione: {', '.join(sorted(overlap))}")
+
+    # 1. Allocate all static IPs in one pass
+    if to_add:
+        already_assigned = ip_manager.get_static_ips(instance_name, subnet_info["subnet"])
+        allocated = ip_manager.allocate_static_ips(instance_name, subnet_info["subnet"], to_add)
+        failed = [name for name, ip in allocated.items() if not ip]
+        if failed:
+            newly_assigned = [name for name, ip in allocated.items() if ip and name not in already_assigned]
+            ip_manager.release_static_ips(instance_name, newly_assigned)
+            raise RuntimeError(f"Failed to allocate static IP for {', '.join(failed)}")
+
+    # 2. Update membership and release IPs no longer used by any group of the instance
+    group.members.extend(to_add)
+    removed = set(to_remove)
+    group.members = [m for m in group.members if m not in removed]
+    still_used = {m for g in groups if g.instance_id == group.instance_id for m in g.members}
+    to_release = [m for m in to_remove if m not in still_used]
+    if to_release:
+        ip_manager.release_static_ips(instance_name, to_release)
+
+    # 3. Persist once and compile the firewall once
+    if to_add or to_remove:
+        _save_groups(groups)
+        apply_firewall_rules()
+
+    return {"added": to_add, "removed": to_remove, "members": len(group.members)}
+
 def remove_client_from_all_groups(instance_name: str, client_name: str):
     """
     Removes a client from all groups they might be part of.
@@ -280,13 +337,125 @@ def get_rules(group_id: Optional[str] = None) -> List[Rule]:
         return [r for r in rules if r.group_id == group_id]
     return rules
 
+# --- Bulk Import/Export ---
+
+RULE_EXPORT_FIELDS = ["id", "group_id", "action", "protocol", "port", "destination", "description", "order"]
+VALID_RULE_ACTIONS = ["ACCEPT", "DROP", "REJECT"]
+VALID_RULE_PROTOCOLS = ["tcp", "udp", "icmp", "all"]
+
+def _scope_group_ids(group_id: Optional[str], instance_id: Optional[str]) -> set:
+    if bool(group_id) == bool(instance_id):
+        raise ValueError("Specificare esattamente uno tra group_id e instance_id.")
+    groups = _load_groups()
+    if group_id:
+        if not any(g.id == group_id for g in groups):
+            raise ValueError("Group not found")
+        return {group_id}
+    return {g.id for g in groups if g.instance_id == instance_id}
+
+def export_rules(group_id: Optional[str] = None, instance_id: Optional[str] = None) -> List[Rule]:
+    """Returns the rules of a group or of all groups of an instance, ordered per group."""
+    scope = _scope_group_ids(group_id, instance_id)
+    rules = [r for r in _load_rules() if r.group_id in scope]
+    rules.sort(key=lambda r: (r.group_id, r.order))
+    return rules
+
+def rules_to_csv(rules: List[Rule]) -> str:
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=RULE_EXPORT_FIELDS)
+    writer.writeheader()
+    for rule in rules:
+        row = rule.dict()
+        writer.writerow({k: ("" if row[k] is None else row[k]) for k in RULE_EXPORT_FIELDS})
+    return output.getvalue()
+
+def parse_rules_csv(text: str) -> List[Dict]:
+    reader = csv.DictReader(io.StringIO(text))
+    rows = []
+    for row in reader:
+        rows.append({k.strip(): (v.strip() if isinstance(v, str) else v) for k, v in row.items() if k})
+    return rows
+
+def import_rules(rows: List[Dict], group_id: Optional[str] = None, instance_id: Optional[str] = None, mode: str = "merge") -> Dict:
+    """
+    Imports a full rule set for a group or an instance in one transaction.
+    Every row is validated up front with the Rule validators; if any row fails nothing is
+    written and the per-row errors are returned. Otherwise rules.json is written once and
+    the firewall is applied once.
+    mode "replace" drops the existing rules of the scope; "merge" updates rules with a
+    matching id and appends the others.
+    """
+    if mode not in ["merge", "replace"]:
+        raise ValueError(f"Modalità di import non valida: '{mode}'.")
+    scope = _scope_group_ids(group_id, instance_id)
+
+    existing = _load_rules()
+    existing_by_id = {r.id: r for r in existing}
+    next_order: Dict[str, int] = {}
+    if mode == "merge":
+        for r in existing:
+            if r.group_id in scope:
+                next_order[r.group_id] = max(next_order.get(r.group_id, -1), r.order)
+
+    validated: List[Rule] = []
+    errors = []
+    seen_ids = set()
+    for index, row in enumerate(rows, start=1):
+        data = {k: v for k, v in dict(row).items() if k in RULE_EXPORT_FIELDS and v not in (None, "")}
+        if group_id:
+            data["group_id"] = group_id
+        try:
+            if data.get("group_id") not in scope:
+                raise ValueError(f"Gruppo '{data.get('group_id')}' non appartiene all'istanza.")
+            data["action"] = str(data.get("action", "")).upper()
+            if data["action"] not in VALID_RULE_ACTIONS:
+                raise ValueError(f"Azione non valida: '{data['action']}'.")
+            data["protocol"] = str(data.get("protocol", "")).lower()
+            if data["protocol"] not in VALID_RULE_PROTOCOLS:
+                raise ValueError(f"Protocollo non valido: '{data['protocol']}'.")
+
+            rule_id = data.get("id")
+            if rule_id and rule_id in existing_by_id and existing_by_id[rule_id].group_id not in scope:
+                raise ValueError(f"La regola '{rule_id}' appartiene a un altro gruppo.")
+            if not rule_id or (mode == "merge" and rule_id not in existing_by_id) or rule_id in seen_ids:
+                data["id"] = str(uuid.uuid4())
+            seen_ids.add(data["id"])
+
+            if "order" in data:
+                data["order"] = int(data["order"])
+            elif mode == "merge" and data["id"] in existing_by_id:
+                data["order"] = existing_by_id[data["id"]].order
+            else:
+                data["order"] = next_order.get(data["group_id"], -1) + 1
+            next_order[data["group_id"]] = max(next_order.get(data["group_id"], -1), data["order"])
+
+            validated.append(Rule(**data))
+        except (ValueError, TypeError) as e:
+            errors.append({"row": index, "error": str(e)})
+
+    if errors:
+        return {"success": False, "imported": 0, "errors": errors}
+
+    if mode == "replace":
+        rules = [r for r in existing if r.group_id not in scope]
+    else:
+        imported_ids = {r.id for r in validated}
+        rules = [r for r in existing if r.id not in imported_ids]
+    rules.extend(validated)
+    rules.sort(key=lambda x: x.order)
+
+    _save_rules(rules)
+    apply_firewall_rules()
+    logger.info(f"Imported {len(validated)} firewall rules ({mode}) into {group_id or instance_id}.")
+    return {"success": True, "imported": len(validated), "errors": []}
+
 # --- IPTables Application ---
 
 def _run_iptables(cmd: List[str], check=False, suppress_errors=False):
     """Helper to run iptables commands, with optional error suppression."""
     try:
         # Using shell=False and list of args is safer
-        result = subprocess.run(cmd, check=check, capture_output=True, text=True)
+        result = metrics.run(cmd, check=check, capture_output=True, text=True)
         if result.returncode != 0 and not suppress_errors:
             logger.warning(f"iptables command failed: {' '.join(cmd)}\n  Error: {result.stderr.strip()}")
         return result
@@ -300,7 +469,14 @@ def apply_firewall_rules():
     Re-generates all VPN firewall rules using a hierarchical chain structure.
     VPN_MAIN_FWD -> VI_{instance_id} -> VIG_{group_id}
     """
+    with metrics.firewall_apply_duration.time(("vpn",)):
+        rule_count = _apply_firewall_rules()
+    metrics.firewall_rules.set(("vpn",), rule_count)
+
+def _apply_firewall_rules() -> int:
+    """Body of apply_firewall_rules; returns the number of rules and jumps installed."""
     logger.info("--- Starting Firewall Rules Application ---")
+    rule_count = 0
 
     # 1. Load all configurations
     instances = instance_manager.get_all_instances()
@@ -335,24 +511,19 @@ def apply_firewall_rules():
     # 6. Populate chains
     logger.info("Populating iptables chains...")
     
-    # Helper to get client IP (same as before, but defined locally)
-    def get_client_ip(member_id, instances_data):
-        for inst in instances_data:
-            if member_id.startswith(f"{inst.name}_"):
-                ip = ip_manager.get_assigned_ip(inst.name, member_id)
-                if ip:
-                    return ip
-        return None
-
-    # Create a member-to-IP map for efficiency
+    # Create a member-to-IP map from the allocator index (no per-member CCD reads)
     member_ip_map = {}
-    all_members = {member for group in groups for member in group.members}
-    for member_id in all_members:
-        ip = get_client_ip(member_id, instances)
-        if ip:
-            member_ip_map[member_id] = ip
-        else:
-             logger.warning(f"Could not resolve IP for member '{member_id}'. They will not be included in firewall rules.")
+    for inst in instances:
+        instance_members = {m for g in groups if g.instance_id == inst.id for m in g.members}
+        if not instance_members:
+            continue
+        static_ips = ip_manager.get_static_ips(inst.name, inst.subnet)
+        for member_id in instance_members:
+            ip = static_ips.get(member_id)
+            if ip:
+                member_ip_map[member_id] = ip
+            else:
+                logger.warning(f"Could not resolve IP for member '{member_id}'. They will not be included in firewall rules.")
 
     # Populate group chains (deepest level)
     for group in groups:
@@ -374,6 +545,7 @@ def apply_firewall_rules():
             cmd.extend(["-j", rule.action.upper()])
             
             _run_iptables(cmd)
+            rule_count += 1
             logger.info(f"  [RULE] Chain {group_chain_name}: {' '.join(cmd)}")
         
         # Add a final RETURN to send non-matching packets back to the instance chain
@@ -385,6 +557,7 @@ def apply_firewall_rules():
         
         # Add jumps from MAIN to INSTANCE chain
         _run_iptables(["iptables", "-A", main_chain, "-s", instance.subnet, "-j", instance_chain_name])
+        rule_count += 1
         logger.info(f"[JUMP] Chain {main_chain}: -s {instance.subnet} -j {instance_chain_name}")
 
         # Find groups belonging to this instance
@@ -397,6 +570,7 @@ def apply_firewall_rules():
                 if member_id in member_ip_map:
                     ip = member_ip_map[member_id]
                     _run_iptables(["iptables", "-A", instance_chain_name, "-s", ip, "-j", group_chain_name])
+                    rule_count += 1
                     logger.info(f"  [JUMP] Chain {instance_chain_name}: -s {ip} -j {group_chain_name}")
         
         # Add instance default policy at the end of the instance chain
@@ -404,6 +578,11 @@ def apply_firewall_rules():
         if default_policy not in ["ACCEPT", "DROP", "REJECT"]:
             default_policy = "ACCEPT" # Safe default
         _run_iptables(["iptables", "-A", instance_chain_name, "-j", default_policy])
+        rule_count += 1
         logger.info(f"  [POLICY] Chain {instance_chain_name}: Default policy set to {default_policy}")
 
+    # 7. Per-client accounting (VPN_ACCT, evaluated before VPN_MAIN_FWD)
+    traffic_accounting.install_rules(instances)
+
     logger.info("--- Firewall Rules Application Finished ---")
+    return rule_count
@@ -6,15 +6,24 @@ import re
 from ipaddress import ip_network, ip_address, AddressValueError
 from typing import List, Optional, Dict
 from pydantic import BaseModel
+import metrics
 import iptables_manager
 import firewall_manager as instance_firewall_manager
+import session_log
+from traffic_archive import traffic_archive
 
 logger = logging.getLogger(__name__)
 
-DATA_FILE = "/opt/vpn-manager/backend/data/instances.json"
-OPENVPN_CONFIG_DIR = "/etc/openvpn"
+HOSTNAME_PATTERN = r"^(?=.{1,253}$)([a-zA-Z0-9]([a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)(\.[a-zA-Z0-9]([a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?)*$"
+
+DATA_DIR = os.getenv("DATA_DIR", "/opt/vpn-manager/backend/data")
+DATA_FILE = os.path.join(DATA_DIR, "instances.json")
+OPENVPN_CONFIG_DIR = os.getenv("OPENVPN_CONFIG_DIR", "/etc/openvpn")
+OPENVPN_LOG_DIR = os.getenv("OPENVPN_LOG_DIR", "/var/log/openvpn")
 DEFAULT_CONFIG_FILE = os.path.join(OPENVPN_CONFIG_DIR, "server.conf")
-IPTABLES_SAVE_SCRIPT = "/opt/vpn-manager/scripts/save-iptables.sh"
+IPTABLES_SAVE_SCRIPT = os.getenv("IPTABLES_SAVE_SCRIPT", "/opt/vpn-manager/scripts/save-iptables.sh")
+# Seconds between two rewrites of the status log by OpenVPN (read by the traffic collector)
+STATUS_INTERVAL = int(os.getenv("STATUS_INTERVAL", "10"))
 
 class Instance(BaseModel):
     id: str
@@ -27,15 +36,16 @@ class Instance(BaseModel):
     routes: List[Dict[str, str]] = []  # List of {"network": "192.168.1.0/24", "interface": "eth1"}
     dns_servers: List[str] = [] # List of DNS servers to push
     firewall_default_policy: str = "ACCEPT"  # Can be "ACCEPT" or "DROP"
+    public_endpoint: Optional[str] = None  # Hostname or IP override for client "remote"
     clients: List[str] = []  # List of client names associated with this instance
     connected_clients: int = 0
     status: str = "stopped" # stopped, running
 
-def _save_iptables_rules():
+def save_iptables_rules():
     """Save current iptables rules to persist across reboots."""
     if os.path.exists(IPTABLES_SAVE_SCRIPT):
         try:
-            subprocess.run(["bash", IPTABLES_SAVE_SCRIPT], check=True)
+            metrics.run(["bash", IPTABLES_SAVE_SCRIPT], check=True)
             logger.info("iptables rules saved successfully")
         except subprocess.CalledProcessError as e:
             logger.warning(f"Failed to save iptables rules: {e}")
@@ -139,13 +149,18 @@ def get_instance_by_id(instance_id: str) -> Optional[Instance]:
 def get_all_instances() -> List[Instance]:
     instances = _load_instances()
     # Update status based on systemd
+    active = _get_active_services(instances)
     for inst in instances:
-        if _is_service_active(inst):
+        if active.get(inst.id):
             inst.status = "running"
         else:
             inst.status = "stopped"
     return instances
 
+def list_instances() -> List[Instance]:
+    """Instances as stored, without querying systemd for their status."""
+    return _load_instances()
+
 def get_instance(instance_id: str) -> Optional[Instance]:
     instances = get_all_instances()
     for inst in instances:
@@ -163,13 +178,42 @@ def _get_service_name(instance: Instance) -> str:
 def _is_service_active(instance: Instance) -> bool:
     service_name = _get_service_name(instance)
     try:
-        subprocess.run(["/usr/bin/systemctl", "is-active", "--quiet", service_name], check=True)
+        metrics.run(["/usr/bin/systemctl", "is-active", "--quiet", service_name], check=True)
         return True
     except subprocess.CalledProcessError:
         return False
 
+def _get_active_services(instances: List[Instance]) -> Dict[str, bool]:
+    """Status of all instance services with a single systemctl call (one output line per unit)."""
+    if not instances:
+        return {}
+    units = [_get_service_name(inst) for inst in instances]
+    try:
+        result = metrics.run(["/usr/bin/systemctl", "is-active", *units], capture_output=True, text=True)
+        states = result.stdout.split()
+    except OSError:
+        states = []
+    if len(states) != len(units):
+        return {inst.id: _is_service_active(inst) for inst in instances}
+    return {inst.id: state == "active" for inst, state in zip(instances, states)}
+
+def _validate_public_endpoint(endpoint: Optional[str]) -> Optional[str]:
+    """Validates an endpoint override (IP address or hostname). Empty means no override."""
+    if endpoint is None or endpoint.strip() == "":
+        return None
+    endpoint = endpoint.strip()
+    try:
+        ip_address(endpoint)
+        return endpoint
+    except ValueError:
+        pass
+    if not re.fullmatch(HOSTNAME_PATTERN, endpoint):
+        raise ValueError(f"Endpoint pubblico non valido: '{endpoint}'. Usare un hostname o un indirizzo IP.")
+    return endpoint
+
 def create_instance(name: str, port: int, subnet: str, protocol: str = "udp", 
-                   tunnel_mode: str = "full", routes: List[Dict[str, str]] = None, dns_servers: List[str] = None) -> Instance:
+                   tunnel_mode: str = "full", routes: List[Dict[str, str]] = None, dns_servers: List[str] = None,
+                   public_endpoint: Optional[str] = None) -> Instance:
     """
     Creates a new OpenVPN instance.
     """
@@ -179,6 +223,8 @@ def create_instance(name: str, port: int, subnet: str, protocol: str = "udp",
     if not re.fullmatch(name_regex, name):
         raise ValueError("Il nome dell'istanza può contenere solo lettere, numeri e trattini.")
 
+    public_endpoint = _validate_public_endpoint(public_endpoint)
+
     try:
         new_subnet = ip_network(subnet, strict=False)
         if not new_subnet.is_private:
@@ -241,6 +287,7 @@ def create_instance(name: str, port: int, subnet: str, protocol: str = "udp",
         tunnel_mode=tunnel_mode,
         routes=routes,
         dns_servers=dns_servers,
+        public_endpoint=public_endpoint,
         status="stopped"
     )
     
@@ -258,8 +305,8 @@ def create_instance(name: str, port: int, subnet: str, protocol: str = "udp",
     service_name = _get_service_name(new_instance)
     try:
         logger.info(f"Enabling and starting systemd service: {service_name}")
-        subprocess.run(["/usr/bin/systemctl", "enable", service_name], check=True)
-        subprocess.run(["/usr/bin/systemctl", "start", service_name], check=True)
+        metrics.run(["/usr/bin/systemctl", "enable", service_name], check=True)
+        metrics.run(["/usr/bin/systemctl", "start", service_name], check=True)
         new_instance.status = "running"
     except subprocess.CalledProcessError as e:
         # Clean up if start fails
@@ -279,7 +326,7 @@ def create_instance(name: str, port: int, subnet: str, protocol: str = "udp",
             iptables_manager.add_forwarding_rule(subnet, route_network)
     
     # Persist iptables rules
-    _save_iptables_rules()
+    save_iptables_rules()
 
     # Save
     instances.append(new_instance)
@@ -295,8 +342,8 @@ def delete_instance(instance_id: str):
 
     # Stop Service
     service_name = _get_service_name(inst)
-    subprocess.run(["/usr/bin/systemctl", "stop", service_name], check=False)
-    subprocess.run(["/usr/bin/systemctl", "disable", service_name], check=False)
+    metrics.run(["/usr/bin/systemctl", "stop", service_name], check=False)
+    metrics.run(["/usr/bin/systemctl", "disable", service_name], check=False)
 
     # Remove iptables
     iptables_manager.remove_openvpn_rules(inst.port, inst.protocol, inst.tun_interface, inst.subnet)
@@ -308,13 +355,19 @@ def delete_instance(instance_id: str):
             iptables_manager.remove_forwarding_rule(inst.subnet, route_network)
     
     # Persist iptables rules
-    _save_iptables_rules()
+    save_iptables_rules()
 
     # Remove Config
     config_path = os.path.join(OPENVPN_CONFIG_DIR, f"server_{inst.name}.conf")
     if os.path.exists(config_path):
         os.remove(config_path)
 
+    # Remove the traffic history, or an instance created later with the same name inherits it
+    try:
+        traffic_archive.remove(inst.name)
+    except OSError as e:
+        logger.error(f"Failed to remove traffic archive of '{inst.name}': {e}")
+
     # Remove from registry
     instances = [i for i in instances if i.id != instance_id]
     _save_instances(instances)
@@ -393,13 +446,13 @@ def update_instance_routes(instance_id: str, tunnel_mode: str, routes: List[Dict
             iptables_manager.add_forwarding_rule(instance.subnet, route_network)
     
     # Persist iptables
-    _save_iptables_rules()
+    save_iptables_rules()
     
     # Restart OpenVPN service to apply changes
     service_name = _get_service_name(instance)
     try:
         logger.info(f"Restarting service: {service_name}")
-        subprocess.run(["/usr/bin/systemctl", "restart", service_name], check=True)
+        metrics.run(["/usr/bin/systemctl", "restart", service_name], check=True)
         logger.info("Service restarted successfully")
     except subprocess.CalledProcessError as e:
         logger.error(f"Failed to restart service: {e}")
@@ -417,14 +470,14 @@ def _generate_openvpn_config(instance: Instance):
     logger.info(f"Generating config for instance '{instance.name}'")
     
     # Use relative paths like the default server.conf
-    # Files are in /etc/openvpn/ directly
+    # Files are in OPENVPN_CONFIG_DIR directly
     ca_path = "ca.crt"
     
     # Find the actual server cert/key names (they have random names from Angristan script)
     server_cert = None
     server_key = None
     try:
-        for f in os.listdir("/etc/openvpn"):
+        for f in os.listdir(OPENVPN_CONFIG_DIR):
             if f.startswith("server_") and f.endswith(".crt"):
                 server_cert = f
             if f.startswith("server_") and f.endswith(".key"):
@@ -457,11 +510,11 @@ def _generate_openvpn_config(instance: Instance):
     elif cidr == '24': netmask = "255.255.255.0"
     
     # Ensure log directory exists
-    log_dir = "/var/log/openvpn"
+    log_dir = OPENVPN_LOG_DIR
     os.makedirs(log_dir, exist_ok=True)
     
     # Ensure client-config-dir exists
-    ccd_dir = f"/etc/openvpn/ccd/{instance.name}"
+    ccd_dir = os.path.join(OPENVPN_CONFIG_DIR, "ccd", instance.name)
     os.makedirs(ccd_dir, exist_ok=True)
     
     # Base config (matching Angristan style)
@@ -497,7 +550,7 @@ def _generate_openvpn_config(instance: Instance):
     ]
     
     # Add tls-crypt if available
-    if os.path.exists(f"/etc/openvpn/{tls_crypt_path}"):
+    if os.path.exists(os.path.join(OPENVPN_CONFIG_DIR, tls_crypt_path)):
         config_lines.append(f"tls-crypt {tls_crypt_path}")
     
     # Client configuration directory
@@ -550,10 +603,17 @@ def _generate_openvpn_config(instance: Instance):
     config_lines.extend([
         "",
         "# Logging",
-        f"status {log_dir}/status_{instance.name}.log",
+        f"status {log_dir}/status_{instance.name}.log {STATUS_INTERVAL}",
         "status-version 2",
         "verb 3",
     ])
+
+    # Session accounting hooks (see session_log)
+    hook_lines = session_log.hook_config_lines(instance.name)
+    if hook_lines:
+        config_lines.append("")
+        config_lines.append("# Session accounting")
+        config_lines.extend(hook_lines)
     
     # Certificate revocation list
     config_lines.extend([
@@ -583,7 +643,7 @@ def _generate_openvpn_config(instance: Instance):
         os.chmod(config_path, 0o644)
         
         # Ensure CRL has correct permissions (using absolute path)
-        crl_absolute = f"/etc/openvpn/{crl_path}"
+        crl_absolute = os.path.join(OPENVPN_CONFIG_DIR, crl_path)
         if os.path.exists(crl_absolute):
             os.chmod(crl_absolute, 0o644)
             logger.info(f"Set CRL permissions: {crl_absolute}")
@@ -647,5 +707,19 @@ def update_instance_firewall_policy(instance_id: str, new_policy: str) -> Instan
     logger.info(f"Updated firewall policy for instance '{instance_id}' to '{new_policy}'.")
     return found_instance
 
+def update_instance_endpoint(instance_id: str, public_endpoint: Optional[str]) -> Instance:
+    """
+    Sets or clears the public endpoint override used in client configs.
+    Only affects configs generated afterwards; the server config is unchanged.
+    """
+    public_endpoint = _validate_public_endpoint(public_endpoint)
 
+    instances = _load_instances()
+    found_instance = next((i for i in instances if i.id == instance_id), None)
+    if not found_instance:
+        raise ValueError(f"Instance '{instance_id}' not found")
 
+    found_instance.public_endpoint = public_endpoint
+    _save_instances(instances)
+    logger.info(f"Updated public endpoint for instance '{instance_id}' to '{public_endpoint}'.")
+    return found_instance
@@ -0,0 +1,127 @@
+import os
+import time
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from ring_buffer import RingBuffer
+
+logger = logging.getLogger(__name__)
+
+SYS_CLASS_NET = "/sys/class/net"
+# Seconds between two counter reads
+INTERFACE_SAMPLE_INTERVAL = float(os.getenv("INTERFACE_SAMPLE_INTERVAL", "5"))
+# Samples kept per interface (default: 10 minutes at 5s)
+INTERFACE_HISTORY_SIZE = int(os.getenv("INTERFACE_HISTORY_SIZE", "120"))
+
+COUNTERS = ("rx_bytes", "tx_bytes", "rx_packets", "tx_packets")
+RATES = ("rx_bps", "tx_bps", "rx_pps", "tx_pps")
+
+def read_counters(name: str) -> Optional[List[int]]:
+    """Reads the sysfs statistics of an interface, in COUNTERS order. None if it disappeared."""
+    base = os.path.join(SYS_CLASS_NET, name, "statistics")
+    values = []
+    try:
+        for counter in COUNTERS:
+            with open(os.path.join(base, counter)) as f:
+                values.append(int(f.read()))
+    except (OSError, ValueError):
+        return None
+    return values
+
+class _InterfaceSeries:
+    __slots__ = ("counters", "timestamp", "times", "rates")
+
+    def __init__(self, counters: List[int], timestamp: float, size: int):
+        self.counters = counters
+        self.timestamp = timestamp
+        self.times = RingBuffer(size, "d")
+        self.rates = [RingBuffer(size, "f") for _ in RATES]
+
+class InterfaceSampler:
+    """
+    Samples rx/tx byte and packet counters of every interface (tun* included) from
+    /sys/class/net at a fixed interval. Rates are kept in fixed-size ring buffers, so
+    memory does not grow and reads never spawn a process.
+    """
+    def __init__(self, interval: float = INTERFACE_SAMPLE_INTERVAL, history_size: int = INTERFACE_HISTORY_SIZE):
+        self.interval = interval
+        self.history_size = history_size
+        self._series: Dict[str, _InterfaceSeries] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name="interface-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        stop = threading.Event()
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Interface sampling failed: {e}")
+            stop.wait(self.interval)
+
+    def sample(self):
+        """Reads all counters once and appends the rates since the previous read."""
+        try:
+            names = os.listdir(SYS_CLASS_NET)
+        except OSError as e:
+            logger.warning(f"Cannot list {SYS_CLASS_NET}: {e}")
+            return
+
+        now = time.monotonic()
+        wall = time.time()
+        with self._lock:
+            for name in names:
+                counters = read_counters(name)
+                if counters is None:
+                    continue
+                series = self._series.get(name)
+                if series is None:
+                    self._series[name] = _InterfaceSeries(counters, now, self.history_size)
+                    continue
+
+                elapsed = now - series.timestamp
+                if elapsed <= 0:
+                    continue
+                for i, value in enumerate(counters):
+                    # A counter going backwards means the interface was recreated (e.g. tun restart)
+                    delta = value - series.counters[i]
+                    rate = delta / elapsed if delta >= 0 else 0.0
+                    if i < 2:
+                        rate *= 8  # bytes -> bits
+                    series.rates[i].append(rate)
+                series.times.append(wall)
+                series.counters = counters
+                series.timestamp = now
+
+            for name in [n for n in self._series if n not in names]:
+                del self._series[name]
+
+    def get(self, name: str, history: int = 0) -> Optional[Dict]:
+        """Current rates (bit/s, packets/s) and cumulative counters; with `history`, the last N samples."""
+        with self._lock:
+            series = self._series.get(name)
+            if series is None:
+                return None
+            result = {counter: series.counters[i] for i, counter in enumerate(COUNTERS)}
+            for i, rate in enumerate(RATES):
+                result[rate] = round(series.rates[i].last(0.0), 1)
+            if history:
+                result["history"] = {
+                    "timestamps": series.times.values(history),
+                    **{rate: [round(v, 1) for v in series.rates[i].values(history)] for i, rate in enumerate(RATES)},
+                }
+            return result
+
+    def get_all(self, history: int = 0) -> Dict[str, Dict]:
+        with self._lock:
+            names = list(self._series)
+        return {name: stats for name in names if (stats := self.get(name, history)) is not None}
+
+interface_sampler = InterfaceSampler()
@@ -0,0 +1,99 @@
+import threading
+import logging
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bidirectional client <-> IP index shared by the firewall compiler, traffic
+# attribution and the API.
+# - static: addresses assigned through CCD files (kept in sync by ip_manager)
+# - session: current virtual addresses from the status logs (kept in sync by vpn_manager)
+# Keys are (instance_name, client_name).
+
+_lock = threading.Lock()
+_static_by_client: Dict[Tuple[str, str], str] = {}
+_static_by_ip: Dict[str, Tuple[str, str]] = {}
+_session_by_client: Dict[Tuple[str, str], str] = {}
+_session_by_ip: Dict[str, Tuple[str, str]] = {}
+
+def _replace(by_client: Dict, by_ip: Dict, instance_name: str, mapping: Dict[str, str]):
+    for key in [k for k in by_client if k[0] == instance_name]:
+        ip = by_client.pop(key)
+        if by_ip.get(ip) == key:
+            del by_ip[ip]
+    for client_name, ip in mapping.items():
+        key = (instance_name, client_name)
+        by_client[key] = ip
+        by_ip[ip] = key
+
+# --- Static (CCD) ---
+
+def replace_static(instance_name: str, mapping: Dict[str, str]):
+    """Replaces all static assignments of an instance (called on allocator rebuild)."""
+    with _lock:
+        _replace(_static_by_client, _static_by_ip, instance_name, mapping)
+
+def set_static(instance_name: str, client_name: str, ip: str):
+    key = (instance_name, client_name)
+    with _lock:
+        old_ip = _static_by_client.get(key)
+        if old_ip and _static_by_ip.get(old_ip) == key:
+            del _static_by_ip[old_ip]
+        _static_by_client[key] = ip
+        _static_by_ip[ip] = key
+
+def remove_static(instance_name: str, client_name: str):
+    key = (instance_name, client_name)
+    with _lock:
+        ip = _static_by_client.pop(key, None)
+        if ip and _static_by_ip.get(ip) == key:
+            del _static_by_ip[ip]
+
+def get_static_ip(instance_name: str, client_name: str) -> Optional[str]:
+    return _static_by_client.get((instance_name, client_name))
+
+# --- Sessions (status log / connect events) ---
+
+def replace_sessions(instance_name: str, mapping: Dict[str, str]):
+    """Replaces the live virtual addresses of an instance (called on status log reparse)."""
+    with _lock:
+        _replace(_session_by_client, _session_by_ip, instance_name, mapping)
+
+def set_session(instance_name: str, client_name: str, ip: str):
+    key = (instance_name, client_name)
+    with _lock:
+        old_ip = _session_by_client.get(key)
+        if old_ip and _session_by_ip.get(old_ip) == key:
+            del _session_by_ip[old_ip]
+        _session_by_client[key] = ip
+        _session_by_ip[ip] = key
+
+def remove_session(instance_name: str, client_name: str):
+    key = (instance_name, client_name)
+    with _lock:
+        ip = _session_by_client.pop(key, None)
+        if ip and _session_by_ip.get(ip) == key:
+            del _session_by_ip[ip]
+
+def get_session_ip(instance_name: str, client_name: str) -> Optional[str]:
+    return _session_by_client.get((instance_name, client_name))
+
+# --- Lookups ---
+
+def lookup_ip(ip: str) -> Optional[Dict]:
+    """Answers "who is <ip>": the owner of the static assignment and/or of the live session."""
+    static = _static_by_ip.get(ip)
+    session = _session_by_ip.get(ip)
+    if not static and not session:
+        return None
+    return {
+        "ip": ip,
+        "static": {"instance_name": static[0], "client_name": static[1]} if static else None,
+        "session": {"instance_name": session[0], "client_name": session[1]} if session else None,
+    }
+
+def get_client_addresses(instance_name: str, client_name: str) -> Dict[str, Optional[str]]:
+    return {
+        "static_ip": get_static_ip(instance_name, client_name),
+        "session_ip": get_session_ip(instance_name, client_name),
+    }
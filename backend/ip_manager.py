@@ -1,13 +1,27 @@
 import os
+import re
+import json
+import fcntl
 import logging
 import ipaddress
-from typing import Optional, List
+import threading
+from contextlib import contextmanager
+from typing import Optional, List, Dict, Tuple
+import metrics
+import ip_index
 
 logger = logging.getLogger(__name__)
 
 # Directory where CCD files are stored (OpenVPN Client Config Directory)
 # Structure: /etc/openvpn/ccd/<instance_name>/<client_name>
-CCD_BASE_DIR = "/etc/openvpn/ccd"
+CCD_BASE_DIR = os.path.join(os.getenv("OPENVPN_CONFIG_DIR", "/etc/openvpn"), "ccd")
+
+# Explicit per-instance reservations (gateway ranges, appliances, ...)
+# Structure: {"<instance_name>": ["10.8.0.2-10.8.0.10", "10.8.0.128/28", "10.8.0.254"]}
+RESERVATIONS_FILE = os.path.join(os.getenv("DATA_DIR", "/opt/vpn-manager/backend/data"), "ip_reservations.json")
+
+# Matches any byte of the bitmap that still has a free bit
+_FREE_BYTE = re.compile(b"[^\xff]")
 
 def _get_ccd_dir(instance_name: str) -> str:
     return os.path.join(CCD_BASE_DIR, instance_name)
@@ -15,82 +29,352 @@ def _get_ccd_dir(instance_name: str) -> str:
 def _get_ccd_path(instance_name: str, client_name: str) -> str:
     return os.path.join(_get_ccd_dir(instance_name), client_name)
 
+def _dir_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_ino
+    except OSError:
+        return None
+
+def _read_ccd_ip(path: str) -> Optional[str]:
+    try:
+        with open(path, "r") as f:
+            # format: ifconfig-push <ip> <netmask>
+            parts = f.read().strip().split()
+            if len(parts) >= 2 and parts[0] == "ifconfig-push":
+                return parts[1]
+    except Exception as e:
+        logger.error(f"Error reading CCD file {path}: {e}")
+    return None
+
 def get_assigned_ip(instance_name: str, client_name: str) -> Optional[str]:
     """Reads the CCD file to find the assigned static IP."""
     path = _get_ccd_path(instance_name, client_name)
     if os.path.exists(path):
+        return _read_ccd_ip(path)
+    return None
+
+# --- Reservations ---
+
+def _load_reservations() -> Dict[str, List[str]]:
+    if os.path.exists(RESERVATIONS_FILE):
         try:
-            with open(path, "r") as f:
-                content = f.read()
-                # format: ifconfig-push <ip> <netmask>
-                parts = content.strip().split()
-                if len(parts) >= 2 and parts[0] == "ifconfig-push":
-                    return parts[1]
+            with open(RESERVATIONS_FILE, "r") as f:
+                return json.load(f)
         except Exception as e:
-            logger.error(f"Error reading CCD file for {client_name}: {e}")
-    return None
+            logger.error(f"Error loading IP reservations: {e}")
+    return {}
+
+def _save_reservations(reservations: Dict[str, List[str]]):
+    os.makedirs(os.path.dirname(RESERVATIONS_FILE), exist_ok=True)
+    with open(RESERVATIONS_FILE, "w") as f:
+        json.dump(reservations, f, indent=4)
+
+def _parse_reservation(spec: str) -> Tuple[ipaddress.IPv4Address, ipaddress.IPv4Address]:
+    """Parses "a.b.c.d", "a.b.c.d/nn" or "a.b.c.d-e.f.g.h" into an inclusive (first, last) range."""
+    spec = spec.strip()
+    try:
+        if "-" in spec:
+            first, last = (ipaddress.IPv4Address(p.strip()) for p in spec.split("-", 1))
+        elif "/" in spec:
+            net = ipaddress.IPv4Network(spec, strict=False)
+            first, last = net.network_address, net.broadcast_address
+        else:
+            first = last = ipaddress.IPv4Address(spec)
+    except ValueError:
+        raise ValueError(f"Prenotazione IP non valida: '{spec}'. Usare un IP, una CIDR o un intervallo 'a-b'.")
+    if first > last:
+        raise ValueError(f"Intervallo IP non valido: '{spec}'.")
+    return first, last
+
+def get_reservations(instance_name: str) -> List[str]:
+    return _load_reservations().get(instance_name, [])
+
+def add_reservation(instance_name: str, subnet: str, spec: str) -> List[str]:
+    """Adds an explicit reservation. Fails if it overlaps an address already assigned to a client."""
+    first, last = _parse_reservation(spec)
+    network = ipaddress.IPv4Network(subnet, strict=False)
+    if first not in network or last not in network:
+        raise ValueError(f"La prenotazione '{spec}' non appartiene alla subnet {subnet}.")
+
+    allocator = get_allocator(instance_name, subnet)
+    with allocator.locked():
+        conflicts = allocator.owners_in_range(first, last)
+        if conflicts:
+            raise ValueError(f"La prenotazione '{spec}' include IP già assegnati: {', '.join(sorted(conflicts))}.")
+
+        reservations = _load_reservations()
+        specs = reservations.setdefault(instance_name, [])
+        if spec not in specs:
+            specs.append(spec)
+            _save_reservations(reservations)
+        allocator.reserve_range(first, last)
+    return specs
+
+def remove_reservation(instance_name: str, subnet: str, spec: str) -> List[str]:
+    reservations = _load_reservations()
+    specs = reservations.get(instance_name, [])
+    if spec not in specs:
+        raise ValueError(f"Prenotazione '{spec}' non trovata.")
+    specs.remove(spec)
+    _save_reservations(reservations)
+    # Reserved bits can overlap each other and the defaults: rebuild from scratch
+    get_allocator(instance_name, subnet).rebuild()
+    return specs
+
+# --- Allocator ---
+
+class SubnetAllocator:
+    """
+    Static IP allocator for one instance, backed by a bitmap with one bit per address
+    of the subnet (2 MB for a /8). The next-free search starts from a moving hint and
+    skips full bytes with a C-level regex scan, so allocations are O(1) amortized.
+    The bitmap is rebuilt from the CCD directory on first use or when the directory
+    changes outside this allocator (drift).
+    """
+    def __init__(self, instance_name: str, subnet: str):
+        self.instance_name = instance_name
+        self.subnet = subnet
+        self.network = ipaddress.IPv4Network(subnet, strict=False)
+        self.base = int(self.network.network_address)
+        self.size = self.network.num_addresses
+        self.ccd_dir = _get_ccd_dir(instance_name)
+        self._lock = threading.Lock()
+        self._bitmap = bytearray()
+        self._owners: Dict[str, int] = {} # client_name -> offset
+        self._hint = 0
+        self._stamp = None
+
+    # -- bit helpers --
+    def _mark(self, offset: int):
+        self._bitmap[offset >> 3] |= 1 << (offset & 7)
+
+    def _unmark(self, offset: int):
+        self._bitmap[offset >> 3] &= ~(1 << (offset & 7)) & 0xFF
+
+    def _offset(self, ip) -> Optional[int]:
+        offset = int(ipaddress.IPv4Address(ip)) - self.base
+        return offset if 0 <= offset < self.size else None
+
+    def _ip(self, offset: int) -> str:
+        return str(ipaddress.IPv4Address(self.base + offset))
+
+    @contextmanager
+    def locked(self):
+        """Thread lock plus an flock on the CCD directory, so other processes cannot race us."""
+        with self._lock:
+            os.makedirs(self.ccd_dir, exist_ok=True)
+            lock_path = os.path.join(CCD_BASE_DIR, f".{self.instance_name}.lock")
+            with open(lock_path, "w") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    if self._stamp is None or _dir_stamp(self.ccd_dir) != self._stamp:
+                        metrics.cache_miss("ccd_allocator")
+                        self._rebuild_locked()
+                    else:
+                        metrics.cache_hit("ccd_allocator")
+                    yield self
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def rebuild(self):
+        with self.locked():
+            self._rebuild_locked()
+
+    def _rebuild_locked(self):
+        self._bitmap = bytearray((self.size + 7) // 8)
+        # Padding bits past the end of the subnet are never free
+        if self.size < len(self._bitmap) * 8:
+            self._mark_range(self.size, len(self._bitmap) * 8 - 1)
+        self._owners = {}
+        self._hint = 0
+
+        # Network, broadcast and server address (OpenVPN "server" takes the first host)
+        # TODO: Pass server IP explicitly if different.
+        if self.size > 2:
+            self._mark(0)
+            self._mark(self.size - 1)
+            self._mark(1)
+
+        for spec in get_reservations(self.instance_name):
+            try:
+                self.reserve_range(*_parse_reservation(spec))
+            except ValueError as e:
+                logger.warning(f"Ignoring reservation for {self.instance_name}: {e}")
+
+        if os.path.isdir(self.ccd_dir):
+            with os.scandir(self.ccd_dir) as entries:
+                for entry in entries:
+                    if not entry.is_file() or entry.name.startswith("."):
+                        continue
+                    ip = _read_ccd_ip(entry.path)
+                    offset = self._offset(ip) if ip else None
+                    if offset is None:
+                        continue
+                    self._mark(offset)
+                    self._owners[entry.name] = offset
+
+        self._stamp = _dir_stamp(self.ccd_dir)
+        ip_index.replace_static(self.instance_name, self.client_ips_locked())
+        logger.info(f"Rebuilt IP allocator for {self.instance_name}: {len(self._owners)} assigned in {self.subnet}")
+
+    def _mark_range(self, start: int, end: int):
+        """Marks offsets start..end (inclusive), filling whole bytes with slice assignment."""
+        while start <= end and start & 7:
+            self._mark(start)
+            start += 1
+        while end >= start and (end + 1) & 7:
+            self._mark(end)
+            end -= 1
+        if start <= end:
+            self._bitmap[start >> 3:(end + 1) >> 3] = b"\xff" * ((end + 1 - start) >> 3)
+
+    def client_ips_locked(self) -> Dict[str, str]:
+        return {name: self._ip(offset) for name, offset in self._owners.items()}
+
+    def client_ips(self) -> Dict[str, str]:
+        """Returns {client_name: static_ip}, resyncing from the CCD directory if it drifted."""
+        with self.locked():
+            return self.client_ips_locked()
+
+    def reserve_range(self, first: ipaddress.IPv4Address, last: ipaddress.IPv4Address):
+        start = max(int(first) - self.base, 0)
+        end = min(int(last) - self.base, self.size - 1)
+        if start <= end:
+            self._mark_range(start, end)
+
+    def owners_in_range(self, first: ipaddress.IPv4Address, last: ipaddress.IPv4Address) -> List[str]:
+        start, end = int(first) - self.base, int(last) - self.base
+        return [f"{name} ({self._ip(o)})" for name, o in self._owners.items() if start <= o <= end]
+
+    def _next_free(self) -> Optional[int]:
+        for start in (self._hint >> 3, 0):
+            match = _FREE_BYTE.search(self._bitmap, start)
+            if match:
+                byte_index = match.start()
+                byte = self._bitmap[byte_index]
+                bit = (~byte & (byte + 1)).bit_length() - 1 # lowest zero bit
+                return (byte_index << 3) + bit
+        return None
+
+    def _write_ccd(self, client_name: str, ip: str):
+        content = f"ifconfig-push {ip} {self.network.netmask}\n"
+        ccd_path = _get_ccd_path(self.instance_name, client_name)
+        tmp_path = os.path.join(self.ccd_dir, f".{client_name}.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, ccd_path)
+
+    def allocate_many(self, client_names: List[str]) -> Dict[str, Optional[str]]:
+        """
+        Assigns an IP to each client in a single locked pass and writes their CCD files.
+        Clients that already have an address keep it. Missing entries map to None.
+        """
+        result: Dict[str, Optional[str]] = {}
+        with self.locked():
+            for client_name in client_names:
+                if client_name in self._owners:
+                    result[client_name] = self._ip(self._owners[client_name])
+                    continue
+
+                offset = self._next_free()
+                if offset is None:
+                    logger.error(f"No available IPs in subnet {self.subnet} for instance {self.instance_name}")
+                    result[client_name] = None
+                    continue
+
+                ip_str = self._ip(offset)
+                try:
+                    self._write_ccd(client_name, ip_str)
+                except Exception as e:
+                    logger.error(f"Failed to write CCD file for {client_name}: {e}")
+                    result[client_name] = None
+                    continue
+
+                self._mark(offset)
+                self._owners[client_name] = offset
+                self._hint = offset + 1
+                ip_index.set_static(self.instance_name, client_name, ip_str)
+                result[client_name] = ip_str
+                logger.info(f"Allocated static IP {ip_str} to {client_name} in {self.instance_name}")
+            self._stamp = _dir_stamp(self.ccd_dir)
+        return result
+
+    def release_many(self, client_names: List[str]):
+        with self.locked():
+            for client_name in client_names:
+                path = _get_ccd_path(self.instance_name, client_name)
+                if os.path.exists(path):
+                    try:
+                        os.remove(path)
+                        logger.info(f"Released static IP for {client_name} in {self.instance_name}")
+                    except Exception as e:
+                        logger.error(f"Failed to remove CCD file for {client_name}: {e}")
+                        continue
+                ip_index.remove_static(self.instance_name, client_name)
+                offset = self._owners.pop(client_name, None)
+                if offset is not None:
+                    self._unmark(offset)
+                    self._hint = min(self._hint, offset)
+            self._stamp = _dir_stamp(self.ccd_dir)
+
+_allocators: Dict[str, SubnetAllocator] = {}
+_allocators_lock = threading.Lock()
+
+def get_allocator(instance_name: str, subnet: str) -> SubnetAllocator:
+    """Returns the allocator of an instance, creating it if missing or if the subnet changed."""
+    with _allocators_lock:
+        allocator = _allocators.get(instance_name)
+        if allocator is None or allocator.subnet != subnet:
+            allocator = SubnetAllocator(instance_name, subnet)
+            _allocators[instance_name] = allocator
+        return allocator
 
 def allocate_static_ip(instance_name: str, subnet: str, client_name: str) -> Optional[str]:
     """
     Allocates the next available static IP from the subnet and writes it to the CCD file.
     Returns the allocated IP or None if subnet is full.
     """
-    ccd_dir = _get_ccd_dir(instance_name)
-    os.makedirs(ccd_dir, exist_ok=True)
-    
-    # 1. Parse Subnet
     try:
-        network = ipaddress.ip_network(subnet, strict=False)
+        allocator = get_allocator(instance_name, subnet)
     except ValueError:
         logger.error(f"Invalid subnet: {subnet}")
         return None
+    return allocator.allocate_many([client_name])[client_name]
 
-    # 2. Find used IPs
-    used_ips = set()
-    used_ips.add(str(network.network_address)) # .0
-    used_ips.add(str(network.broadcast_address)) # .255 (or similar)
-    # OpenVPN server usually takes the first usable IP (.1)
-    # We assume server uses the first IP of the network. 
-    # TODO: Pass server IP explicitly if different.
-    server_ip = list(network.hosts())[0]
-    used_ips.add(str(server_ip))
-
-    # Scan existing CCD files
-    if os.path.exists(ccd_dir):
-        for fname in os.listdir(ccd_dir):
-            ip = get_assigned_ip(instance_name, fname)
-            if ip:
-                used_ips.add(ip)
-
-    # 3. Find next free IP
-    # We skip the first one (.1) as it is likely the server
-    for ip in network.hosts():
-        ip_str = str(ip)
-        if ip_str not in used_ips:
-            # Found one!
-            netmask = str(network.netmask)
-            
-            # Write CCD
-            content = f"ifconfig-push {ip_str} {netmask}\n"
-            ccd_path = _get_ccd_path(instance_name, client_name)
-            try:
-                with open(ccd_path, "w") as f:
-                    f.write(content)
-                logger.info(f"Allocated static IP {ip_str} to {client_name} in {instance_name}")
-                return ip_str
-            except Exception as e:
-                logger.error(f"Failed to write CCD file for {client_name}: {e}")
-                return None
-    
-    logger.error(f"No available IPs in subnet {subnet} for instance {instance_name}")
-    return None
+def allocate_static_ips(instance_name: str, subnet: str, client_names: List[str]) -> Dict[str, Optional[str]]:
+    """Bulk variant of allocate_static_ip: one lock acquisition for all clients."""
+    try:
+        allocator = get_allocator(instance_name, subnet)
+    except ValueError:
+        logger.error(f"Invalid subnet: {subnet}")
+        return {name: None for name in client_names}
+    return allocator.allocate_many(client_names)
+
+def get_static_ips(instance_name: str, subnet: str) -> Dict[str, str]:
+    """Returns {client_name: static_ip} for an instance without reading every CCD file."""
+    try:
+        return get_allocator(instance_name, subnet).client_ips()
+    except ValueError:
+        logger.error(f"Invalid subnet: {subnet}")
+        return {}
 
 def release_static_ip(instance_name: str, client_name: str):
     """Removes the CCD file, effectively releasing the IP."""
-    path = _get_ccd_path(instance_name, client_name)
-    if os.path.exists(path):
-        try:
-            os.remove(path)
-            logger.info(f"Released static IP for {client_name} in {instance_name}")
-        except Exception as e:
-            logger.error(f"Failed to remove CCD file for {client_name}: {e}")
+    release_static_ips(instance_name, [client_name])
+
+def release_static_ips(instance_name: str, client_names: List[str]):
+    allocator = _allocators.get(instance_name)
+    if allocator:
+        allocator.release_many(client_names)
+        return
+    # No allocator yet for this instance: just remove the files, it will rebuild on first use
+    for client_name in client_names:
+        ip_index.remove_static(instance_name, client_name)
+        path = _get_ccd_path(instance_name, client_name)
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+                logger.info(f"Released static IP for {client_name} in {instance_name}")
+            except Exception as e:
+                logger.error(f"Failed to remove CCD file for {client_name}: {e}")
@@ -1,15 +1,24 @@
+import re
 import subprocess
 import logging
 import uuid
-from typing import List, Union, Optional
+from ipaddress import ip_network
+from typing import List, Union, Optional, Tuple
+import metrics
+import network_utils
 
 logger = logging.getLogger(__name__)
 
 def _get_default_interface():
     """Detects the default network interface."""
+    # Cheapest source first: /proc/net/route, no subprocess
+    iface = network_utils.get_default_route_interface()
+    if iface:
+        return iface
+
     try:
         # Using `ip -o -4 route show default` is more reliable for default gateway interface
-        result = subprocess.run(["/usr/sbin/ip", "-o", "-4", "route", "show", "default"], capture_output=True, text=True, check=True)
+        result = metrics.run(["/usr/sbin/ip", "-o", "-4", "route", "show", "default"], capture_output=True, text=True, check=True)
         if result.stdout:
             parts = result.stdout.split()
             if "dev" in parts:
@@ -19,7 +28,7 @@ def _get_default_interface():
     
     # Fallback to older `route` command if `ip` fails or is not available in expected way
     try:
-        result = subprocess.run(["/sbin/route"], capture_output=True, text=True, check=False) # check=False because route can fail on some systems
+        result = metrics.run(["/sbin/route"], capture_output=True, text=True, check=False) # check=False because route can fail on some systems
         for line in result.stdout.splitlines():
             if "default" in line:
                 parts = line.split()
@@ -33,6 +42,10 @@ def _get_default_interface():
 
 DEFAULT_INTERFACE = _get_default_interface()
 
+# Per-client accounting chain (see traffic_accounting): its jump must stay first in FORWARD
+ACCOUNTING_CHAIN = "VPN_ACCT"
+ACCOUNTING_JUMP = f"-A FORWARD -j {ACCOUNTING_CHAIN}"
+
 class MachineFirewallRule:
     def __init__(self, id: str, chain: str, action: str,
                  protocol: Optional[str] = None,
@@ -85,7 +98,7 @@ def _run_iptables(table: str, args: List[str]):
     try:
         full_command_str = ' '.join(command)
         logger.debug(f"Executing iptables command: {full_command_str}")
-        subprocess.run(command, check=True, capture_output=True, text=True)
+        metrics.run(command, check=True, capture_output=True, text=True)
         return True, None
     except subprocess.CalledProcessError as e:
         full_command_str = ' '.join(command)
@@ -93,10 +106,25 @@ def _run_iptables(table: str, args: List[str]):
         logger.error(error_msg)
         return False, error_msg
 
+def _forward_top(forward_rules: Optional[List[str]] = None) -> str:
+    """
+    Position for rules inserted at the top of FORWARD: below the accounting jump, so the
+    traffic they accept is still counted. `forward_rules` are the "-A FORWARD" lines in
+    order (read with `iptables -S FORWARD` when not given).
+    """
+    if forward_rules is None:
+        try:
+            output = metrics.run(["/usr/sbin/iptables", "-S", "FORWARD"], check=True, capture_output=True, text=True).stdout
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.warning(f"Could not read the FORWARD chain: {e}")
+            return "1"
+        forward_rules = [line for line in output.splitlines() if line.startswith("-A FORWARD ")]
+    return "2" if forward_rules and forward_rules[0] == ACCOUNTING_JUMP else "1"
+
 def _run_iptables_save():
     """Saves current iptables rules."""
     try:
-        subprocess.run(["/usr/sbin/iptables-save"], check=True, capture_output=True, text=True)
+        metrics.run(["/usr/sbin/iptables-save"], check=True, capture_output=True, text=True)
         return True, None
     except subprocess.CalledProcessError as e:
         error_msg = f"iptables-save error: {e.stderr.strip()}"
@@ -161,9 +189,14 @@ def _build_iptables_args_from_rule(rule: MachineFirewallRule, operation: str = "
 
     return args
 
-def add_machine_firewall_rule(rule: MachineFirewallRule) -> (bool, Optional[str]):
-    """Adds a new generic machine-level iptables rule by inserting it at the top."""
+def add_machine_firewall_rule(rule: MachineFirewallRule, forward_top: Optional[str] = None) -> (bool, Optional[str]):
+    """
+    Adds a new generic machine-level iptables rule by inserting it at the top.
+    filter/FORWARD rules go below the accounting jump (`forward_top`, read when not given).
+    """
     args = _build_iptables_args_from_rule(rule, operation="-I")
+    if rule.table == "filter" and rule.chain == "FORWARD":
+        args.insert(2, forward_top or _forward_top())
     return _run_iptables(rule.table, args)
 
 def delete_machine_firewall_rule(rule: MachineFirewallRule) -> (bool, Optional[str]):
@@ -182,7 +215,7 @@ def clear_machine_firewall_rules_by_comment_prefix(table: str = "filter", commen
         # Use iptables -S which shows full rule specification for easier parsing.
         list_command = ["/usr/sbin/iptables", "-t", table, "-S"]
         logger.debug(f"Executing iptables list command: {' '.join(list_command)}")
-        result = subprocess.run(list_command, check=True, capture_output=True, text=True)
+        result = metrics.run(list_command, check=True, capture_output=True, text=True)
         
         lines = result.stdout.splitlines()
         rules_to_delete_args = []
@@ -228,6 +261,13 @@ def apply_machine_firewall_rules(rules: List[MachineFirewallRule]):
     """
     Clears all manager-added rules and applies the given set of machine-level iptables rules.
     """
+    with metrics.firewall_apply_duration.time(("machine",)):
+        success, error_message = _apply_machine_firewall_rules(rules)
+    if success:
+        metrics.firewall_rules.set(("machine",), len(rules))
+    return success, error_message
+
+def _apply_machine_firewall_rules(rules: List[MachineFirewallRule]):
     success = True
     error_message = None
 
@@ -247,9 +287,10 @@ def apply_machine_firewall_rules(rules: List[MachineFirewallRule]):
     # Apply new rules, sorted by order, in reverse.
     # By using -I (insert at top) in reverse order, the final list is in the correct order.
     rules.sort(key=lambda r: r.order)
+    forward_top = _forward_top() if any(r.table == "filter" and r.chain == "FORWARD" for r in rules) else None
 
     for rule in reversed(rules):
-        rule_add_success, rule_add_error = add_machine_firewall_rule(rule)
+        rule_add_success, rule_add_error = add_machine_firewall_rule(rule, forward_top)
         if not rule_add_success:
             logger.error(f"Failed to apply rule {rule.id}: {rule_add_error}")
             success = False
@@ -272,12 +313,13 @@ def add_openvpn_rules(port: int, proto: str, tun_interface: str, subnet: str, ou
     _run_iptables("filter", ["-I", "INPUT", "-p", proto, "--dport", str(port), "-j", "ACCEPT"])
 
     # 2. Allow traffic from TUN interface
+    top = _forward_top()
     _run_iptables("filter", ["-I", "INPUT", "-i", tun_interface, "-j", "ACCEPT"])
-    _run_iptables("filter", ["-I", "FORWARD", "-i", tun_interface, "-j", "ACCEPT"])
+    _run_iptables("filter", ["-I", "FORWARD", top, "-i", tun_interface, "-j", "ACCEPT"])
 
     # 3. Allow forwarding from TUN to WAN
-    _run_iptables("filter", ["-I", "FORWARD", "-i", tun_interface, "-o", outgoing_interface, "-m", "state", "--state", "RELATED,ESTABLISHED", "-j", "ACCEPT"])
-    _run_iptables("filter", ["-I", "FORWARD", "-i", outgoing_interface, "-o", tun_interface, "-m", "state", "--state", "RELATED,ESTABLISHED", "-j", "ACCEPT"])
+    _run_iptables("filter", ["-I", "FORWARD", top, "-i", tun_interface, "-o", outgoing_interface, "-m", "state", "--state", "RELATED,ESTABLISHED", "-j", "ACCEPT"])
+    _run_iptables("filter", ["-I", "FORWARD", top, "-i", outgoing_interface, "-o", tun_interface, "-m", "state", "--state", "RELATED,ESTABLISHED", "-j", "ACCEPT"])
 
     # 4. Masquerade (NAT) traffic from VPN subnet
     _run_iptables("nat", ["-I", "POSTROUTING", "-s", subnet, "-o", outgoing_interface, "-j", "MASQUERADE"])
@@ -310,7 +352,86 @@ def add_forwarding_rule(source_subnet: str, dest_network: str):
     Adds a forwarding rule to allow traffic from a VPN subnet to a specific destination network.
     """
     # Example: iptables -I FORWARD -s 10.8.0.0/24 -d 192.168.1.0/24 -j ACCEPT
-    return _run_iptables("filter", ["-I", "FORWARD", "-s", source_subnet, "-d", dest_network, "-j", "ACCEPT"])
+    return _run_iptables("filter", ["-I", "FORWARD", _forward_top(), "-s", source_subnet, "-d", dest_network, "-j", "ACCEPT"])
 
 def remove_forwarding_rule(source_subnet: str, dest_network: str):
     return _run_iptables("filter", ["-D", "FORWARD", "-s", source_subnet, "-d", dest_network, "-j", "ACCEPT"])
+
+def _uplink_rule_patterns(tun_interface: str, subnet: str) -> List[Tuple[str, re.Pattern, str]]:
+    """
+    (table, regex on iptables-save lines, template) for the rules of an instance that
+    reference the outgoing interface, as created by add_openvpn_rules.
+    """
+    subnet = str(ip_network(subnet, strict=False))
+    state = "-m state --state RELATED,ESTABLISHED -j ACCEPT"
+    tun = re.escape(tun_interface)
+    return [
+        ("filter", re.compile(rf"^-A FORWARD -i {tun} -o (\S+) {re.escape(state)}$"),
+         f"FORWARD -i {tun_interface} -o {{iface}} {state}"),
+        ("filter", re.compile(rf"^-A FORWARD -i (\S+) -o {tun} {re.escape(state)}$"),
+         f"FORWARD -i {{iface}} -o {tun_interface} {state}"),
+        ("nat", re.compile(rf"^-A POSTROUTING -s {re.escape(subnet)} -o (\S+) -j MASQUERADE$"),
+         f"POSTROUTING -s {subnet} -o {{iface}} -j MASQUERADE"),
+    ]
+
+def sync_openvpn_uplink(instances: List[Tuple[str, str]], outgoing_interface: str) -> Tuple[bool, int]:
+    """
+    Moves the NAT/forward rules of each instance, given as (tun_interface, subnet), to
+    outgoing_interface. Only rules pointing at a different interface are touched, and all
+    changes are applied in a single `iptables-restore --noflush` transaction.
+    Returns (success, number of rules moved).
+    """
+    try:
+        saved = metrics.run(["/usr/sbin/iptables-save"], check=True, capture_output=True, text=True).stdout
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error(f"iptables-save failed while syncing uplink rules: {e}")
+        return False, 0
+
+    lines_by_table = {}
+    forward_rules = []
+    table = None
+    for line in saved.splitlines():
+        if line.startswith("*"):
+            table = line[1:]
+        elif line.startswith("-A ") and table:
+            lines_by_table.setdefault(table, set()).add(line)
+            if table == "filter" and line.startswith("-A FORWARD "):
+                forward_rules.append(line)
+    forward_top = _forward_top(forward_rules)
+
+    commands = {"filter": [], "nat": []}
+    moved = 0
+    for tun_interface, subnet in instances:
+        for rule_table, pattern, template in _uplink_rule_patterns(tun_interface, subnet):
+            present = lines_by_table.get(rule_table, set())
+            target = template.format(iface=outgoing_interface)
+            for line in present:
+                match = pattern.match(line)
+                if not match or match.group(1) == outgoing_interface:
+                    continue
+                commands[rule_table].append(f"-D {line[3:]}")
+                if f"-A {target}" not in present:
+                    chain, spec = target.split(" ", 1)
+                    position = f" {forward_top}" if chain == "FORWARD" else ""
+                    commands[rule_table].append(f"-I {chain}{position} {spec}")
+                    present = present | {f"-A {target}"}
+                moved += 1
+
+    if not moved:
+        return True, 0
+
+    payload = ""
+    for rule_table, table_commands in commands.items():
+        if table_commands:
+            payload += f"*{rule_table}\n" + "\n".join(table_commands) + "\nCOMMIT\n"
+    try:
+        metrics.run(["/usr/sbin/iptables-restore", "--noflush"], input=payload, check=True, capture_output=True, text=True)
+    except subprocess.CalledProcessError as e:
+        logger.error(f"iptables-restore failed while moving uplink rules to {outgoing_interface}: {e.stderr.strip()}")
+        return False, 0
+    except OSError as e:
+        logger.error(f"iptables-restore not available: {e}")
+        return False, 0
+
+    logger.info(f"Moved {moved} OpenVPN uplink rules to interface {outgoing_interface}.")
+    return True, moved
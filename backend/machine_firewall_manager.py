@@ -10,7 +10,7 @@ from iptables_manager import MachineFirewallRule, apply_machine_firewall_rules
 logger = logging.getLogger(__name__)
 
 # Directory where configuration files are stored
-CONFIG_DIR = "/opt/vpn-manager/config"
+CONFIG_DIR = os.getenv("CONFIG_DIR", "/opt/vpn-manager/config")
 MACHINE_FIREWALL_RULES_FILE = os.path.join(CONFIG_DIR, "machine_firewall_rules.json")
 
 class MachineFirewallManager:
@@ -139,7 +139,8 @@ class MachineFirewallManager:
             rule_to_update.protocol = rule_to_update.protocol.lower()
         rule_to_update.source = rule_data.get('source', rule_to_update.source)
         rule_to_update.destination = rule_data.get('destination', rule_to_update.destination)
-        rule_to_update.port = rule_data.get('port', rule_to_update.port)
+        port = rule_data.get('port', rule_to_update.port)
+        rule_to_update.port = str(port) if port else None # as in MachineFirewallRule.__init__
         rule_to_update.in_interface = rule_data.get('in_interface', rule_to_update.in_interface)
         rule_to_update.out_interface = rule_data.get('out_interface', rule_to_update.out_interface)
         rule_to_update.state = rule_data.get('state', rule_to_update.state)
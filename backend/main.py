@@ -1,17 +1,41 @@
 import os
 import re
+import time
+import csv
+import json
+import ipaddress
+from contextlib import asynccontextmanager
 from typing import List, Optional, Dict, Union # Added Union
-from fastapi import FastAPI, HTTPException, Security, Depends
+from fastapi import FastAPI, HTTPException, Security, Depends, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security.api_key import APIKeyHeader
-from fastapi.responses import PlainTextResponse
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
 
 import vpn_manager
 import instance_manager
+import ip_manager
+import ip_index
+import versioning
+import metrics
+import tracing
 import network_utils
+import netplan_manager
 import firewall_manager as instance_firewall_manager # Renamed for clarity on instance-specific firewall
 from machine_firewall_manager import machine_firewall_manager # Will be created later
+from route_watcher import route_watcher
+from interface_sampler import interface_sampler
+from traffic_collector import traffic_collector
+from traffic_archive import traffic_archive
+from session_log import session_store, MAX_SESSION_RESULTS
+from traffic_accounting import traffic_accounting, MONTH_PATTERN
+from event_stream import event_hub
+
+# Per-request tracing of the manager modules (see tracing.REQUEST_TRACING)
+tracing.instrument("instance_manager", "vpn_manager", "ip_manager", "ip_index", "versioning", "network_utils",
+                   "netplan_manager", "firewall_manager", "machine_firewall_manager", "iptables_manager",
+                   "traffic_accounting", "session_log")
 
 # --- Modelli Pydantic ---
 class ClientRequest(BaseModel):
@@ -26,6 +50,11 @@ class GroupMemberRequest(BaseModel):
     client_identifier: str # e.g. "instance_clientname"
     subnet_info: Dict[str, str]
 
+class GroupMembersBulkRequest(BaseModel):
+    add: List[str] = [] # client identifiers, e.g. "instance_clientname"
+    remove: List[str] = []
+    subnet_info: Dict[str, str]
+
 class RuleRequest(BaseModel):
     group_id: str
     action: str
@@ -83,6 +112,13 @@ class InstanceRequest(BaseModel):
     tunnel_mode: str = "full"  # "full" or "split"
     routes: List[RouteConfig] = []  # Custom routes for split tunnel
     dns_servers: List[str] = [] # Optional custom DNS servers
+    public_endpoint: Optional[str] = None # Hostname or IP override for client configs
+
+class EndpointUpdateRequest(BaseModel):
+    public_endpoint: Optional[str] = None # None or empty clears the override
+
+class IpReservationRequest(BaseModel):
+    reservation: str # IP, CIDR or range "a.b.c.d-e.f.g.h"
 
 class FirewallPolicyRequest(BaseModel):
     default_policy: str
@@ -92,6 +128,12 @@ API_KEY = os.getenv("API_KEY", "change-this-in-production")
 API_KEY_NAME = "X-API-Key"
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=True)
 
+# --- Download via nginx (X-Accel-Redirect) ---
+# Location "internal" di nginx che serve ACCEL_CONFIG_DIR (vedi nginx/vpn-dashboard.conf).
+X_ACCEL_REDIRECT_LOCATION = os.getenv("X_ACCEL_REDIRECT_LOCATION", "/protected-ovpn/")
+# Se true, i download usano X-Accel-Redirect anche senza ?accel=true.
+X_ACCEL_REDIRECT_DEFAULT = os.getenv("X_ACCEL_REDIRECT_DEFAULT", "false").lower() == "true"
+
 async def get_api_key(key: str = Security(api_key_header)):
     if key == API_KEY:
         return key
@@ -101,11 +143,29 @@ async def get_api_key(key: str = Security(api_key_header)):
             detail="Could not validate credentials",
         )
 
+def _versioned(collection: str, items: List, key: str, since: Optional[int]):
+    """Without `since` returns the list as is; otherwise only what changed after that version."""
+    if since is None:
+        return items
+    items = jsonable_encoder(items)
+    return versioning.changes_since(collection, {str(item[key]): item for item in items}, since)
+
+# --- Servizi in background ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    route_watcher.start()
+    interface_sampler.start()
+    traffic_collector.start()
+    traffic_accounting.start()
+    event_hub.start()
+    yield
+
 # --- Applicazione FastAPI ---
 app = FastAPI(
     title="OpenVPN Management API",
     description="API per gestire istanze multiple di OpenVPN.",
     version="2.0.0",
+    lifespan=lifespan,
 )
 
 # --- Middleware CORS ---
@@ -118,11 +178,84 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# --- Metriche ---
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    response = await call_next(request)
+    # Route template (e.g. /api/instances/{instance_id}), so the label set stays bounded
+    route = request.scope.get("route")
+    metrics.http_request_duration.observe(
+        (request.method, route.path if route else "unmatched"), time.perf_counter() - start)
+    return response
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    requested = request.headers.get(tracing.TRACE_HEADER)
+    # Traces expose commands and paths: only honour the header for authenticated callers
+    if requested and request.headers.get(API_KEY_NAME) != API_KEY:
+        requested = None
+    trace = tracing.start(request.method, request.url.path, requested)
+    if trace is None:
+        return await call_next(request)
+    try:
+        response = await call_next(request)
+    except Exception:
+        tracing.finish(trace, 500, None)
+        raise
+    route = request.scope.get("route")
+    tracing.finish(trace, response.status_code, route.path if route else None)
+    response.headers[tracing.TRACE_HEADER] = trace.summary()
+    return response
+
+async def get_metrics_key(request: Request):
+    """Accepts the API key as X-API-Key or as a bearer token (Prometheus `authorization`)."""
+    auth = request.headers.get("Authorization", "")
+    key = request.headers.get(API_KEY_NAME) or (auth[7:] if auth.startswith("Bearer ") else None)
+    if key != API_KEY:
+        raise HTTPException(status_code=403, detail="Could not validate credentials")
+
+@app.get("/metrics", dependencies=[Depends(get_metrics_key)], response_class=PlainTextResponse)
+def get_metrics():
+    """Metriche in formato Prometheus (latenze API, comandi esterni, firewall, cache, client connessi)."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/debug/traces", dependencies=[Depends(get_api_key)])
+async def list_traces():
+    """Ultime richieste tracciate (header X-Trace: 1 o profile, oppure REQUEST_TRACING=all)."""
+    return tracing.get_traces()
+
+@app.get("/api/debug/traces/{trace_id}", dependencies=[Depends(get_api_key)])
+async def get_trace(trace_id: str):
+    """Traccia completa: sottoprocessi, file letti/scritti, tempo per funzione ed eventuale profilo cProfile."""
+    trace = tracing.get_trace(trace_id)
+    if not trace:
+        raise HTTPException(status_code=404, detail="Traccia non trovata.")
+    return trace
+
+# --- Eventi in tempo reale ---
+
+@app.get("/api/events", dependencies=[Depends(get_api_key)])
+async def stream_events():
+    """
+    Stream Server-Sent Events: stato delle istanze, connessioni/disconnessioni dei client
+    e velocità di traffico, prodotti da un unico ciclo condiviso tra tutti i sottoscrittori.
+    """
+    return StreamingResponse(
+        event_hub.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # --- Endpoints Istanze ---
 
 @app.get("/api/instances", dependencies=[Depends(get_api_key)])
-async def get_instances():
-    """Restituisce la lista di tutte le istanze OpenVPN con il conteggio dei client connessi."""
+async def get_instances(since: Optional[int] = None):
+    """
+    Restituisce la lista di tutte le istanze OpenVPN con il conteggio dei client connessi.
+    Con `since` restituisce {version, full, items, deleted}: solo le istanze cambiate dopo quella versione.
+    """
     instances = instance_manager.get_all_instances()
     for inst in instances:
         if inst.status == "running":
@@ -130,7 +263,7 @@ async def get_instances():
             inst.connected_clients = len(connected)
         else:
             inst.connected_clients = 0
-    return instances
+    return _versioned("instances", instances, "id", since)
 
 @app.get("/api/instances/{instance_id}", dependencies=[Depends(get_api_key)])
 async def get_instance(instance_id: str):
@@ -151,7 +284,8 @@ async def create_instance(request: InstanceRequest):
             protocol=request.protocol,
             tunnel_mode=request.tunnel_mode,
             routes=[route.dict() for route in request.routes],
-            dns_servers=request.dns_servers
+            dns_servers=request.dns_servers,
+            public_endpoint=request.public_endpoint
         )
         return instance
     except ValueError as e:
@@ -198,38 +332,202 @@ async def update_instance_firewall_policy_endpoint(instance_id: str, request: Fi
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.patch("/api/instances/{instance_id}/endpoint", dependencies=[Depends(get_api_key)])
+async def update_instance_endpoint_endpoint(instance_id: str, request: EndpointUpdateRequest):
+    """Imposta (o rimuove) l'endpoint pubblico usato nei file .ovpn dell'istanza."""
+    try:
+        return instance_manager.update_instance_endpoint(instance_id, request.public_endpoint)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/instances/{instance_id}/ip-reservations", dependencies=[Depends(get_api_key)])
+async def list_ip_reservations(instance_id: str):
+    """Restituisce gli IP/intervalli esclusi dall'assegnazione statica dei client."""
+    instance = instance_manager.get_instance_by_id(instance_id)
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    return ip_manager.get_reservations(instance.name)
+
+@app.post("/api/instances/{instance_id}/ip-reservations", dependencies=[Depends(get_api_key)])
+async def add_ip_reservation(instance_id: str, request: IpReservationRequest):
+    """Prenota un IP, una CIDR o un intervallo nella subnet dell'istanza."""
+    instance = instance_manager.get_instance_by_id(instance_id)
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    try:
+        return ip_manager.add_reservation(instance.name, instance.subnet, request.reservation)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.delete("/api/instances/{instance_id}/ip-reservations", dependencies=[Depends(get_api_key)])
+async def remove_ip_reservation(instance_id: str, reservation: str):
+    """Rimuove una prenotazione IP (passata come query parameter)."""
+    instance = instance_manager.get_instance_by_id(instance_id)
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    try:
+        return ip_manager.remove_reservation(instance.name, instance.subnet, reservation)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # --- Endpoints Statistiche ---
 
 @app.get("/api/stats/top-clients", dependencies=[Depends(get_api_key)])
-async def get_top_clients():
-    """Restituisce i top 5 client per traffico totale (tutte le istanze)."""
-    instances = instance_manager.get_all_instances()
-    all_clients = []
+async def get_top_clients(k: int = 5, window: int = 0, direction: str = "total", group_by: str = "client"):
+    """
+    Restituisce i top k per traffico (tutte le istanze).
+    window: 0 = byte delle sessioni correnti, altrimenti minuti (anche come velocità media);
+    direction: rx, tx, total; group_by: client, instance, group.
+    """
+    try:
+        return traffic_collector.top(k, window, direction, group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-    for inst in instances:
-        if inst.status == "running":
-            connected = vpn_manager.get_connected_clients(inst.name)
-            for name, data in connected.items():
-                # data keys: virtual_ip, real_ip, connected_since, bytes_received, bytes_sent
-                try:
-                    b_rx = int(data.get("bytes_received", 0))
-                    b_tx = int(data.get("bytes_sent", 0))
-                    total_bytes = b_rx + b_tx
-                    
-                    all_clients.append({
-                        "client_name": name,
-                        "instance_name": inst.name,
-                        "total_bytes": total_bytes,
-                        "bytes_received": b_rx,
-                        "bytes_sent": b_tx,
-                        "connected_since": data.get("connected_since", "-")
-                    })
-                except (ValueError, TypeError):
-                    continue
-
-    # Sort by total_bytes descending
-    sorted_clients = sorted(all_clients, key=lambda x: x["total_bytes"], reverse=True)
-    return sorted_clients[:5]
+@app.get("/api/stats/traffic", dependencies=[Depends(get_api_key)])
+async def get_traffic_rates(instance_id: Optional[str] = None):
+    """Velocità corrente (byte/s) dei client tracciati dal collector, opzionalmente di una sola istanza."""
+    instance_name = None
+    if instance_id:
+        instance = instance_manager.get_instance(instance_id)
+        if not instance:
+            raise HTTPException(status_code=404, detail="Instance not found")
+        instance_name = instance.name
+    return {
+        "sample_interval": traffic_collector.interval,
+        "clients": traffic_collector.get_rates(instance_name),
+    }
+
+@app.get("/api/stats/instances", dependencies=[Depends(get_api_key)])
+async def get_instance_stats():
+    """Per istanza: client connessi, velocità corrente (byte/s) e byte totali dall'avvio del collector."""
+    return traffic_collector.get_instance_stats()
+
+@app.get("/api/stats/groups", dependencies=[Depends(get_api_key)])
+async def get_group_stats(instance_id: Optional[str] = None):
+    """
+    Come /api/stats/instances per ogni gruppo firewall, opzionalmente di una sola istanza.
+    I byte sono contati mentre il client è membro del gruppo.
+    """
+    instance_name = None
+    if instance_id:
+        instance = instance_manager.get_instance(instance_id)
+        if not instance:
+            raise HTTPException(status_code=404, detail="Instance not found")
+        instance_name = instance.name
+    return traffic_collector.get_group_stats(instance_name)
+
+@app.get("/api/instances/{instance_id}/clients/{client_name}/traffic", dependencies=[Depends(get_api_key)])
+async def get_client_traffic(instance_id: str, client_name: str, minutes: int = 60):
+    """Storico del traffico di un client (byte per intervallo) negli ultimi `minutes` minuti."""
+    if minutes < 1:
+        raise HTTPException(status_code=400, detail="minutes deve essere almeno 1")
+    instance = instance_manager.get_instance(instance_id)
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    history = traffic_collector.get_history(instance.name, client_name, minutes)
+    if history is None:
+        raise HTTPException(status_code=404, detail="Nessun dato di traffico per questo client.")
+    return history
+
+@app.get("/api/instances/{instance_id}/traffic/archive", dependencies=[Depends(get_api_key)])
+async def get_traffic_archive(instance_id: str, client_name: Optional[str] = None, start: Optional[int] = None,
+                              end: Optional[int] = None, step: Optional[int] = None):
+    """
+    Storico di lungo periodo (fino a 90 giorni) di un client o, senza client_name, dell'intera istanza.
+    start/end sono epoch in secondi (default: ultima ora); step sceglie la risoluzione (10, 300, 3600).
+    """
+    instance = instance_manager.get_instance(instance_id)
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    if client_name is not None and not re.fullmatch(CLIENT_NAME_PATTERN, client_name):
+        raise HTTPException(status_code=400, detail="Nome client non valido.")
+
+    end = end if end is not None else int(time.time())
+    start = start if start is not None else end - 3600
+    if start > end:
+        raise HTTPException(status_code=400, detail="start deve precedere end")
+    try:
+        return traffic_archive.query(instance.name, client_name, start, end, step)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _query_sessions(instance_id: str, client_name: Optional[str], start: Optional[int], end: Optional[int], limit: int):
+    instance = instance_manager.get_instance(instance_id)
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    if client_name is not None and not re.fullmatch(CLIENT_NAME_PATTERN, client_name):
+        raise HTTPException(status_code=400, detail="Nome client non valido.")
+    if not 1 <= limit <= MAX_SESSION_RESULTS:
+        raise HTTPException(status_code=400, detail=f"limit deve essere compreso tra 1 e {MAX_SESSION_RESULTS}")
+
+    end = end if end is not None else int(time.time())
+    start = start if start is not None else end - 86400
+    if start > end:
+        raise HTTPException(status_code=400, detail="start deve precedere end")
+    return session_store.query(instance.name, client_name, start, end, limit)
+
+@app.get("/api/instances/{instance_id}/sessions", dependencies=[Depends(get_api_key)])
+def get_instance_sessions(instance_id: str, client_name: Optional[str] = None, start: Optional[int] = None,
+                          end: Optional[int] = None, limit: int = 100):
+    """
+    Sessioni (connessione/disconnessione, IP reale e virtuale, durata, byte) attive tra start ed end
+    (epoch in secondi, default: ultime 24 ore), dalla più recente. Le sessioni aperte hanno end = null.
+    """
+    return _query_sessions(instance_id, client_name, start, end, limit)
+
+@app.get("/api/instances/{instance_id}/clients/{client_name}/sessions", dependencies=[Depends(get_api_key)])
+def get_client_sessions(instance_id: str, client_name: str, start: Optional[int] = None,
+                        end: Optional[int] = None, limit: int = 100):
+    """Sessioni di un singolo client tra start ed end (default: ultime 24 ore)."""
+    return _query_sessions(instance_id, client_name, start, end, limit)
+
+@app.get("/api/instances/{instance_id}/usage", dependencies=[Depends(get_api_key)])
+def get_instance_usage(instance_id: str, month: Optional[str] = None):
+    """
+    Traffico cumulativo del mese (YYYY-MM, default: mese corrente) per client, dai contatori
+    del kernel: non si azzera a riconnessioni o riavvii. Solo i client con IP statico.
+    """
+    instance = instance_manager.get_instance(instance_id)
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    if month is not None and not re.fullmatch(MONTH_PATTERN, month):
+        raise HTTPException(status_code=400, detail="Mese non valido, formato atteso YYYY-MM.")
+    return traffic_accounting.get_usage(instance.name, month=month)
+
+@app.get("/api/instances/{instance_id}/clients/{client_name}/usage", dependencies=[Depends(get_api_key)])
+def get_client_usage(instance_id: str, client_name: str):
+    """Totali mensili (rx/tx in byte) di un client."""
+    instance = instance_manager.get_instance(instance_id)
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    return {"client_name": client_name, "months": traffic_accounting.get_history(instance.name, client_name)}
+
+# --- Endpoints Lookup ---
+
+@app.get("/api/lookup/ip/{ip}", dependencies=[Depends(get_api_key)])
+async def lookup_ip(ip: str):
+    """Indica a quale client appartiene un IP (assegnazione statica e/o sessione attiva)."""
+    try:
+        ipaddress.ip_address(ip)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Indirizzo IP non valido: '{ip}'")
+
+    # Make sure the index reflects the current CCD files and status logs
+    for inst in instance_manager.get_all_instances():
+        ip_manager.get_static_ips(inst.name, inst.subnet)
+        vpn_manager.get_connected_clients(inst.name)
+
+    result = ip_index.lookup_ip(ip)
+    if not result:
+        raise HTTPException(status_code=404, detail="IP non assegnato a nessun client")
+    return result
 
 # --- Endpoints Network ---
 
@@ -245,13 +543,39 @@ async def get_network_interfaces():
 # --- Endpoints Client (Scoped per Istanza) ---
 
 @app.get("/api/instances/{instance_id}/clients", dependencies=[Depends(get_api_key)])
-async def get_clients(instance_id: str):
-    """Ottiene la lista dei client per una specifica istanza."""
+async def get_clients(instance_id: str, page: Optional[int] = None, page_size: Optional[int] = None,
+                      search: Optional[str] = None, match: str = "prefix", status: Optional[str] = None,
+                      group_id: Optional[str] = None, sort: Optional[str] = None, order: str = "asc",
+                      since: Optional[int] = None):
+    """
+    Ottiene la lista dei client per una specifica istanza.
+    Senza parametri restituisce la lista completa; con paginazione, ricerca, filtri o
+    ordinamento restituisce {items, total, page, page_size}. Con `since` restituisce
+    solo i client cambiati o eliminati dopo quella versione.
+    """
+    paginated = any(p is not None for p in (page, page_size, search, status, group_id, sort))
+    if paginated and since is not None:
+        raise HTTPException(status_code=400, detail="since non è combinabile con paginazione, ricerca o filtri")
     try:
-        clients = vpn_manager.list_clients(instance_id)
-        return clients
-    except ValueError:
+        if not paginated:
+            return _versioned(f"clients:{instance_id}", vpn_manager.list_clients(instance_id), "name", since)
+        return vpn_manager.list_clients_page(
+            instance_id,
+            page=page or 1,
+            page_size=page_size or 50,
+            search=search,
+            match=match,
+            status=status,
+            group_id=group_id,
+            sort=sort or "name",
+            order=order
+        )
+    except LookupError:
         raise HTTPException(status_code=404, detail="Instance not found")
+    except ValueError as e:
+        if not paginated:
+            raise HTTPException(status_code=404, detail="Instance not found")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -269,25 +593,81 @@ async def create_client(instance_id: str, request: ClientRequest):
     return {"message": f"Client '{client_name}' creato con successo."}
 
 @app.get("/api/instances/{instance_id}/clients/{client_name}/download", dependencies=[Depends(get_api_key)])
-async def download_client_config(instance_id: str, client_name: str):
-    """Scarica il file .ovpn per un client."""
-    # Verifica esistenza istanza (opzionale, ma buona pratica)
-    if not instance_manager.get_instance(instance_id):
+async def download_client_config(instance_id: str, client_name: str, request: Request, accel: Optional[bool] = None):
+    """
+    Scarica il file .ovpn per un client, renderizzato dal template dell'istanza.
+    Con accel=true la richiesta viene solo autorizzata e nginx serve il file via X-Accel-Redirect.
+    """
+    instance = instance_manager.get_instance(instance_id)
+    if not instance:
         raise HTTPException(status_code=404, detail="Instance not found")
 
     if not client_name or not re.fullmatch(CLIENT_NAME_PATTERN, client_name):
         raise HTTPException(status_code=400, detail="Nome client non valido.")
+
+    if client_name not in instance.clients:
+        raise HTTPException(status_code=404, detail="Client not found for this instance")
+
+    if accel is None:
+        accel = X_ACCEL_REDIRECT_DEFAULT
+
+    if accel:
+        filename, error = vpn_manager.export_client_config_file(instance, client_name)
+        if error:
+            raise HTTPException(status_code=404, detail=error)
+        return Response(
+            media_type="application/x-openvpn-profile",
+            headers={
+                "X-Accel-Redirect": f"{X_ACCEL_REDIRECT_LOCATION}{filename}",
+                "Content-Disposition": f"attachment; filename={client_name}.ovpn",
+                "Cache-Control": "no-cache",
+            }
+        )
     
-    config_content, error = vpn_manager.get_client_config(client_name)
+    stream, etag, error = vpn_manager.get_client_config_stream(instance, client_name)
     if error:
         raise HTTPException(status_code=404, detail=error)
 
-    return PlainTextResponse(
-        content=config_content,
-        media_type="application/x-openvpn-profile",
-        headers={"Content-Disposition": f"attachment; filename={client_name}.ovpn"}
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+
+    headers["Content-Disposition"] = f"attachment; filename={client_name}.ovpn"
+    return StreamingResponse(stream, media_type="application/x-openvpn-profile", headers=headers)
+
+@app.get("/api/instances/{instance_id}/clients/export", dependencies=[Depends(get_api_key)])
+async def export_client_configs(instance_id: str, group_id: Optional[str] = None):
+    """Esporta in un archivio ZIP (in streaming) i file .ovpn dei client dell'istanza, opzionalmente di un solo gruppo."""
+    instance = instance_manager.get_instance(instance_id)
+    if not instance:
+        raise HTTPException(status_code=404, detail="Instance not found")
+
+    client_names = list(instance.clients)
+    if group_id:
+        group = next((g for g in instance_firewall_manager.get_groups(instance_id) if g.id == group_id), None)
+        if not group:
+            raise HTTPException(status_code=404, detail="Group not found")
+        members = set(group.members)
+        client_names = [c for c in client_names if c in members]
+
+    filename = f"{instance.name}_{group_id}_clients.zip" if group_id else f"{instance.name}_clients.zip"
+    return StreamingResponse(
+        vpn_manager.iter_client_configs_zip(instance, client_names),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
     )
 
+@app.post("/api/instances/{instance_id}/clients/regenerate", dependencies=[Depends(get_api_key)])
+async def regenerate_client_configs(instance_id: str):
+    """Rigenera i file .ovpn salvati di tutti i client dell'istanza (es. dopo cambio CA o porta)."""
+    try:
+        written = vpn_manager.regenerate_client_configs(instance_id)
+        return {"success": True, "regenerated": written}
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Instance not found")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/api/instances/{instance_id}/clients/{client_name}", dependencies=[Depends(get_api_key)])
 async def revoke_client(instance_id: str, client_name: str):
     """Revoca un client."""
@@ -304,8 +684,8 @@ async def revoke_client(instance_id: str, client_name: str):
 # --- Endpoints Gruppi e Firewall ---
 
 @app.get("/api/groups", dependencies=[Depends(get_api_key)])
-async def list_groups(instance_id: Optional[str] = None):
-    return instance_firewall_manager.get_groups(instance_id)
+async def list_groups(instance_id: Optional[str] = None, since: Optional[int] = None):
+    return _versioned(f"groups:{instance_id or '*'}", instance_firewall_manager.get_groups(instance_id), "id", since)
 
 @app.post("/api/groups", dependencies=[Depends(get_api_key)])
 async def create_group(request: GroupRequest):
@@ -327,6 +707,16 @@ async def add_group_member(group_id: str, request: GroupMemberRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/groups/{group_id}/members/bulk", dependencies=[Depends(get_api_key)])
+async def update_group_members_bulk(group_id: str, request: GroupMembersBulkRequest):
+    """Aggiunge/rimuove più membri in un'unica operazione con un solo aggiornamento del firewall."""
+    try:
+        return instance_firewall_manager.update_group_members(group_id, request.add, request.remove, request.subnet_info)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @app.delete("/api/groups/{group_id}/members/{client_identifier}", dependencies=[Depends(get_api_key)])
 async def remove_group_member(group_id: str, client_identifier: str, instance_name: str):
     try:
@@ -338,8 +728,8 @@ async def remove_group_member(group_id: str, client_identifier: str, instance_na
 # --- Endpoints Firewall Rules ---
 
 @app.get("/api/firewall/rules", dependencies=[Depends(get_api_key)])
-async def list_rules(group_id: Optional[str] = None):
-    return instance_firewall_manager.get_rules(group_id)
+async def list_rules(group_id: Optional[str] = None, since: Optional[int] = None):
+    return _versioned(f"rules:{group_id or '*'}", instance_firewall_manager.get_rules(group_id), "id", since)
 
 @app.post("/api/firewall/rules", dependencies=[Depends(get_api_key)])
 async def create_rule(request: RuleRequest):
@@ -348,6 +738,50 @@ async def create_rule(request: RuleRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/firewall/rules/export", dependencies=[Depends(get_api_key)])
+async def export_rules(group_id: Optional[str] = None, instance_id: Optional[str] = None, format: str = "json"):
+    """Esporta le regole di un gruppo o di un'istanza in JSON o CSV."""
+    try:
+        rules = instance_firewall_manager.export_rules(group_id, instance_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if format == "csv":
+        return Response(
+            content=instance_firewall_manager.rules_to_csv(rules),
+            media_type="text/csv",
+            headers={"Content-Disposition": f"attachment; filename=rules_{group_id or instance_id}.csv"}
+        )
+    if format != "json":
+        raise HTTPException(status_code=400, detail=f"Formato non supportato: '{format}'")
+    return rules
+
+@app.post("/api/firewall/rules/import", dependencies=[Depends(get_api_key)])
+async def import_rules(request: Request, group_id: Optional[str] = None, instance_id: Optional[str] = None,
+                       mode: str = "merge", format: str = "json"):
+    """
+    Importa un set completo di regole (JSON: lista di regole, CSV: con intestazione) per un gruppo
+    o un'istanza. Tutte le righe sono validate prima di applicare; in caso di errori nulla viene salvato.
+    """
+    body = (await request.body()).decode("utf-8-sig")
+    try:
+        if format == "csv":
+            rows = instance_firewall_manager.parse_rules_csv(body)
+        elif format == "json":
+            rows = json.loads(body)
+            if not isinstance(rows, list) or not all(isinstance(r, dict) for r in rows):
+                raise ValueError("Il corpo JSON deve essere una lista di regole.")
+        else:
+            raise ValueError(f"Formato non supportato: '{format}'")
+        result = instance_firewall_manager.import_rules(rows, group_id, instance_id, mode)
+    except (ValueError, csv.Error) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if not result["success"]:
+        raise HTTPException(status_code=422, detail=result)
+    return result
+
 @app.put("/api/firewall/rules/{rule_id}", dependencies=[Depends(get_api_key)])
 async def update_rule(rule_id: str, request: RuleRequest):
     try:
@@ -383,12 +817,12 @@ async def reorder_rules(orders: List[RuleOrderRequest]):
 
 # --- Endpoints Firewall (Machine-level) ---
 
-@app.get("/api/machine-firewall/rules", response_model=List[MachineFirewallRuleModel], dependencies=[Depends(get_api_key)])
-async def list_machine_firewall_rules():
-    """List all machine-level firewall rules."""
+@app.get("/api/machine-firewall/rules", response_model=Union[List[MachineFirewallRuleModel], Dict], dependencies=[Depends(get_api_key)])
+async def list_machine_firewall_rules(since: Optional[int] = None):
+    """List all machine-level firewall rules (only the changes after `since`, if given)."""
     try:
         all_rules = machine_firewall_manager.get_all_rules()
-        return all_rules
+        return _versioned("machine-rules", all_rules, "id", since)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -434,70 +868,75 @@ async def apply_machine_firewall_rules_endpoint(rules_order: List[MachineFirewal
 # --- Endpoints Network Interface (Machine-level) ---
 
 @app.get("/api/machine-network/interfaces", dependencies=[Depends(get_api_key)])
-async def get_all_machine_network_interfaces():
-    """Get all machine network interfaces with detailed information."""
+async def get_all_machine_network_interfaces(history: int = 0, include_tun: bool = False):
+    """
+    Get all machine network interfaces with detailed information and current traffic rates.
+    `history` adds the last N samples; `include_tun` also lists the OpenVPN tun* interfaces.
+    """
+    if history < 0 or history > interface_sampler.history_size:
+        raise HTTPException(status_code=400, detail=f"history deve essere compreso tra 0 e {interface_sampler.history_size}")
     try:
-        interfaces = network_utils.get_network_interfaces()
+        interfaces = [dict(iface) for iface in network_utils.get_network_interfaces()]
+        for iface in interfaces:
+            iface["traffic"] = interface_sampler.get(iface["name"], history)
+        if include_tun:
+            for name, traffic in sorted(interface_sampler.get_all(history).items()):
+                if name.startswith("tun"):
+                    interfaces.append({"name": name, "virtual": True, "traffic": traffic})
         return interfaces
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/api/machine-network/interfaces/{interface_name}/config", dependencies=[Depends(get_api_key)])
 async def get_machine_network_interface_config(interface_name: str):
-    """Get the current Netplan configuration for a specific interface."""
-    try:
-        netplan_files = network_utils.get_netplan_config_files()
-        # For simplicity, we assume the config is in the first file, or we need to iterate
-        # and find the config relevant to this interface.
-        if not netplan_files:
-            return {} # No netplan config files found
-        
-        # Read the first netplan file and extract config for the specific interface
-        config_data = network_utils.read_netplan_config(netplan_files[0])
-        if config_data and "network" in config_data and "ethernets" in config_data["network"]:
-            return config_data["network"]["ethernets"].get(interface_name, {})
-        return {}
+    """Get the effective Netplan configuration for a specific interface (all files merged)."""
+    try:
+        return netplan_manager.get_interface_config(interface_name)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/machine-network/interfaces/{interface_name}/config", dependencies=[Depends(get_api_key)])
-async def update_machine_network_interface_config(interface_name: str, config_data: Dict):
-    """Update the Netplan configuration for a specific interface and apply it."""
-    try:
-        # This endpoint will manage reading, updating, and writing the netplan config.
-        # It's a critical operation that needs to be handled carefully.
-        # For this iteration, we'll try to modify the first netplan file found.
-        netplan_files = network_utils.get_netplan_config_files()
-        
-        # If no netplan file exists, create a new one with a default structure
-        if not netplan_files:
-            config_file_path = f"/etc/netplan/99-custom-{interface_name}.yaml"
-            current_netplan_full_config = {"network": {"version": 2, "renderer": "networkd"}}
-        else:
-            config_file_path = netplan_files[0] # Pick the first one
-            current_netplan_full_config = network_utils.read_netplan_config(config_file_path)
-            if current_netplan_full_config is None: # handle empty or invalid YAML
-                 current_netplan_full_config = {"network": {"version": 2, "renderer": "networkd"}}
-
-        if "network" not in current_netplan_full_config:
-            current_netplan_full_config["network"] = {"version": 2, "renderer": "networkd"}
-        if "ethernets" not in current_netplan_full_config["network"]:
-            current_netplan_full_config["network"]["ethernets"] = {}
-
-        # Apply the new config_data for the specific interface
-        current_netplan_full_config["network"]["ethernets"][interface_name] = config_data
-
-        if not network_utils.write_netplan_config(config_file_path, current_netplan_full_config):
-            raise HTTPException(status_code=500, detail="Failed to write Netplan config file.")
-        
-        success, error = network_utils.apply_netplan_config()
-        if not success:
-            raise HTTPException(status_code=500, detail=f"Failed to apply Netplan config: {error}")
-
-        return {"success": True, "message": f"Netplan config for {interface_name} updated and applied."}
+def update_machine_network_interface_config(interface_name: str, config_data: Dict, rollback_timeout: int = 0):
+    """
+    Update the Netplan configuration for a specific interface and apply it.
+    With `rollback_timeout` the change is reverted unless confirmed within that many seconds.
+    """
+    if rollback_timeout < 0 or rollback_timeout > netplan_manager.MAX_ROLLBACK_TIMEOUT:
+        raise HTTPException(status_code=400, detail=f"rollback_timeout deve essere compreso tra 0 e {netplan_manager.MAX_ROLLBACK_TIMEOUT} secondi")
+    try:
+        result = netplan_manager.set_interface_config(interface_name, config_data, rollback_timeout)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error updating Netplan config: {e}")
 
+    if not result["changed"]:
+        message = f"Netplan config for {interface_name} unchanged, nothing applied."
+    elif result["pending_rollback"]:
+        message = f"Netplan config for {interface_name} applied, waiting for confirmation."
+    else:
+        message = f"Netplan config for {interface_name} updated and applied."
+    return {"success": True, "message": message, **result}
+
+@app.get("/api/machine-network/netplan-pending", dependencies=[Depends(get_api_key)])
+async def get_pending_netplan_change():
+    """Returns the Netplan change waiting for confirmation, if any."""
+    return {"pending": netplan_manager.get_pending()}
+
+@app.post("/api/machine-network/netplan-pending/{change_id}/confirm", dependencies=[Depends(get_api_key)])
+async def confirm_netplan_change(change_id: str):
+    if not netplan_manager.confirm_pending(change_id):
+        raise HTTPException(status_code=404, detail="Nessuna modifica in attesa con questo ID (forse già ripristinata).")
+    return {"success": True, "message": "Netplan change confirmed."}
+
+@app.post("/api/machine-network/netplan-pending/{change_id}/rollback", dependencies=[Depends(get_api_key)])
+def rollback_netplan_change(change_id: str):
+    if not netplan_manager.rollback_pending(change_id):
+        raise HTTPException(status_code=404, detail="Nessuna modifica in attesa con questo ID.")
+    return {"success": True, "message": "Netplan change rolled back."}
+
 @app.post("/api/machine-network/netplan-apply", dependencies=[Depends(get_api_key)])
 async def apply_global_netplan_config():
     """Applies the current Netplan configuration globally."""
@@ -0,0 +1,217 @@
+import os
+import time
+import threading
+import subprocess
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Sequence, Tuple
+
+import tracing
+
+# Prometheus metrics in the text exposition format, without a client library.
+# Updating a metric is a dict lookup and an addition under a lock; a scrape renders
+# one line per series, so its cost depends on the number of routes, commands and
+# instances, not on the traffic served since the previous scrape.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SUBPROCESS_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+Labels = Tuple[str, ...]
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Labels, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _header(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+class _Simple(_Metric):
+    """One value per label set."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Labels, float] = {}
+
+    def get(self, labels: Labels = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def replace(self, values: Dict[Labels, float]):
+        """Swaps in all series at once (for values mirrored from another module's state)."""
+        with self._lock:
+            self._values = dict(values)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = list(self._values.items())
+        return self._header() + [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}"
+                                 for labels, v in values]
+
+class Counter(_Simple):
+    kind = "counter"
+
+    def inc(self, labels: Labels = (), value: float = 1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + value
+
+class Gauge(_Simple):
+    kind = "gauge"
+
+    def set(self, labels: Labels = (), value: float = 0):
+        with self._lock:
+            self._values[labels] = value
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (non-cumulative, last is +Inf), sum]
+        self._values: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, labels: Labels = ()):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(labels, time.perf_counter() - start)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = [(labels, list(counts), total) for labels, (counts, total) in self._values.items()]
+        lines = self._header()
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {_format_value(total)}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+_registry: List[_Metric] = []
+# Called on every scrape to refresh gauges computed from other modules' state
+_collectors: List[Callable[[], None]] = []
+
+def register_collector(collector: Callable[[], None]):
+    _collectors.append(collector)
+
+def render() -> str:
+    for collector in _collectors:
+        collector()
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+# --- Metrics shared across modules ---
+
+http_request_duration = Histogram(
+    "vpn_http_request_duration_seconds", "API request latency by route template.", ("method", "route"))
+subprocess_duration = Histogram(
+    "vpn_subprocess_duration_seconds", "Duration of external commands by command type.", ("command",),
+    buckets=SUBPROCESS_BUCKETS)
+subprocess_failures = Counter(
+    "vpn_subprocess_failures_total", "External commands that exited non-zero or could not start.", ("command",))
+firewall_apply_duration = Histogram(
+    "vpn_firewall_apply_seconds", "Time to compile and apply a firewall.", ("firewall",), buckets=SUBPROCESS_BUCKETS)
+firewall_rules = Gauge(
+    "vpn_firewall_rules", "Rules installed by the last firewall application.", ("firewall",))
+status_parse_duration = Histogram(
+    "vpn_status_parse_seconds", "Time to parse an OpenVPN status log (cache misses only).", ("instance",),
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25))
+cache_requests = Counter(
+    "vpn_cache_requests_total", "Lookups in the in-process caches.", ("cache", "result"))
+cache_hit_ratio = Gauge(
+    "vpn_cache_hit_ratio", "Hits over lookups since the backend started.", ("cache",))
+
+def cache_hit(cache: str):
+    cache_requests.inc((cache, "hit"))
+
+def cache_miss(cache: str):
+    cache_requests.inc((cache, "miss"))
+
+def _collect_cache_ratios():
+    caches = {labels[0] for labels in list(cache_requests._values)}
+    for cache in caches:
+        hits, misses = cache_requests.get((cache, "hit")), cache_requests.get((cache, "miss"))
+        cache_hit_ratio.set((cache,), hits / (hits + misses) if hits + misses else 0.0)
+
+register_collector(_collect_cache_ratios)
+
+# --- Subprocess instrumentation ---
+
+# Executable (or script) basename -> command type label
+COMMAND_TYPES = {
+    "iptables": "iptables", "iptables-save": "iptables", "iptables-restore": "iptables",
+    "save-iptables.sh": "iptables",
+    "systemctl": "systemctl",
+    "easyrsa": "easyrsa", "create-client.sh": "easyrsa", "revoke-client.sh": "easyrsa",
+    "netplan": "netplan",
+    "ip": "ip", "route": "ip",
+}
+_SHELL_WORDS = {"bash", "sh", "sudo", "env", "cd", "&&", ";", "|"}
+
+def command_type(cmd) -> str:
+    """Label of a command: a known tool anywhere in it, else the basename of the first word."""
+    words = cmd.split() if isinstance(cmd, str) else [str(word) for word in cmd]
+    first = None
+    for word in words:
+        name = os.path.basename(word)
+        if name in COMMAND_TYPES:
+            return COMMAND_TYPES[name]
+        if first is None and name not in _SHELL_WORDS and not word.startswith("-") and "=" not in word:
+            first = name
+    return first or "other"
+
+def run(cmd, **kwargs) -> subprocess.CompletedProcess:
+    """subprocess.run, timed and counted per command type."""
+    label = (command_type(cmd),)
+    returncode = None
+    start = time.perf_counter()
+    try:
+        result = subprocess.run(cmd, **kwargs)
+        returncode = result.returncode
+    except subprocess.CalledProcessError as e:
+        returncode = e.returncode
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        subprocess_duration.observe(label, duration)
+        # None: TimeoutExpired or the command could not start
+        if returncode != 0:
+            subprocess_failures.inc(label)
+        tracing.record_subprocess(cmd, label[0], duration, returncode)
+    return result
@@ -0,0 +1,123 @@
+import os
+import socket
+import struct
+import logging
+from typing import Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Minimal rtnetlink client (Linux only), used instead of forking `ip`.
+# Only the messages needed by network_utils are decoded: links and IPv4 addresses.
+
+NETLINK_ROUTE = 0
+
+# Message types
+NLMSG_ERROR = 2
+NLMSG_DONE = 3
+RTM_NEWLINK = 16
+RTM_DELLINK = 17
+RTM_GETLINK = 18
+RTM_NEWADDR = 20
+RTM_DELADDR = 21
+RTM_GETADDR = 22
+
+# Flags
+NLM_F_REQUEST = 0x1
+NLM_F_DUMP = 0x300
+
+# Multicast groups (bitmask form for bind)
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+
+# Attributes
+IFLA_ADDRESS = 1
+IFLA_IFNAME = 3
+IFA_ADDRESS = 1
+IFA_LOCAL = 2
+
+IFF_UP = 0x1
+ARPHRD_ETHER = 1
+
+_NLMSGHDR = struct.Struct("=IHHII")
+_IFINFOMSG = struct.Struct("=BxHiII")
+_IFADDRMSG = struct.Struct("=BBBBI")
+_RTATTR = struct.Struct("=HH")
+
+def _align(length: int) -> int:
+    return (length + 3) & ~3
+
+def _parse_attrs(data: bytes, offset: int) -> Dict[int, bytes]:
+    attrs = {}
+    while offset + _RTATTR.size <= len(data):
+        length, attr_type = _RTATTR.unpack_from(data, offset)
+        if length < _RTATTR.size:
+            break
+        attrs[attr_type & 0x7FFF] = data[offset + _RTATTR.size:offset + length]
+        offset += _align(length)
+    return attrs
+
+def iter_messages(data: bytes) -> Iterator[Tuple[int, bytes]]:
+    """Splits a netlink datagram into (msg_type, payload) pairs."""
+    offset = 0
+    while offset + _NLMSGHDR.size <= len(data):
+        length, msg_type, _, _, _ = _NLMSGHDR.unpack_from(data, offset)
+        if length < _NLMSGHDR.size:
+            break
+        yield msg_type, data[offset + _NLMSGHDR.size:offset + length]
+        offset += _align(length)
+
+def open_socket(groups: int = 0) -> socket.socket:
+    """Opens an rtnetlink socket, subscribed to the given multicast groups."""
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    sock.bind((0, groups))
+    return sock
+
+def dump(msg_type: int, family: int = socket.AF_UNSPEC) -> List[Tuple[int, bytes]]:
+    """Performs an NLM_F_DUMP request and returns all (msg_type, payload) replies."""
+    if msg_type == RTM_GETLINK:
+        body = _IFINFOMSG.pack(family, 0, 0, 0, 0)
+    else:
+        body = _IFADDRMSG.pack(family, 0, 0, 0, 0)
+
+    seq = os.getpid() & 0xFFFF
+    request = _NLMSGHDR.pack(_NLMSGHDR.size + len(body), msg_type, NLM_F_REQUEST | NLM_F_DUMP, seq, 0) + body
+
+    replies = []
+    with open_socket() as sock:
+        sock.send(request)
+        while True:
+            data = sock.recv(65536)
+            for reply_type, payload in iter_messages(data):
+                if reply_type == NLMSG_DONE:
+                    return replies
+                if reply_type == NLMSG_ERROR:
+                    errno = -struct.unpack_from("=i", payload)[0]
+                    if errno:
+                        raise OSError(errno, os.strerror(errno))
+                    continue
+                replies.append((reply_type, payload))
+
+def parse_link(payload: bytes) -> Dict:
+    """Decodes an ifinfomsg: index, name, flags, MAC (only for Ethernet links)."""
+    _, link_type, index, flags, _ = _IFINFOMSG.unpack_from(payload)
+    attrs = _parse_attrs(payload, _IFINFOMSG.size)
+    mac = attrs.get(IFLA_ADDRESS)
+    return {
+        "index": index,
+        "name": attrs.get(IFLA_IFNAME, b"").rstrip(b"\0").decode(errors="replace"),
+        "flags": flags,
+        "mac_address": ":".join(f"{b:02x}" for b in mac) if mac and link_type == ARPHRD_ETHER else None,
+    }
+
+def parse_addr(payload: bytes) -> Optional[Dict]:
+    """Decodes an IPv4 ifaddrmsg: index, address, prefix length. Returns None for other families."""
+    family, prefixlen, _, _, index = _IFADDRMSG.unpack_from(payload)
+    if family != socket.AF_INET:
+        return None
+    attrs = _parse_attrs(payload, _IFADDRMSG.size)
+    raw = attrs.get(IFA_LOCAL) or attrs.get(IFA_ADDRESS)
+    if not raw:
+        return None
+    return {"index": index, "ip": socket.inet_ntoa(raw), "prefixlen": prefixlen}
@@ -0,0 +1,245 @@
+import os
+import copy
+import time
+import uuid
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import yaml
+
+import metrics
+import network_utils
+
+logger = logging.getLogger(__name__)
+
+# Netplan search path, lowest priority first. A file in /run hides a file with the
+# same name in /etc, which hides one in /lib. The remaining files are read in
+# lexicographic order of their name, later files amending earlier ones.
+NETPLAN_DIRS = ["/lib/netplan", "/etc/netplan", "/run/netplan"]
+# Only files here are edited; /lib belongs to packages and /run is volatile
+NETPLAN_WRITE_DIR = "/etc/netplan"
+# Used for interfaces not defined in any writable file (sorts last, so it wins)
+NETPLAN_MANAGED_FILE = os.path.join(NETPLAN_WRITE_DIR, "99-vpn-manager.yaml")
+
+DEVICE_SECTIONS = ("ethernets", "bonds", "bridges", "vlans", "wifis", "tunnels", "vrfs")
+MAX_ROLLBACK_TIMEOUT = 600
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+def get_config_files() -> List[str]:
+    """Returns the effective netplan files in the order netplan reads them."""
+    by_name = {}
+    for directory in NETPLAN_DIRS:
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            if name.endswith(".yaml"):
+                by_name[name] = os.path.join(directory, name)
+    return [by_name[name] for name in sorted(by_name)]
+
+def _merge(base, override):
+    """Netplan merge rules: mappings are merged, sequences appended, scalars replaced."""
+    if isinstance(base, dict) and isinstance(override, dict):
+        merged = dict(base)
+        for key, value in override.items():
+            merged[key] = _merge(base[key], value) if key in base else value
+        return merged
+    if isinstance(base, list) and isinstance(override, list):
+        return base + [item for item in override if item not in base]
+    return override
+
+class NetplanModel:
+    """Parsed netplan files plus their merged view and the file owning each interface."""
+    def __init__(self, files: Dict[str, Dict], raw: Dict[str, bytes]):
+        self.files = files
+        self.raw = raw
+        self.merged: Dict = {}
+        # interface -> (section, path of the last file defining it)
+        self.owners: Dict[str, Tuple[str, str]] = {}
+        for path, data in files.items():
+            self.merged = _merge(self.merged, data)
+            network = data.get("network") or {}
+            for section in DEVICE_SECTIONS:
+                for name in (network.get(section) or {}):
+                    self.owners[name] = (section, path)
+
+    def interface_config(self, name: str) -> Dict:
+        network = self.merged.get("network") or {}
+        for section in DEVICE_SECTIONS:
+            config = (network.get(section) or {}).get(name)
+            if config is not None:
+                return config
+        return {}
+
+    def writable_owner(self, name: str) -> Tuple[str, str]:
+        """(section, path) to write an interface to: its owning file if editable, else NETPLAN_MANAGED_FILE."""
+        section, path = self.owners.get(name, ("ethernets", None))
+        if path and os.path.dirname(path) == NETPLAN_WRITE_DIR:
+            return section, path
+        return section, NETPLAN_MANAGED_FILE
+
+_cache_lock = threading.Lock()
+_cache: Dict = {"stamps": None, "model": None}
+
+def load() -> NetplanModel:
+    """Returns the merged netplan model, reparsed only when a file was added, removed or modified."""
+    paths = get_config_files()
+    stamps = tuple((path, _file_stamp(path)) for path in paths)
+    with _cache_lock:
+        if _cache["stamps"] == stamps and _cache["model"] is not None:
+            metrics.cache_hit("netplan")
+            return _cache["model"]
+        metrics.cache_miss("netplan")
+
+        files, raw = {}, {}
+        for path in paths:
+            try:
+                with open(path, "rb") as f:
+                    raw[path] = f.read()
+                files[path] = yaml.safe_load(raw[path]) or {}
+            except (OSError, yaml.YAMLError) as e:
+                logger.error(f"Error reading or parsing netplan config {path}: {e}")
+                continue
+            if not isinstance(files[path], dict):
+                logger.error(f"Ignoring netplan config {path}: not a mapping")
+                del files[path]
+        model = NetplanModel(files, raw)
+        _cache["stamps"] = stamps
+        _cache["model"] = model
+        return model
+
+def get_interface_config(name: str) -> Dict:
+    return load().interface_config(name)
+
+def _render(data: Dict) -> bytes:
+    return yaml.dump(data, default_flow_style=False, sort_keys=False).encode()
+
+def _write_file(path: str, content: Optional[bytes]):
+    """Atomically writes a netplan file (0600, as netplan expects); None removes it."""
+    if content is None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+# --- Timed rollback (netplan try) ---
+
+_pending_lock = threading.Lock()
+_pending: Optional[Dict] = None
+
+def get_pending() -> Optional[Dict]:
+    with _pending_lock:
+        if not _pending:
+            return None
+        return {
+            "id": _pending["id"],
+            "interface": _pending["interface"],
+            "file": _pending["path"],
+            "expires_in": max(0, round(_pending["expires"] - time.monotonic())),
+        }
+
+def _rollback(change_id: str) -> bool:
+    global _pending
+    with _pending_lock:
+        if not _pending or _pending["id"] != change_id:
+            return False
+        pending, _pending = _pending, None
+    pending["timer"].cancel()
+
+    logger.warning(f"Rolling back netplan change on {pending['interface']} ({pending['path']}).")
+    _write_file(pending["path"], pending["previous"])
+    success, error = network_utils.apply_netplan_config()
+    if not success:
+        logger.error(f"Netplan rollback apply failed: {error}")
+    return True
+
+def confirm_pending(change_id: str) -> bool:
+    """Keeps a change applied with a rollback timeout. Returns False if it is unknown or already expired."""
+    global _pending
+    with _pending_lock:
+        if not _pending or _pending["id"] != change_id:
+            return False
+        _pending["timer"].cancel()
+        logger.info(f"Netplan change on {_pending['interface']} confirmed.")
+        _pending = None
+    return True
+
+def rollback_pending(change_id: str) -> bool:
+    """Reverts a pending change immediately."""
+    return _rollback(change_id)
+
+def set_interface_config(name: str, config: Dict, rollback_timeout: int = 0) -> Dict:
+    """
+    Writes the configuration of an interface into the file that owns it and applies it.
+    Nothing is written or applied when the rendered file would be byte-identical.
+    With `rollback_timeout` the previous file is restored (and applied again) unless
+    confirm_pending() is called in time.
+    Raises ValueError if another change is waiting for confirmation, RuntimeError on failure.
+    """
+    global _pending
+    with _pending_lock:
+        if _pending:
+            raise ValueError(f"Una modifica su {_pending['interface']} è in attesa di conferma.")
+
+        model = load()
+        section, path = model.writable_owner(name)
+        previous = model.raw.get(path)
+        data = copy.deepcopy(model.files.get(path) or {"network": {"version": 2, "renderer": "networkd"}})
+        if not isinstance(data.get("network"), dict):
+            data["network"] = {"version": 2}
+        network = data["network"]
+        if not isinstance(network.get(section), dict):
+            network[section] = {}
+
+        result = {"interface": name, "file": path, "changed": False, "applied": False, "pending_rollback": None}
+        if network[section].get(name) == config:
+            return result
+        network[section][name] = config
+        content = _render(data)
+        if content == previous:
+            return result
+
+        try:
+            _write_file(path, content)
+        except OSError as e:
+            raise RuntimeError(f"Impossibile scrivere {path}: {e}")
+        result["changed"] = True
+
+        success, error = network_utils.apply_netplan_config()
+        if not success:
+            # Never leave a file netplan rejected on disk
+            _write_file(path, previous)
+            network_utils.apply_netplan_config()
+            raise RuntimeError(f"netplan apply fallito, configurazione precedente ripristinata: {error}")
+        result["applied"] = True
+
+        if rollback_timeout:
+            change_id = uuid.uuid4().hex
+            timer = threading.Timer(rollback_timeout, _rollback, args=(change_id,))
+            timer.daemon = True
+            _pending = {
+                "id": change_id,
+                "interface": name,
+                "path": path,
+                "previous": previous,
+                "timer": timer,
+                "expires": time.monotonic() + rollback_timeout,
+            }
+            timer.start()
+            result["pending_rollback"] = {"id": change_id, "expires_in": rollback_timeout}
+        return result
@@ -1,20 +1,148 @@
 import subprocess
 import logging
-from typing import List, Dict, Optional
+import socket
+import struct
+import fcntl
+import threading
+from typing import List, Dict, Optional, Tuple
 import re
+import metrics
+import netlink
 
 logger = logging.getLogger(__name__)
 
+PROC_NET_ROUTE = "/proc/net/route"
+RTF_UP = 0x0001
+SIOCGIFADDR = 0x8915
+
+_monitor_start_lock = threading.Lock()
+
+# Interfaces hidden from the dashboard (loopback and common virtual/internal interfaces)
+SKIPPED_INTERFACE_PREFIXES = ('lo', 'tun', 'tap', 'docker', 'veth', 'br-', 'lxc', 'bond')
+
+class InterfaceMonitor:
+    """
+    In-memory view of links and IPv4 addresses, loaded with one rtnetlink dump and then
+    kept current by a background thread subscribed to RTM_NEWLINK/RTM_NEWADDR events.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._links: Dict[int, Dict] = {}
+        self._addrs: Dict[int, List[Dict]] = {}
+        self._thread: Optional[threading.Thread] = None
+        self.available = True
+
+    def _resync(self):
+        links = {}
+        for _, payload in netlink.dump(netlink.RTM_GETLINK):
+            link = netlink.parse_link(payload)
+            links[link["index"]] = link
+        addrs: Dict[int, List[Dict]] = {}
+        for _, payload in netlink.dump(netlink.RTM_GETADDR, socket.AF_INET):
+            addr = netlink.parse_addr(payload)
+            if addr:
+                addrs.setdefault(addr["index"], []).append(addr)
+        with self._lock:
+            self._links = links
+            self._addrs = addrs
+
+    def _apply(self, msg_type: int, payload: bytes):
+        with self._lock:
+            if msg_type in (netlink.RTM_NEWLINK, netlink.RTM_DELLINK):
+                link = netlink.parse_link(payload)
+                if msg_type == netlink.RTM_NEWLINK:
+                    self._links[link["index"]] = link
+                else:
+                    self._links.pop(link["index"], None)
+                    self._addrs.pop(link["index"], None)
+            elif msg_type in (netlink.RTM_NEWADDR, netlink.RTM_DELADDR):
+                addr = netlink.parse_addr(payload)
+                if not addr:
+                    return
+                current = [a for a in self._addrs.get(addr["index"], []) if a["ip"] != addr["ip"]]
+                if msg_type == netlink.RTM_NEWADDR:
+                    current.append(addr)
+                self._addrs[addr["index"]] = current
+
+    def _watch(self, sock):
+        while True:
+            try:
+                data = sock.recv(65536)
+            except OSError as e:
+                # ENOBUFS: events were dropped, the cached view may be stale
+                logger.warning(f"Netlink event stream interrupted ({e}), resyncing interfaces.")
+                try:
+                    self._resync()
+                except OSError as resync_error:
+                    logger.error(f"Interface resync failed: {resync_error}")
+                continue
+            for msg_type, payload in netlink.iter_messages(data):
+                self._apply(msg_type, payload)
+
+    def start(self) -> bool:
+        """Loads the initial state and starts the event thread. Returns False if netlink is unavailable."""
+        if self._thread or not self.available:
+            return self.available
+        try:
+            # Subscribe before the dump so no event between the two is lost
+            sock = netlink.open_socket(netlink.RTMGRP_LINK | netlink.RTMGRP_IPV4_IFADDR)
+            self._resync()
+        except (OSError, AttributeError) as e:
+            logger.warning(f"rtnetlink not available, falling back to the ip command: {e}")
+            self.available = False
+            return False
+        self._thread = threading.Thread(target=self._watch, args=(sock,), name="netlink-interfaces", daemon=True)
+        self._thread.start()
+        return True
+
+    def snapshot(self) -> Tuple[Dict[int, Dict], Dict[int, List[Dict]]]:
+        with self._lock:
+            return dict(self._links), {i: list(a) for i, a in self._addrs.items()}
+
+interface_monitor = InterfaceMonitor()
+
 def get_network_interfaces() -> List[Dict[str, str]]:
     """
     Returns a list of network interfaces with their IP addresses, MAC, and status.
     Each interface is represented as a dict with: name, ip, netmask, cidr, mac_address, link_status.
+    Answers from the netlink-maintained cache; no subprocess is spawned.
+    """
+    with _monitor_start_lock:
+        started = interface_monitor.start()
+    if not started:
+        return _get_network_interfaces_ip_command()
+
+    links, addrs = interface_monitor.snapshot()
+    interfaces = []
+    for index in sorted(addrs):
+        link = links.get(index)
+        if not link or link["name"].startswith(SKIPPED_INTERFACE_PREFIXES) or not addrs[index]:
+            continue
+        configured_ips = [
+            {"ip": a["ip"], "netmask": _cidr_to_netmask(a["prefixlen"]), "cidr": str(a["prefixlen"])}
+            for a in addrs[index]
+        ]
+        interfaces.append({
+            "name": link["name"],
+            "ip": configured_ips[0]["ip"],
+            "netmask": configured_ips[0]["netmask"],
+            "cidr": configured_ips[0]["cidr"],
+            "mac_address": link["mac_address"],
+            "link_status": "UP" if link["flags"] & netlink.IFF_UP else "DOWN",
+            "configured_ips": configured_ips,
+        })
+    return interfaces
+
+def _get_network_interfaces_ip_command() -> List[Dict[str, str]]:
+    """
+    Fallback for get_network_interfaces() when rtnetlink is not available:
+    parses the output of `ip -o link show` and `ip -o addr show`.
     """
     interfaces = []
     
     try:
         # Use 'ip -o link show' to get link status and MAC addresses
-        link_result = subprocess.run(
+        link_result = metrics.run(
             ["/usr/sbin/ip", "-o", "link", "show"],
             capture_output=True,
             text=True,
@@ -31,7 +159,7 @@ def get_network_interfaces() -> List[Dict[str, str]]:
                 link_info[name] = {"mac_address": mac_address, "link_status": link_status}
         
         # Use 'ip -o addr show' to get IP addresses
-        addr_result = subprocess.run(
+        addr_result = metrics.run(
             ["/usr/sbin/ip", "-o", "addr", "show"],
             capture_output=True,
             text=True,
@@ -48,7 +176,7 @@ def get_network_interfaces() -> List[Dict[str, str]]:
             interface_name = parts[1].rstrip(':')
             
             # Skip loopback and common virtual/internal interfaces
-            if interface_name.startswith(('lo', 'tun', 'tap', 'docker', 'veth', 'br-', 'lxc', 'bond')):
+            if interface_name.startswith(SKIPPED_INTERFACE_PREFIXES):
                 continue
             
             # Only process inet (IPv4) addresses for now
@@ -102,6 +230,52 @@ def _cidr_to_netmask(cidr: int) -> str:
     mask = (0xFFFFFFFF >> (32 - cidr)) << (32 - cidr)
     return f"{(mask >> 24) & 0xFF}.{(mask >> 16) & 0xFF}.{(mask >> 8) & 0xFF}.{mask & 0xFF}"
 
+def get_default_route_interface() -> Optional[str]:
+    """
+    Returns the interface of the IPv4 default route by reading /proc/net/route.
+    If multiple default routes exist, the one with the lowest metric wins.
+    """
+    best_iface = None
+    best_metric = None
+    try:
+        with open(PROC_NET_ROUTE, "r") as f:
+            next(f, None) # Skip header
+            for line in f:
+                fields = line.split()
+                if len(fields) < 8:
+                    continue
+                iface, destination, flags, metric, mask = fields[0], fields[1], fields[3], fields[6], fields[7]
+                if destination != "00000000" or mask != "00000000":
+                    continue
+                if not int(flags, 16) & RTF_UP:
+                    continue
+                if best_metric is None or int(metric) < best_metric:
+                    best_iface = iface
+                    best_metric = int(metric)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read default route from {PROC_NET_ROUTE}: {e}")
+    return best_iface
+
+def get_interface_ipv4(name: str) -> Optional[str]:
+    """Returns the primary IPv4 address of an interface using the SIOCGIFADDR ioctl."""
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+            packed = fcntl.ioctl(s.fileno(), SIOCGIFADDR, struct.pack("256s", name[:15].encode()))
+            return socket.inet_ntoa(packed[20:24])
+    except OSError as e:
+        logger.warning(f"Could not read IPv4 address of interface '{name}': {e}")
+        return None
+
+def detect_local_endpoint() -> Optional[str]:
+    """
+    Detects the address clients should use to reach this host, without any external call.
+    Uses the address of the default route interface.
+    """
+    iface = get_default_route_interface()
+    if not iface:
+        return None
+    return get_interface_ipv4(iface)
+
 def get_interface_by_name(name: str) -> Optional[Dict[str, str]]:
     """Get a specific interface by name."""
     interfaces = get_network_interfaces()
@@ -110,48 +284,10 @@ def get_interface_by_name(name: str) -> Optional[Dict[str, str]]:
             return iface
     return None
 
-def get_netplan_config_files() -> List[str]:
-    """Lists all .yaml files in /etc/netplan/."""
-    try:
-        result = subprocess.run(
-            ["find", "/etc/netplan/", "-name", "*.yaml"],
-            capture_output=True,
-            text=True,
-            check=True
-        )
-        return result.stdout.splitlines()
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Failed to list netplan config files: {e}")
-        return []
-
-def read_netplan_config(file_path: str) -> Optional[Dict]:
-    """Reads and parses a YAML netplan configuration file."""
-    try:
-        import yaml
-        with open(file_path, 'r') as f:
-            return yaml.safe_load(f)
-    except FileNotFoundError:
-        logger.warning(f"Netplan config file not found: {file_path}")
-        return None
-    except Exception as e:
-        logger.error(f"Error reading or parsing netplan config {file_path}: {e}")
-        return None
-
-def write_netplan_config(file_path: str, config_data: Dict) -> bool:
-    """Writes a dictionary as a YAML netplan configuration file."""
-    try:
-        import yaml
-        with open(file_path, 'w') as f:
-            yaml.dump(config_data, f, default_flow_style=False, sort_keys=False)
-        return True
-    except Exception as e:
-        logger.error(f"Error writing netplan config to {file_path}: {e}")
-        return False
-
 def apply_netplan_config() -> (bool, Optional[str]):
     """Applies the netplan configuration."""
     try:
-        subprocess.run(["/usr/sbin/netplan", "apply"], check=True, capture_output=True, text=True)
+        metrics.run(["/usr/sbin/netplan", "apply"], check=True, capture_output=True, text=True)
         return True, None
     except subprocess.CalledProcessError as e:
         error_msg = f"netplan apply error (exit code {e.returncode}): {e.stderr.strip()}"
@@ -0,0 +1,37 @@
+from array import array
+from typing import List
+
+class RingBuffer:
+    """
+    Fixed-size circular buffer backed by a typed array (no per-sample Python objects).
+    Once full, each append overwrites the oldest value.
+    """
+    __slots__ = ("_data", "_size", "_next", "_count")
+
+    def __init__(self, size: int, typecode: str = "d"):
+        self._data = array(typecode, bytes(array(typecode).itemsize * size))
+        self._size = size
+        self._next = 0
+        self._count = 0
+
+    def append(self, value):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self._size
+        if self._count < self._size:
+            self._count += 1
+
+    def last(self, default=None):
+        if not self._count:
+            return default
+        return self._data[self._next - 1]
+
+    def values(self, limit: int = 0) -> List:
+        """Returns the stored values oldest first; `limit` keeps only the most recent ones."""
+        count = self._count if not limit else min(limit, self._count)
+        start = self._next - count
+        if start >= 0:
+            return self._data[start:self._next].tolist()
+        return self._data[start:].tolist() + self._data[:self._next].tolist()
+
+    def __len__(self) -> int:
+        return self._count
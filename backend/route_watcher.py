@@ -0,0 +1,86 @@
+import os
+import socket
+import logging
+import threading
+from typing import Optional
+
+import netlink
+import network_utils
+import iptables_manager
+import instance_manager
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two reads of /proc/net/route when no netlink event arrives
+ROUTE_WATCH_INTERVAL = int(os.getenv("ROUTE_WATCH_INTERVAL", "10"))
+
+class RouteWatcher:
+    """
+    Tracks the IPv4 default route. Route changes are signalled by rtnetlink
+    (RTMGRP_IPV4_ROUTE), with a periodic /proc/net/route read as a fallback. When the
+    uplink changes, iptables_manager.DEFAULT_INTERFACE is updated and the per-instance
+    NAT/forward rules are moved to the new interface in one iptables-restore transaction.
+    """
+    def __init__(self, interval: int = ROUTE_WATCH_INTERVAL):
+        self.interval = interval
+        self.current: Optional[str] = None
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        if self._thread:
+            return
+        self.current = iptables_manager.DEFAULT_INTERFACE
+        self._thread = threading.Thread(target=self._run, name="route-watcher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # Rules saved before a restart may still reference a previous uplink
+        self.check(force=True)
+
+        sock = None
+        try:
+            sock = netlink.open_socket(netlink.RTMGRP_IPV4_ROUTE)
+            sock.settimeout(self.interval)
+        except (OSError, AttributeError) as e:
+            logger.warning(f"Route events not available, polling /proc/net/route every {self.interval}s: {e}")
+
+        stop = threading.Event()
+        while True:
+            if sock:
+                try:
+                    sock.recv(65536)
+                except socket.timeout:
+                    pass
+                except OSError as e:
+                    logger.warning(f"Route event stream interrupted: {e}")
+            else:
+                stop.wait(self.interval)
+            self.check()
+
+    def check(self, force: bool = False) -> bool:
+        """Re-reads the default route and moves the uplink rules if it changed. Returns True if rules were synced."""
+        iface = network_utils.get_default_route_interface()
+        if not iface:
+            return False
+
+        with self._lock:
+            if iface == self.current and not force:
+                return False
+
+            previous = self.current
+            instances = [(i.tun_interface, i.subnet) for i in instance_manager.get_all_instances()]
+            success, moved = iptables_manager.sync_openvpn_uplink(instances, iface)
+            if not success:
+                # Keep the old value so the next check retries
+                return False
+
+            iptables_manager.DEFAULT_INTERFACE = iface
+            self.current = iface
+            if previous != iface:
+                logger.info(f"Default route moved from {previous} to {iface}.")
+            if moved:
+                instance_manager.save_iptables_rules()
+            return True
+
+route_watcher = RouteWatcher()
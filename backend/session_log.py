@@ -0,0 +1,223 @@
+import os
+import shutil
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Session accounting. OpenVPN runs SESSION_HOOK_SCRIPT (plain sh, no Python startup)
+# on client-connect/client-disconnect; it appends one tab-separated line per event to
+# the append-only log of the instance:
+#   C  start  client  real_ip  virtual_ip
+#   D  start  client  real_ip  virtual_ip  duration  bytes_received  bytes_sent
+# The backend tails each log incrementally and keeps the sessions indexed by client
+# and by start time. No D line is written when OpenVPN is killed or the host goes down:
+# without duplicate-cn a client has one session at a time, so its next C line closes
+# the sessions it left open, at an unknown time before that connection.
+
+SESSION_LOG_DIR = os.getenv("SESSION_LOG_DIR", "/var/log/openvpn/sessions")
+SESSION_HOOK_SCRIPT = os.getenv("SESSION_HOOK_SCRIPT", "/opt/vpn-manager/scripts/session-log.sh")
+# OpenVPN drops privileges before running the hooks
+OPENVPN_USER, OPENVPN_GROUP = "nobody", "nogroup"
+MAX_SESSION_RESULTS = 1000
+
+def log_path(instance_name: str) -> str:
+    return os.path.join(SESSION_LOG_DIR, f"sessions_{instance_name}.log")
+
+def hook_config_lines(instance_name: str) -> List[str]:
+    """OpenVPN directives installing the hooks, or nothing if the hook script is missing."""
+    if not os.path.exists(SESSION_HOOK_SCRIPT):
+        logger.warning(f"Session hook {SESSION_HOOK_SCRIPT} not found, sessions of '{instance_name}' will not be logged")
+        return []
+    try:
+        os.makedirs(SESSION_LOG_DIR, exist_ok=True)
+        shutil.chown(SESSION_LOG_DIR, OPENVPN_USER, OPENVPN_GROUP)
+    except (OSError, LookupError) as e:
+        logger.warning(f"Cannot prepare {SESSION_LOG_DIR} for OpenVPN: {e}")
+    command = f"{SESSION_HOOK_SCRIPT} {log_path(instance_name)}"
+    return [
+        "script-security 2",
+        f'client-connect "{command}"',
+        f'client-disconnect "{command}"',
+    ]
+
+class _SessionList:
+    """
+    Sessions sorted by start. The longest closed duration bounds how far before a range
+    a session overlapping it can start; open sessions are kept apart since they have no end yet.
+    """
+    def __init__(self):
+        self.starts: List[int] = []
+        self.sessions: List[Dict] = []
+        self.open: List[Dict] = []
+        self.max_duration = 0
+
+    def add(self, session: Dict):
+        index = bisect_right(self.starts, session["start"])
+        self.starts.insert(index, session["start"])
+        self.sessions.insert(index, session)
+        self.open.append(session)
+
+    def closed(self, session: Dict):
+        self.open.remove(session)
+        self.ended(session)
+
+    def ended(self, session: Dict):
+        """Records the end of a closed session (set again by a late D record)."""
+        self.max_duration = max(self.max_duration, session["end"] - session["start"])
+
+    def overlapping(self, start: int, end: int) -> List[Dict]:
+        """Sessions active at some point in [start, end], newest first."""
+        lo = bisect_left(self.starts, start - self.max_duration)
+        hi = bisect_right(self.starts, end)
+        result = [s for s in self.sessions[lo:hi] if s["end"] is not None and s["end"] >= start]
+        result.extend(s for s in self.open if s["start"] <= end)
+        result.sort(key=lambda s: s["start"], reverse=True)
+        return result
+
+class SessionLog:
+    """The indexed sessions of one instance, read incrementally from its log."""
+    def __init__(self, instance_name: str):
+        self.instance_name = instance_name
+        self.path = log_path(instance_name)
+        self._reset()
+
+    def _reset(self):
+        self._inode = None
+        self._offset = 0
+        self._partial = b""
+        self._all = _SessionList()
+        self._by_client: Dict[str, _SessionList] = {}
+        # (client, start, real_ip) -> session still open, or closed by a later connection
+        self._open: Dict[Tuple[str, int, str], Dict] = {}
+        self._unknown_end: Dict[Tuple[str, int, str], Dict] = {}
+
+    def refresh(self):
+        """Parses the lines appended since the last call (restarts if the log was rotated)."""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._inode is not None:
+                self._reset()
+            return
+        if st.st_ino != self._inode or st.st_size < self._offset:
+            self._reset()
+            self._inode = st.st_ino
+        if st.st_size == self._offset:
+            return
+
+        with open(self.path, "rb") as f:
+            f.seek(self._offset)
+            data = self._partial + f.read(st.st_size - self._offset)
+        self._offset = st.st_size
+        lines = data.split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._parse(line.decode(errors="replace"))
+
+    def _parse(self, line: str):
+        fields = line.split("\t")
+        try:
+            if fields[0] == "C" and len(fields) == 5:
+                self._connect(int(fields[1]), fields[2], fields[3], fields[4])
+            elif fields[0] == "D" and len(fields) == 8:
+                self._disconnect(int(fields[1]), fields[2], fields[3], fields[4],
+                                 int(fields[5]), int(fields[6]), int(fields[7]))
+            elif line:
+                logger.warning(f"Malformed session record in {self.path}: {line!r}")
+        except ValueError:
+            logger.warning(f"Malformed session record in {self.path}: {line!r}")
+
+    def _add(self, session: Dict):
+        self._all.add(session)
+        self._by_client.setdefault(session["client_name"], _SessionList()).add(session)
+
+    def _connect(self, start: int, client: str, real_ip: str, virtual_ip: str):
+        sessions = self._by_client.get(client)
+        if sessions:
+            for stale in [s for s in sessions.open if s["start"] <= start]:
+                self._close_unknown(stale, start)
+        session = {
+            "client_name": client,
+            "instance": self.instance_name,
+            "real_ip": real_ip,
+            "virtual_ip": virtual_ip or None,
+            "start": start,
+            "end": None,
+            "duration": None,
+            "bytes_received": None,
+            "bytes_sent": None,
+            "end_unknown": False,
+        }
+        self._open[(client, start, real_ip)] = session
+        self._add(session)
+
+    def _close_unknown(self, session: Dict, before: int):
+        """Closes a session whose D record is missing; `before` is the latest it can have ended."""
+        key = (session["client_name"], session["start"], session["real_ip"])
+        self._unknown_end[key] = self._open.pop(key)
+        session.update({"end": before, "end_unknown": True})
+        self._all.closed(session)
+        self._by_client[session["client_name"]].closed(session)
+
+    def _disconnect(self, start: int, client: str, real_ip: str, virtual_ip: str,
+                    duration: int, received: int, sent: int):
+        key = (client, start, real_ip)
+        # A D record coming after the client's next connection still knows the real end
+        late = self._unknown_end.pop(key, None)
+        session = late or self._open.pop(key, None)
+        if session is None:
+            # Connected before the log began
+            self._connect(start, client, real_ip, virtual_ip)
+            session = self._open.pop(key)
+        session.update({
+            "virtual_ip": virtual_ip or session["virtual_ip"],
+            "end": start + duration,
+            "duration": duration,
+            "bytes_received": received,
+            "bytes_sent": sent,
+            "end_unknown": False,
+        })
+        for sessions in (self._all, self._by_client[client]):
+            if late:
+                sessions.ended(session)
+            else:
+                sessions.closed(session)
+
+    def query(self, client_name: Optional[str], start: int, end: int) -> List[Dict]:
+        sessions = self._all if client_name is None else self._by_client.get(client_name)
+        if sessions is None:
+            return []
+        return sessions.overlapping(start, end)
+
+class SessionStore:
+    """SessionLogs of all instances, created on first query."""
+    def __init__(self):
+        self._logs: Dict[str, SessionLog] = {}
+        self._lock = threading.Lock()
+
+    def query(self, instance_name: str, client_name: Optional[str], start: int, end: int,
+              limit: int = MAX_SESSION_RESULTS) -> Dict:
+        """
+        Sessions of an instance (or of one client) active at some point between two
+        epochs, newest first. Sessions still open have end = None; sessions closed by the
+        client's next connection have end_unknown = True and end = that connection's start.
+        """
+        with self._lock:
+            log = self._logs.get(instance_name)
+            if log is None:
+                log = self._logs[instance_name] = SessionLog(instance_name)
+            try:
+                log.refresh()
+            except OSError as e:
+                logger.error(f"Error reading session log {log.path}: {e}")
+            sessions = log.query(client_name, start, end)
+        return {
+            "sessions": [dict(s) for s in sessions[:limit]],
+            "total": len(sessions),
+            "truncated": len(sessions) > limit,
+        }
+
+session_store = SessionStore()
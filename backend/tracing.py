@@ -0,0 +1,227 @@
+import io
+import os
+import sys
+import time
+import uuid
+import pstats
+import cProfile
+import inspect
+import logging
+import functools
+import threading
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Opt-in per-request tracing. A traced request records every subprocess it spawns,
+# every file it opens and the inclusive time of each manager function it calls, and
+# can also be profiled with cProfile. The trace follows the request through the
+# threadpool because it lives in a ContextVar; untraced code pays one ContextVar
+# lookup per instrumented call.
+#
+# REQUEST_TRACING: "off" (no instrumentation), "header" (requests sending
+# X-Trace: 1 or X-Trace: profile with a valid API key), "all" (every request).
+
+REQUEST_TRACING = os.getenv("REQUEST_TRACING", "header").lower()
+TRACE_HISTORY = int(os.getenv("TRACE_HISTORY", "50"))
+# When set, profiles are also written there as <trace id>.prof (for snakeviz & co.)
+TRACE_PROFILE_DIR = os.getenv("TRACE_PROFILE_DIR", "")
+TRACE_HEADER = "X-Trace"
+MAX_TRACE_EVENTS = 500
+PROFILE_LINES = 40
+
+_IGNORED_FILE_SUFFIXES = (".py", ".pyc", ".so")
+
+class Trace:
+    def __init__(self, method: str, path: str, profile: bool = False):
+        self.id = uuid.uuid4().hex[:16]
+        self.method = method
+        self.path = path
+        self.route: Optional[str] = None
+        self.status: Optional[int] = None
+        self.started = time.time()
+        self._start = time.perf_counter()
+        self.duration = 0.0
+        self.subprocesses: List[Dict] = []
+        self.files: List[Dict] = []
+        self.functions: Dict[str, List[float]] = {}  # name -> [calls, inclusive seconds]
+        self.dropped = 0
+        self.profiler = cProfile.Profile() if profile else None
+        self.profile: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _append(self, events: List[Dict], event: Dict):
+        with self._lock:
+            if len(self.subprocesses) + len(self.files) >= MAX_TRACE_EVENTS:
+                self.dropped += 1
+            else:
+                events.append(event)
+
+    def finish(self, status: int, route: Optional[str]):
+        self.duration = time.perf_counter() - self._start
+        self.status = status
+        self.route = route
+        if self.profiler:
+            stream = io.StringIO()
+            stats = pstats.Stats(self.profiler, stream=stream)
+            stats.sort_stats("cumulative").print_stats(PROFILE_LINES)
+            self.profile = stream.getvalue()
+            if TRACE_PROFILE_DIR:
+                try:
+                    os.makedirs(TRACE_PROFILE_DIR, exist_ok=True)
+                    self.profiler.dump_stats(os.path.join(TRACE_PROFILE_DIR, f"{self.id}.prof"))
+                except OSError as e:
+                    logger.warning(f"Cannot write profile of trace {self.id}: {e}")
+            self.profiler = None
+
+    def summary(self) -> str:
+        """Compact form for the response header."""
+        sub_time = sum(s["duration_ms"] for s in self.subprocesses)
+        reads = sum(1 for f in self.files if f["mode"] == "r")
+        parts = [
+            f"id={self.id}",
+            f"total={self.duration * 1000:.1f}ms",
+            f"subprocess={len(self.subprocesses)}/{sub_time:.1f}ms",
+            f"files={reads}r/{len(self.files) - reads}w",
+        ]
+        slowest = sorted(self.functions.items(), key=lambda f: f[1][1], reverse=True)[:3]
+        if slowest:
+            parts.append("slowest=" + ",".join(f"{name}:{seconds * 1000:.1f}ms" for name, (_, seconds) in slowest))
+        return ";".join(parts)
+
+    def to_dict(self) -> Dict:
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "status": self.status,
+            "started": self.started,
+            "duration_ms": round(self.duration * 1000, 3),
+            "subprocesses": self.subprocesses,
+            "files": self.files,
+            "functions": sorted(
+                ({"name": name, "calls": int(calls), "total_ms": round(seconds * 1000, 3)}
+                 for name, (calls, seconds) in self.functions.items()),
+                key=lambda f: f["total_ms"], reverse=True),
+            "dropped_events": self.dropped,
+            "profile": self.profile,
+        }
+
+_current: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_history: deque = deque(maxlen=TRACE_HISTORY)
+_history_lock = threading.Lock()
+# Depth of instrumented calls per thread, to profile only the outermost one
+_local = threading.local()
+_audit_installed = False
+
+def enabled() -> bool:
+    return REQUEST_TRACING in ("header", "all")
+
+def start(method: str, path: str, requested: Optional[str]) -> Optional[Trace]:
+    """Starts a trace for the current request if tracing applies to it."""
+    if REQUEST_TRACING == "all" or (REQUEST_TRACING == "header" and requested):
+        trace = Trace(method, path, profile=requested == "profile")
+        _current.set(trace)
+        return trace
+    return None
+
+def finish(trace: Trace, status: int, route: Optional[str]):
+    _current.set(None)
+    trace.finish(status, route)
+    with _history_lock:
+        _history.append(trace)
+
+def get_traces() -> List[Dict]:
+    with _history_lock:
+        traces = list(_history)
+    return [{"id": t.id, "method": t.method, "path": t.path, "status": t.status,
+             "started": t.started, "summary": t.summary()} for t in reversed(traces)]
+
+def get_trace(trace_id: str) -> Optional[Dict]:
+    with _history_lock:
+        trace = next((t for t in _history if t.id == trace_id), None)
+    return trace.to_dict() if trace else None
+
+# --- Recording hooks ---
+
+def record_subprocess(cmd, command_type: str, duration: float, returncode: Optional[int]):
+    trace = _current.get()
+    if trace is None:
+        return
+    command = cmd if isinstance(cmd, str) else " ".join(str(word) for word in cmd)
+    trace._append(trace.subprocesses, {
+        "command": command[:300],
+        "type": command_type,
+        "duration_ms": round(duration * 1000, 3),
+        "returncode": returncode,
+    })
+
+def _audit_hook(event: str, args):
+    if event != "open":
+        return
+    trace = _current.get()
+    if trace is None:
+        return
+    path, mode, flags = args
+    if not isinstance(path, str) or path.endswith(_IGNORED_FILE_SUFFIXES):
+        return
+    if mode:
+        kind = "r" if mode.startswith("r") and "+" not in mode else "w"
+    else:
+        kind = "r" if not flags & (os.O_WRONLY | os.O_RDWR) else "w"
+    trace._append(trace.files, {"path": path, "mode": kind})
+
+def _timed(name: str, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        trace = _current.get()
+        if trace is None:
+            return func(*args, **kwargs)
+        depth = getattr(_local, "depth", 0)
+        _local.depth = depth + 1
+        profiling = False
+        if depth == 0 and trace.profiler:
+            try:
+                trace.profiler.enable()
+                profiling = True
+            except ValueError:
+                pass  # another profiler is active (e.g. a concurrent profiled request)
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start_time
+            if profiling:
+                trace.profiler.disable()
+            _local.depth = depth
+            with trace._lock:
+                entry = trace.functions.setdefault(name, [0, 0.0])
+                entry[0] += 1
+                entry[1] += elapsed
+    wrapper._traced = True
+    return wrapper
+
+def _instrumentable(func) -> bool:
+    return (inspect.isfunction(func) and not getattr(func, "_traced", False) and "<locals>" not in func.__qualname__
+            and not inspect.isgeneratorfunction(func) and not inspect.iscoroutinefunction(func))
+
+def instrument(*module_names: str):
+    """Wraps the functions and plain methods defined in the given (imported) modules with timers."""
+    global _audit_installed
+    if not enabled():
+        return
+    if not _audit_installed:
+        sys.addaudithook(_audit_hook)
+        _audit_installed = True
+    for prefix in module_names:
+        module = sys.modules[prefix]
+        for attr, value in list(vars(module).items()):
+            if _instrumentable(value) and value.__module__ == prefix:
+                setattr(module, attr, _timed(f"{prefix}.{attr}", value))
+            elif inspect.isclass(value) and value.__module__ == prefix and not hasattr(value, "__fields__"):
+                for name, method in list(vars(value).items()):
+                    if not name.startswith("__") and _instrumentable(method):
+                        setattr(value, name, _timed(f"{prefix}.{value.__name__}.{name}", method))
@@ -0,0 +1,178 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+import instance_manager
+import iptables_manager
+import ip_manager
+
+logger = logging.getLogger(__name__)
+
+# Persistent per-client byte accounting in the kernel. One counting rule per direction
+# and static IP (no target, so packets just continue) lives in ACCOUNTING_CHAIN, jumped
+# to first from FORWARD. The sampler reads and zeroes the chain in one iptables call and
+# folds the deltas into per-month totals on disk, so usage survives reconnections and
+# OpenVPN/backend restarts. Clients without a static IP are not accounted.
+
+ACCOUNTING_CHAIN = iptables_manager.ACCOUNTING_CHAIN
+ACCOUNTING_FILE = os.getenv("ACCOUNTING_FILE", "/opt/vpn-manager/backend/data/accounting.json")
+# Seconds between two reads of the kernel counters (bytes since the last read are lost on a crash)
+ACCOUNTING_INTERVAL = int(os.getenv("ACCOUNTING_INTERVAL", "60"))
+
+_COUNTER_LINE = re.compile(r"^\s*\d+\s+(\d+)\s.*/\* acct (\S+) (\S+) (rx|tx) \*/")
+MONTH_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+
+def _iptables(args: List[str]) -> subprocess.CompletedProcess:
+    cmd = ["iptables", "-w"] + args
+    try:
+        return metrics.run(cmd, capture_output=True, text=True)
+    except OSError as e:
+        return subprocess.CompletedProcess(cmd, 127, "", str(e))
+
+def current_month(now: Optional[float] = None) -> str:
+    return time.strftime("%Y-%m", time.localtime(now))
+
+class TrafficAccounting:
+    def __init__(self, path: str = ACCOUNTING_FILE, interval: int = ACCOUNTING_INTERVAL):
+        self.path = path
+        self.interval = interval
+        self.lock = threading.Lock()
+        self._install_lock = threading.Lock()
+        # instance -> client -> month -> [rx, tx]
+        self._totals: Dict[str, Dict[str, Dict[str, List[int]]]] = self._load()
+        self._thread: Optional[threading.Thread] = None
+
+    def _load(self) -> Dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Error reading accounting totals {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._totals, f, separators=(",", ":"))
+        os.replace(tmp_path, self.path)
+
+    def start(self):
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, name="traffic-accounting", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        stop = threading.Event()
+        # After a reboot the chain is gone until the firewall is compiled again
+        if _iptables(["-n", "-L", ACCOUNTING_CHAIN]).returncode != 0:
+            try:
+                self.install_rules(instance_manager.list_instances())
+            except Exception as e:
+                logger.error(f"Installing accounting rules failed: {e}")
+        while True:
+            stop.wait(self.interval)
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Accounting sample failed: {e}")
+
+    def _read_and_zero(self) -> Dict[Tuple[str, str], List[int]]:
+        """Reads the counters of the chain and zeroes them in the same iptables call."""
+        result = _iptables(["-L", ACCOUNTING_CHAIN, "-n", "-v", "-x", "-Z"])
+        if result.returncode != 0:
+            return {}
+        deltas: Dict[Tuple[str, str], List[int]] = {}
+        for line in result.stdout.splitlines():
+            match = _COUNTER_LINE.match(line)
+            if not match:
+                continue
+            nbytes, instance_name, client_name, direction = match.groups()
+            entry = deltas.setdefault((instance_name, client_name), [0, 0])
+            entry[0 if direction == "rx" else 1] += int(nbytes)
+        return deltas
+
+    def sample(self):
+        """Folds the bytes counted since the previous sample into the monthly totals."""
+        with self.lock:
+            self._fold()
+
+    def _fold(self):
+        month = current_month()
+        changed = False
+        for (instance_name, client_name), (rx, tx) in self._read_and_zero().items():
+            if not rx and not tx:
+                continue
+            months = self._totals.setdefault(instance_name, {}).setdefault(client_name, {})
+            totals = months.setdefault(month, [0, 0])
+            totals[0] += rx
+            totals[1] += tx
+            changed = True
+        if changed:
+            self._save()
+
+    def install_rules(self, instances: List):
+        """
+        (Re)builds the counting rules from the static IPs of every instance, in one
+        iptables-restore transaction. Pending counters are folded first, so rebuilding
+        loses nothing.
+        """
+        lines = []
+        for inst in instances:
+            for client_name, ip in sorted(ip_manager.get_static_ips(inst.name, inst.subnet).items()):
+                for direction, match in (("rx", "-s"), ("tx", "-d")):
+                    lines.append(f'-A {ACCOUNTING_CHAIN} {match} {ip} -m comment --comment "acct {inst.name} {client_name} {direction}"')
+        rules = len(lines)
+
+        # Readers only wait for the fold, not for the whole rebuild
+        with self._install_lock, metrics.firewall_apply_duration.time(("accounting",)):
+            forward = _iptables(["-S", "FORWARD"]).stdout.splitlines()
+            with self.lock:
+                self._fold()
+            # Declaring the chain creates or flushes it. The jump must come before
+            # VPN_MAIN_FWD, whose ACCEPT/DROP ends the traversal of FORWARD.
+            lines.insert(0, f":{ACCOUNTING_CHAIN} - [0:0]")
+            lines.extend(["-D FORWARD -j " + ACCOUNTING_CHAIN] * forward.count(iptables_manager.ACCOUNTING_JUMP))
+            lines.append(f"-I FORWARD 1 -j {ACCOUNTING_CHAIN}")
+            payload = "*filter\n" + "\n".join(lines) + "\nCOMMIT\n"
+            try:
+                metrics.run(["iptables-restore", "-w", "--noflush"], input=payload, check=True, capture_output=True, text=True)
+            except subprocess.CalledProcessError as e:
+                logger.error(f"iptables-restore failed while installing accounting rules: {e.stderr.strip()}")
+                return
+            except OSError as e:
+                logger.error(f"iptables-restore not available: {e}")
+                return
+        metrics.firewall_rules.set(("accounting",), rules)
+        logger.info(f"Installed {rules} accounting rules in {ACCOUNTING_CHAIN}.")
+
+    def get_usage(self, instance_name: str, client_name: Optional[str] = None,
+                  month: Optional[str] = None) -> List[Dict]:
+        """Bytes of a month (default: the current one) per client, heaviest first."""
+        month = month or current_month()
+        with self.lock:
+            clients = self._totals.get(instance_name, {})
+            names = [client_name] if client_name else list(clients)
+            usage = []
+            for name in names:
+                rx, tx = clients.get(name, {}).get(month, (0, 0))
+                usage.append({"client_name": name, "month": month, "rx_bytes": rx, "tx_bytes": tx, "total_bytes": rx + tx})
+        usage.sort(key=lambda u: u["total_bytes"], reverse=True)
+        return usage
+
+    def get_history(self, instance_name: str, client_name: str) -> Dict[str, Dict[str, int]]:
+        """All monthly totals of a client."""
+        with self.lock:
+            months = self._totals.get(instance_name, {}).get(client_name, {})
+            return {month: {"rx_bytes": rx, "tx_bytes": tx} for month, (rx, tx) in sorted(months.items())}
+
+traffic_accounting = TrafficAccounting()
@@ -0,0 +1,240 @@
+import os
+import mmap
+import time
+import struct
+import logging
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Long-term traffic history, one memory-mapped file per instance (RRD-style).
+#
+# Layout: a 4 KB header followed by one fixed-size record per series (a client, or
+# INSTANCE_SERIES for the instance total). A record is:
+#   name (64 bytes) | last bucket written, per archive (int64) | rows of each archive
+# and every row is (rx, tx) as two uint64. Each archive is a ring indexed by
+# bucket % rows, consolidated on write (bytes are summed into the bucket of every
+# resolution), so queries only read the slice of the resolution they need.
+
+TRAFFIC_ARCHIVE_DIR = os.getenv("TRAFFIC_ARCHIVE_DIR", "/opt/vpn-manager/backend/data/traffic")
+
+# (step in seconds, rows): 10s for 1 hour, 5m for 7 days, 1h for 90 days
+ARCHIVES: Tuple[Tuple[int, int], ...] = ((10, 360), (300, 2016), (3600, 2160))
+INSTANCE_SERIES = "*"
+
+MAGIC = b"VPNRRD\x00\x01"
+HEADER_SIZE = 4096
+NAME_SIZE = 64
+ROW_SIZE = 16
+INITIAL_CAPACITY = 16
+
+_HEADER = struct.Struct("=8sII")
+_ARCHIVE_DEF = struct.Struct("=II")
+_LAST = struct.Struct(f"={len(ARCHIVES)}q")
+
+def _record_layout() -> Tuple[int, List[int]]:
+    """Record size and the offset of each archive inside a record."""
+    offset = NAME_SIZE + _LAST.size
+    offsets = []
+    for _, rows in ARCHIVES:
+        offsets.append(offset)
+        offset += rows * ROW_SIZE
+    return offset, offsets
+
+RECORD_SIZE, ARCHIVE_OFFSETS = _record_layout()
+
+def _header() -> bytes:
+    header = _HEADER.pack(MAGIC, RECORD_SIZE, len(ARCHIVES))
+    for step, rows in ARCHIVES:
+        header += _ARCHIVE_DEF.pack(step, rows)
+    return header
+
+class ArchiveFile:
+    """The archive of one instance. Not thread-safe by itself; TrafficArchive serialises access."""
+    def __init__(self, path: str):
+        self.path = path
+        self.series: Dict[str, int] = {}
+        self._open()
+
+    def _open(self):
+        header = _header()
+        exists = os.path.exists(self.path)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o640)
+        size = os.fstat(self._fd).st_size
+        if exists and size >= HEADER_SIZE:
+            if os.pread(self._fd, len(header), 0) != header:
+                # Written with another layout: keep it aside rather than misreading it
+                os.close(self._fd)
+                os.replace(self.path, f"{self.path}.old")
+                logger.warning(f"Traffic archive {self.path} has an incompatible layout, moved to {self.path}.old")
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o640)
+                size = 0
+        if size < HEADER_SIZE:
+            size = HEADER_SIZE + INITIAL_CAPACITY * RECORD_SIZE
+            os.ftruncate(self._fd, size)
+            os.pwrite(self._fd, header, 0)
+
+        self.capacity = (size - HEADER_SIZE) // RECORD_SIZE
+        self._mm = mmap.mmap(self._fd, size)
+        for index in range(self.capacity):
+            offset = HEADER_SIZE + index * RECORD_SIZE
+            name = bytes(self._mm[offset:offset + NAME_SIZE]).rstrip(b"\0")
+            if not name:
+                break
+            self.series[name.decode()] = index
+
+    def _grow(self):
+        self._mm.close()
+        self.capacity *= 2
+        size = HEADER_SIZE + self.capacity * RECORD_SIZE
+        os.ftruncate(self._fd, size)  # sparse: unused records cost no disk blocks
+        self._mm = mmap.mmap(self._fd, size)
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+    def _series_index(self, name: str, create: bool) -> Optional[int]:
+        index = self.series.get(name)
+        if index is not None or not create:
+            return index
+        encoded = name.encode()
+        if not encoded or len(encoded) >= NAME_SIZE:
+            return None
+        index = len(self.series)
+        if index >= self.capacity:
+            self._grow()
+        offset = HEADER_SIZE + index * RECORD_SIZE
+        self._mm[offset:offset + NAME_SIZE] = encoded.ljust(NAME_SIZE, b"\0")
+        self._mm[offset + NAME_SIZE:offset + NAME_SIZE + _LAST.size] = _LAST.pack(*([-1] * len(ARCHIVES)))
+        self.series[name] = index
+        return index
+
+    def _rows(self, index: int, archive: int) -> memoryview:
+        """Zero-copy view of the rows of an archive as a flat uint64 array (rx, tx, rx, tx, ...)."""
+        start = HEADER_SIZE + index * RECORD_SIZE + ARCHIVE_OFFSETS[archive]
+        return memoryview(self._mm)[start:start + ARCHIVES[archive][1] * ROW_SIZE].cast("Q")
+
+    def add(self, name: str, timestamp: float, rx: int, tx: int) -> bool:
+        """Adds bytes to the bucket containing `timestamp` in every archive."""
+        index = self._series_index(name, create=True)
+        if index is None:
+            return False
+        last_offset = HEADER_SIZE + index * RECORD_SIZE + NAME_SIZE
+        last = list(_LAST.unpack_from(self._mm, last_offset))
+        for archive, (step, rows) in enumerate(ARCHIVES):
+            bucket = int(timestamp // step)
+            with self._rows(index, archive) as view:
+                if bucket > last[archive]:
+                    # Clear the rows skipped since the previous write (ring reuse)
+                    gap = bucket - last[archive] if last[archive] >= 0 else rows
+                    for b in range(bucket - min(gap, rows) + 1, bucket + 1):
+                        row = (b % rows) * 2
+                        view[row] = view[row + 1] = 0
+                    last[archive] = bucket
+                elif bucket <= last[archive] - rows:
+                    continue  # older than the archive retention
+                row = (bucket % rows) * 2
+                view[row] += rx
+                view[row + 1] += tx
+        _LAST.pack_into(self._mm, last_offset, *last)
+        return True
+
+    def query(self, name: str, archive: int, first: int, last: int) -> Tuple[List[int], List[int]]:
+        """rx/tx of buckets first..last of an archive; buckets without data are 0."""
+        step, rows = ARCHIVES[archive]
+        count = last - first + 1
+        index = self._series_index(name, create=False)
+        if index is None:
+            return [0] * count, [0] * count
+
+        written = _LAST.unpack_from(self._mm, HEADER_SIZE + index * RECORD_SIZE + NAME_SIZE)[archive]
+        # Only buckets still in the ring hold data
+        lo, hi = max(first, written - rows + 1), min(last, written)
+        values = array("Q")
+        if lo <= hi:
+            with self._rows(index, archive) as view:
+                start, end = lo % rows, hi % rows
+                if start <= end:
+                    values.frombytes(view[start * 2:(end + 1) * 2].cast("B"))
+                else:
+                    values.frombytes(view[start * 2:].cast("B"))
+                    values.frombytes(view[:(end + 1) * 2].cast("B"))
+        pad_before = max(0, lo - first) if lo <= hi else count
+        pad_after = count - pad_before - len(values) // 2
+        rx = [0] * pad_before + values[0::2].tolist() + [0] * pad_after
+        tx = [0] * pad_before + values[1::2].tolist() + [0] * pad_after
+        return rx, tx
+
+class TrafficArchive:
+    """Per-instance ArchiveFiles, opened lazily."""
+    def __init__(self, directory: str = TRAFFIC_ARCHIVE_DIR):
+        self.directory = directory
+        self._files: Dict[str, ArchiveFile] = {}
+        self._lock = threading.Lock()
+
+    def _file(self, instance_name: str) -> ArchiveFile:
+        archive = self._files.get(instance_name)
+        if archive is None:
+            os.makedirs(self.directory, exist_ok=True)
+            archive = ArchiveFile(os.path.join(self.directory, f"{instance_name}.rrd"))
+            self._files[instance_name] = archive
+        return archive
+
+    def record(self, instance_name: str, timestamp: float, deltas: Dict[str, Tuple[int, int]]):
+        """Stores one sample: per-client (rx, tx) deltas, plus their sum as the instance total."""
+        total_rx = total_tx = 0
+        with self._lock:
+            archive = self._file(instance_name)
+            for client_name, (rx, tx) in deltas.items():
+                if not archive.add(client_name, timestamp, rx, tx):
+                    logger.warning(f"Traffic of '{client_name}' not archived: name too long")
+                total_rx += rx
+                total_tx += tx
+            if total_rx or total_tx:
+                archive.add(INSTANCE_SERIES, timestamp, total_rx, total_tx)
+
+    def remove(self, instance_name: str):
+        """Deletes the archive of an instance, so a new instance with the same name starts empty."""
+        path = os.path.join(self.directory, f"{instance_name}.rrd")
+        with self._lock:
+            archive = self._files.pop(instance_name, None)
+            if archive:
+                archive.close()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def query(self, instance_name: str, client_name: Optional[str], start: float, end: float,
+              step: Optional[int] = None) -> Dict:
+        """
+        Traffic of a client (or of the whole instance if client_name is None) between two
+        epochs. Without `step` the finest resolution still covering `start` is used.
+        Raises ValueError for an unknown step.
+        """
+        steps = [s for s, _ in ARCHIVES]
+        if step is None:
+            age = time.time() - start
+            archive = next((i for i, (s, rows) in enumerate(ARCHIVES) if s * rows >= age), len(ARCHIVES) - 1)
+        elif step in steps:
+            archive = steps.index(step)
+        else:
+            raise ValueError(f"Risoluzione non valida. Valori ammessi: {steps}")
+
+        step, rows = ARCHIVES[archive]
+        first, last = int(start // step), int(end // step)
+        first = max(first, last - rows + 1)
+        series = client_name or INSTANCE_SERIES
+
+        path = os.path.join(self.directory, f"{instance_name}.rrd")
+        with self._lock:
+            if instance_name not in self._files and not os.path.exists(path):
+                rx, tx = [0] * (last - first + 1), [0] * (last - first + 1)
+            else:
+                rx, tx = self._file(instance_name).query(series, archive, first, last)
+        return {"step": step, "start": first * step, "rx_bytes": rx, "tx_bytes": tx}
+
+traffic_archive = TrafficArchive()
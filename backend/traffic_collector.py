@@ -0,0 +1,510 @@
+import os
+import time
+import heapq
+import logging
+import threading
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import instance_manager
+import vpn_manager
+import firewall_manager
+import metrics
+from traffic_archive import traffic_archive
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two reads of the status logs (OpenVPN rewrites them every STATUS_INTERVAL)
+TRAFFIC_SAMPLE_INTERVAL = int(os.getenv("TRAFFIC_SAMPLE_INTERVAL", "10"))
+# History resolution and length (default: 1 minute buckets over 24 hours)
+TRAFFIC_BUCKET_SECONDS = int(os.getenv("TRAFFIC_BUCKET_SECONDS", "60"))
+TRAFFIC_HISTORY_BUCKETS = int(os.getenv("TRAFFIC_HISTORY_BUCKETS", "1440"))
+
+SLOT_CHUNK = 256
+TOP_DIRECTIONS = ("rx", "tx", "total")
+TOP_GROUPINGS = ("client", "instance", "group")
+MAX_TOP_K = 100
+MAX_BUCKET_BYTES = 0xFFFFFFFF
+
+ClientKey = Tuple[str, str]  # (instance_name, client_name)
+
+def _counter(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def _zeros(typecode: str, count: int) -> array:
+    return array(typecode, bytes(array(typecode).itemsize * count))
+
+class TrafficTable:
+    """
+    Per-client traffic stored as flat typed arrays (structure of arrays). Each client
+    owns a slot; its history is the slice [slot * buckets, (slot + 1) * buckets) of
+    rx_hist/tx_hist, a ring of uint32 byte counts indexed by absolute bucket number.
+    Memory per client is 8 bytes per bucket plus ~60 bytes of scalars: with the
+    defaults 11.5 KB, i.e. ~115 MB for 10k clients over 24h, allocated in chunks of
+    SLOT_CHUNK slots and reused when clients go away.
+    """
+    def __init__(self, buckets: int = TRAFFIC_HISTORY_BUCKETS, bucket_seconds: int = TRAFFIC_BUCKET_SECONDS):
+        self.buckets = buckets
+        self.bucket_seconds = bucket_seconds
+        self.slots: Dict[ClientKey, int] = {}
+        self.keys: List[Optional[ClientKey]] = []
+        self.free: List[int] = []
+        self.rx_hist = array("I")
+        self.tx_hist = array("I")
+        self.last_bucket = array("q")    # absolute bucket number last written
+        self.rx_total = array("Q")       # counters from the status log at the last sample
+        self.tx_total = array("Q")
+        self.session = array("q")        # "connected since" epoch of the current session
+        self.rx_rate = array("f")        # bytes/s over the last sample
+        self.tx_rate = array("f")
+        self.last_seen = array("d")
+        self.connected = array("b")
+        self._empty_ring = _zeros("I", buckets)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def _grow(self):
+        start = len(self.keys)
+        self.rx_hist.extend(_zeros("I", SLOT_CHUNK * self.buckets))
+        self.tx_hist.extend(_zeros("I", SLOT_CHUNK * self.buckets))
+        for column, typecode in ((self.last_bucket, "q"), (self.rx_total, "Q"), (self.tx_total, "Q"),
+                                 (self.session, "q"), (self.rx_rate, "f"), (self.tx_rate, "f"),
+                                 (self.last_seen, "d"), (self.connected, "b")):
+            column.extend(_zeros(typecode, SLOT_CHUNK))
+        self.keys.extend([None] * SLOT_CHUNK)
+        self.free.extend(range(start + SLOT_CHUNK - 1, start - 1, -1))
+
+    def allocate(self, key: ClientKey) -> int:
+        if not self.free:
+            self._grow()
+        slot = self.free.pop()
+        self.slots[key] = slot
+        self.keys[slot] = key
+        base = slot * self.buckets
+        self.rx_hist[base:base + self.buckets] = self._empty_ring
+        self.tx_hist[base:base + self.buckets] = self._empty_ring
+        self.last_bucket[slot] = -1
+        self.rx_rate[slot] = self.tx_rate[slot] = 0.0
+        self.connected[slot] = 0
+        return slot
+
+    def release(self, key: ClientKey):
+        slot = self.slots.pop(key, None)
+        if slot is not None:
+            self.keys[slot] = None
+            self.free.append(slot)
+
+    def add(self, slot: int, bucket: int, rx: int, tx: int):
+        """Adds byte deltas to a bucket, clearing the buckets skipped since the last write."""
+        base = slot * self.buckets
+        last = self.last_bucket[slot]
+        if bucket != last:
+            if last < 0 or bucket - last >= self.buckets:
+                self.rx_hist[base:base + self.buckets] = self._empty_ring
+                self.tx_hist[base:base + self.buckets] = self._empty_ring
+            else:
+                for b in range(last + 1, bucket + 1):
+                    self.rx_hist[base + b % self.buckets] = 0
+                    self.tx_hist[base + b % self.buckets] = 0
+            self.last_bucket[slot] = bucket
+        i = base + bucket % self.buckets
+        self.rx_hist[i] = min(self.rx_hist[i] + rx, MAX_BUCKET_BYTES)
+        self.tx_hist[i] = min(self.tx_hist[i] + tx, MAX_BUCKET_BYTES)
+
+    def history(self, slot: int, count: int, now_bucket: int) -> Tuple[List[int], List[int]]:
+        """The last `count` buckets up to now_bucket, oldest first (missing buckets are 0)."""
+        base = slot * self.buckets
+        last = self.last_bucket[slot]
+        rx, tx = [], []
+        for b in range(now_bucket - count + 1, now_bucket + 1):
+            if last - self.buckets < b <= last:
+                rx.append(self.rx_hist[base + b % self.buckets])
+                tx.append(self.tx_hist[base + b % self.buckets])
+            else:
+                rx.append(0)
+                tx.append(0)
+        return rx, tx
+
+    def window_totals(self, slot: int, count: int, now_bucket: int) -> Tuple[int, int]:
+        """Bytes received/sent over the last `count` buckets."""
+        last = self.last_bucket[slot]
+        lo, hi = max(now_bucket - count + 1, last - self.buckets + 1), min(now_bucket, last)
+        if lo > hi:
+            return 0, 0
+        base = slot * self.buckets
+        start, end = base + lo % self.buckets, base + hi % self.buckets
+        if start <= end:
+            return sum(self.rx_hist[start:end + 1]), sum(self.tx_hist[start:end + 1])
+        wrap = base + self.buckets
+        return (sum(self.rx_hist[start:wrap]) + sum(self.rx_hist[base:end + 1]),
+                sum(self.tx_hist[start:wrap]) + sum(self.tx_hist[base:end + 1]))
+
+class TrafficCollector:
+    """
+    Samples the status log of every instance at a fixed interval and folds the
+    per-client byte counter deltas into a TrafficTable. The status logs are cached by
+    mtime in vpn_manager, so an unchanged log costs one stat().
+    """
+    def __init__(self, interval: int = TRAFFIC_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.table = TrafficTable()
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self._last_status: Dict[str, Dict] = {}
+        self._connected: Dict[str, set] = {}
+        self._last_evict = 0
+        self._thread: Optional[threading.Thread] = None
+        # Firewall group membership, reloaded only when the groups or instances file changes
+        self._groups_stamp = None
+        self._memberships: Dict[ClientKey, List[str]] = {}
+        self._group_info: Dict[str, Dict] = {}
+        # Running aggregates (see _apply), keyed by instance name and by group id
+        self._instance_stats: Dict[str, Dict] = {}
+        self._group_stats: Dict[str, Dict] = {}
+
+    def start(self):
+        if self._thread:
+            return
+        self.started = time.time()
+        self._thread = threading.Thread(target=self._run, name="traffic-collector", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        stop = threading.Event()
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Traffic sampling failed: {e}")
+            stop.wait(self.interval)
+
+    def current_bucket(self, now: Optional[float] = None) -> int:
+        return int((now or time.time()) // self.table.bucket_seconds)
+
+    def sample(self):
+        now = time.time()
+        bucket = self.current_bucket(now)
+        # One batched systemctl is-active: a stopped or crashed instance leaves its last status log behind
+        instances = instance_manager.get_all_instances()
+        with self.lock:
+            self._refresh_groups()
+            for inst in instances:
+                if inst.status != "running":
+                    if self._connected.get(inst.name):
+                        self._sample_instance(inst.name, {}, now, bucket)
+                    # Read the log again once the instance is back
+                    self._last_status.pop(inst.name, None)
+                    continue
+                clients = vpn_manager.get_connected_clients(inst.name)
+                # Same cached object: the log was not rewritten since the previous sample
+                if clients is self._last_status.get(inst.name):
+                    continue
+                self._last_status[inst.name] = clients
+                self._sample_instance(inst.name, clients, now, bucket)
+
+            names = {inst.name for inst in instances}
+            for name in [n for n in self._connected if n not in names]:
+                self._sample_instance(name, {}, now, bucket)
+                del self._connected[name]
+                self._last_status.pop(name, None)
+
+            if bucket != self._last_evict:
+                self._evict(now)
+                self._last_evict = bucket
+
+    def _sample_instance(self, instance_name: str, clients: Dict[str, Dict], now: float, bucket: int):
+        table = self.table
+        current = set()
+        deltas = {}
+        for client_name, data in clients.items():
+            key = (instance_name, client_name)
+            current.add(key)
+            rx = _counter(data.get("bytes_received"))
+            tx = _counter(data.get("bytes_sent"))
+            since = data.get("connected_since_epoch") or 0
+
+            slot = table.slots.get(key)
+            if slot is None:
+                slot = table.allocate(key)
+                # Sessions opened before the collector started: their past bytes are not attributed
+                new_session = since >= self.started
+                d_rx, d_tx = (rx, tx) if new_session else (0, 0)
+            elif since != table.session[slot] or rx < table.rx_total[slot] or tx < table.tx_total[slot]:
+                # Reconnect: the counters restarted from zero
+                d_rx, d_tx = rx, tx
+            else:
+                d_rx, d_tx = rx - table.rx_total[slot], tx - table.tx_total[slot]
+
+            was_connected = table.connected[slot]
+            old_rx_rate, old_tx_rate = table.rx_rate[slot], table.tx_rate[slot]
+            elapsed = now - table.last_seen[slot] if was_connected else 0
+            table.rx_rate[slot] = d_rx / elapsed if elapsed > 0 else 0.0
+            table.tx_rate[slot] = d_tx / elapsed if elapsed > 0 else 0.0
+            self._apply(key, 1 - was_connected, table.rx_rate[slot] - old_rx_rate,
+                        table.tx_rate[slot] - old_tx_rate, d_rx, d_tx)
+            if d_rx or d_tx:
+                table.add(slot, bucket, d_rx, d_tx)
+                deltas[client_name] = (d_rx, d_tx)
+            table.rx_total[slot] = rx
+            table.tx_total[slot] = tx
+            table.session[slot] = since
+            table.last_seen[slot] = now
+            table.connected[slot] = 1
+
+        for key in self._connected.get(instance_name, set()) - current:
+            slot = table.slots.get(key)
+            if slot is not None and table.connected[slot]:
+                self._apply(key, -1, -table.rx_rate[slot], -table.tx_rate[slot], 0, 0)
+                table.connected[slot] = 0
+                table.rx_rate[slot] = table.tx_rate[slot] = 0.0
+        self._connected[instance_name] = current
+
+        if deltas:
+            try:
+                traffic_archive.record(instance_name, now, deltas)
+            except OSError as e:
+                logger.error(f"Cannot archive traffic of {instance_name}: {e}")
+
+    # --- Per-instance and per-group aggregates ---
+
+    @staticmethod
+    def _new_stats() -> Dict:
+        return {"connected_clients": 0, "rx_rate": 0.0, "tx_rate": 0.0, "rx_bytes": 0, "tx_bytes": 0}
+
+    def _apply(self, key: ClientKey, connected: int, rx_rate: float, tx_rate: float, rx: int, tx: int):
+        """Adds the change of one client to its instance and to each of its groups."""
+        targets = [self._instance_stats.setdefault(key[0], self._new_stats())]
+        targets.extend(self._group_stats.setdefault(group_id, self._new_stats())
+                       for group_id in self._memberships.get(key, ()))
+        for stats in targets:
+            stats["connected_clients"] += connected
+            stats["rx_rate"] += rx_rate
+            stats["tx_rate"] += tx_rate
+            stats["rx_bytes"] += rx
+            stats["tx_bytes"] += tx
+
+    def _refresh_groups(self):
+        """Reloads group membership when its files changed and recomputes the aggregates once."""
+        stamp = (_file_stamp(firewall_manager.GROUPS_FILE), _file_stamp(instance_manager.DATA_FILE))
+        if stamp == self._groups_stamp:
+            return
+        self._groups_stamp = stamp
+        instance_names = {inst.id: inst.name for inst in instance_manager.list_instances()}
+        memberships: Dict[ClientKey, List[str]] = {}
+        group_info: Dict[str, Dict] = {}
+        for group in firewall_manager.get_groups():
+            instance_name = instance_names.get(group.instance_id)
+            if not instance_name:
+                continue
+            group_info[group.id] = {"group_id": group.id, "group_name": group.name,
+                                    "instance_name": instance_name, "members": len(group.members)}
+            for member in group.members:
+                memberships.setdefault((instance_name, member), []).append(group.id)
+        self._memberships = memberships
+        self._group_info = group_info
+
+        # Byte counters keep running (they are monotonic); connected/rates are recounted
+        instance_stats = {name: self._new_stats() for name in instance_names.values()}
+        group_stats = {group_id: self._new_stats() for group_id in group_info}
+        for stats, previous in ((instance_stats, self._instance_stats), (group_stats, self._group_stats)):
+            for name, entry in stats.items():
+                if name in previous:
+                    entry["rx_bytes"] = previous[name]["rx_bytes"]
+                    entry["tx_bytes"] = previous[name]["tx_bytes"]
+        self._instance_stats, self._group_stats = instance_stats, group_stats
+        table = self.table
+        for key, slot in table.slots.items():
+            if table.connected[slot]:
+                self._apply(key, 1, table.rx_rate[slot], table.tx_rate[slot], 0, 0)
+
+    def _evict(self, now: float):
+        """Frees the slots of clients not seen for longer than the history window."""
+        horizon = now - self.table.buckets * self.table.bucket_seconds
+        table = self.table
+        for key, slot in list(table.slots.items()):
+            if not table.connected[slot] and table.last_seen[slot] < horizon:
+                table.release(key)
+
+    # --- Queries ---
+
+    def get_rates(self, instance_name: Optional[str] = None) -> List[Dict]:
+        """Current rate (bytes/s) of every tracked client, optionally of one instance."""
+        table = self.table
+        with self.lock:
+            return [
+                {
+                    "instance_name": key[0],
+                    "client_name": key[1],
+                    "connected": bool(table.connected[slot]),
+                    "rx_rate": round(table.rx_rate[slot], 1),
+                    "tx_rate": round(table.tx_rate[slot], 1),
+                }
+                for key, slot in table.slots.items()
+                if instance_name is None or key[0] == instance_name
+            ]
+
+    def get_instance_stats(self) -> List[Dict]:
+        """Connected clients, current rate and bytes since the collector started, per instance."""
+        with self.lock:
+            return [_format_stats({"instance_name": name}, stats)
+                    for name, stats in sorted(self._instance_stats.items())]
+
+    def get_group_stats(self, instance_name: Optional[str] = None) -> List[Dict]:
+        """Same as get_instance_stats for each firewall group (bytes counted while a member)."""
+        with self.lock:
+            self._refresh_groups()
+            return [_format_stats(dict(self._group_info[group_id]), stats)
+                    for group_id, stats in self._group_stats.items()
+                    if instance_name is None or self._group_info[group_id]["instance_name"] == instance_name]
+
+    def get_history(self, instance_name: str, client_name: str, minutes: int) -> Optional[Dict]:
+        """Per-bucket bytes over the last `minutes`. None if the client is not tracked."""
+        table = self.table
+        count = max(1, min(table.buckets, minutes * 60 // table.bucket_seconds))
+        now_bucket = self.current_bucket()
+        with self.lock:
+            slot = table.slots.get((instance_name, client_name))
+            if slot is None:
+                return None
+            rx, tx = table.history(slot, count, now_bucket)
+            return {
+                "instance_name": instance_name,
+                "client_name": client_name,
+                "connected": bool(table.connected[slot]),
+                "rx_rate": round(table.rx_rate[slot], 1),
+                "tx_rate": round(table.tx_rate[slot], 1),
+                "bucket_seconds": table.bucket_seconds,
+                "start": (now_bucket - count + 1) * table.bucket_seconds,
+                "rx_bytes": rx,
+                "tx_bytes": tx,
+            }
+
+    def top(self, k: int = 5, window: int = 0, direction: str = "total", group_by: str = "client") -> List[Dict]:
+        """
+        The k heaviest clients, instances or firewall groups. With window=0 the bytes of the
+        current sessions (since connect) are ranked; otherwise the bytes of the last `window`
+        minutes, reported also as an average rate. Uses a bounded heap (O(n log k)).
+        Raises ValueError for invalid parameters.
+        """
+        if not 1 <= k <= MAX_TOP_K:
+            raise ValueError(f"k deve essere compreso tra 1 e {MAX_TOP_K}")
+        max_window = self.table.buckets * self.table.bucket_seconds // 60
+        if not 0 <= window <= max_window:
+            raise ValueError(f"window deve essere compreso tra 0 e {max_window} minuti")
+        if direction not in TOP_DIRECTIONS:
+            raise ValueError(f"direction non valida. Valori ammessi: {', '.join(TOP_DIRECTIONS)}")
+        if group_by not in TOP_GROUPINGS:
+            raise ValueError(f"group_by non valido. Valori ammessi: {', '.join(TOP_GROUPINGS)}")
+
+        table = self.table
+        now_bucket = self.current_bucket()
+        count = -(-window * 60 // table.bucket_seconds)
+
+        entries = []
+        with self.lock:
+            if group_by == "group":
+                self._refresh_groups()
+            for key, slot in table.slots.items():
+                if window:
+                    rx, tx = table.window_totals(slot, count, now_bucket)
+                    if not rx and not tx:
+                        continue
+                elif table.connected[slot]:
+                    rx, tx = table.rx_total[slot], table.tx_total[slot]
+                else:
+                    continue
+                entries.append((key, slot, rx, tx))
+
+            if group_by == "client":
+                ranked = [
+                    {
+                        "client_name": key[1],
+                        "instance_name": key[0],
+                        "connected": bool(table.connected[slot]),
+                        "connected_since": _format_epoch(table.session[slot]) if table.connected[slot] else "-",
+                        "bytes_received": rx,
+                        "bytes_sent": tx,
+                    }
+                    for key, slot, rx, tx in heapq.nlargest(k, entries, key=lambda e: _ranking_value(e[2], e[3], direction))
+                ]
+            else:
+                totals: Dict[str, List[int]] = {}
+                for key, slot, rx, tx in entries:
+                    targets = [key[0]] if group_by == "instance" else self._memberships.get(key, [])
+                    for target in targets:
+                        total = totals.setdefault(target, [0, 0, 0])
+                        total[0] += rx
+                        total[1] += tx
+                        total[2] += 1
+                ranked = []
+                for target, (rx, tx, clients) in heapq.nlargest(k, totals.items(), key=lambda t: _ranking_value(t[1][0], t[1][1], direction)):
+                    if group_by == "instance":
+                        entry = {"instance_name": target}
+                    else:
+                        info = self._group_info[target]
+                        entry = {"group_id": target, "group_name": info["group_name"], "instance_name": info["instance_name"]}
+                    entry.update({"clients": clients, "bytes_received": rx, "bytes_sent": tx})
+                    ranked.append(entry)
+
+        for entry in ranked:
+            entry["total_bytes"] = entry["bytes_received"] + entry["bytes_sent"]
+            if window:
+                entry["rx_rate"] = round(entry["bytes_received"] / (window * 60), 1)
+                entry["tx_rate"] = round(entry["bytes_sent"] / (window * 60), 1)
+        return ranked
+
+def _ranking_value(rx: int, tx: int, direction: str) -> int:
+    if direction == "rx":
+        return rx
+    if direction == "tx":
+        return tx
+    return rx + tx
+
+def _format_epoch(epoch: int) -> str:
+    # Same format as "Connected Since" in the status log
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(epoch)) if epoch else "-"
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+def _format_stats(entry: Dict, stats: Dict) -> Dict:
+    entry.update(stats)
+    entry["connected_clients"] = max(0, entry["connected_clients"])
+    entry["rx_rate"] = round(max(0.0, entry["rx_rate"]), 1)
+    entry["tx_rate"] = round(max(0.0, entry["tx_rate"]), 1)
+    return entry
+
+traffic_collector = TrafficCollector()
+
+# --- Metrics (refreshed from the running aggregates on every scrape) ---
+
+_connected_clients = metrics.Gauge("vpn_connected_clients", "Connected clients.", ("instance",))
+_rate = metrics.Gauge("vpn_traffic_rate_bytes", "Current traffic rate in bytes/s.", ("instance", "direction"))
+_bytes = metrics.Counter("vpn_traffic_bytes_total", "Bytes since the backend started.", ("instance", "direction"))
+_group_connected = metrics.Gauge("vpn_group_connected_clients", "Connected members of a firewall group.",
+                                 ("instance", "group"))
+_group_rate = metrics.Gauge("vpn_group_traffic_rate_bytes", "Current traffic rate of a firewall group in bytes/s.",
+                            ("instance", "group", "direction"))
+_group_bytes = metrics.Counter("vpn_group_traffic_bytes_total", "Bytes of a firewall group's members while members.",
+                               ("instance", "group", "direction"))
+
+def _collect_metrics():
+    for stats_list, labels_of, connected, rate, nbytes in (
+        (traffic_collector.get_instance_stats(), lambda s: (s["instance_name"],),
+         _connected_clients, _rate, _bytes),
+        (traffic_collector.get_group_stats(), lambda s: (s["instance_name"], s["group_name"]),
+         _group_connected, _group_rate, _group_bytes),
+    ):
+        connected.replace({labels_of(s): s["connected_clients"] for s in stats_list})
+        rate.replace({labels_of(s) + (d,): s[f"{d}_rate"] for s in stats_list for d in ("rx", "tx")})
+        nbytes.replace({labels_of(s) + (d,): s[f"{d}_bytes"] for s in stats_list for d in ("rx", "tx")})
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,85 @@
+import json
+import time
+import hashlib
+import threading
+from typing import Any, Dict, Tuple
+
+# Versions for the mutable collections served by the API (instances, clients, groups,
+# rules, machine rules). Each tracker compares the current items with the previous
+# snapshot, so every change is seen whatever code path (or manual edit) made it.
+# Versions come from one counter seeded with the start time in milliseconds, so they
+# keep increasing across restarts and a client never mistakes an old version for a new one.
+
+MAX_TOMBSTONES = 1000
+
+_counter_lock = threading.Lock()
+_counter = int(time.time() * 1000)
+
+def _next_version() -> int:
+    global _counter
+    with _counter_lock:
+        _counter += 1
+        return _counter
+
+def _digest(item: Any) -> bytes:
+    return hashlib.blake2b(json.dumps(item, sort_keys=True, default=str).encode(), digest_size=12).digest()
+
+class VersionTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items: Dict[str, Tuple[bytes, int]] = {}
+        self._deleted: Dict[str, int] = {}
+        # Changes older than this cannot be answered as a delta (tracker start or pruned tombstones)
+        self._floor = _next_version()
+        self.version = self._floor
+
+    def update(self, items: Dict[str, Any]) -> int:
+        """Records the current items and returns the collection version."""
+        with self._lock:
+            for key, item in items.items():
+                digest = _digest(item)
+                known = self._items.get(key)
+                if not known or known[0] != digest:
+                    self.version = _next_version()
+                    self._items[key] = (digest, self.version)
+                    self._deleted.pop(key, None)
+            for key in [k for k in self._items if k not in items]:
+                del self._items[key]
+                self.version = _next_version()
+                self._deleted[key] = self.version
+            if len(self._deleted) > MAX_TOMBSTONES:
+                oldest = sorted(self._deleted.items(), key=lambda kv: kv[1])[:len(self._deleted) - MAX_TOMBSTONES]
+                for key, version in oldest:
+                    del self._deleted[key]
+                    self._floor = max(self._floor, version)
+            return self.version
+
+    def changes_since(self, items: Dict[str, Any], since: int) -> Dict:
+        """
+        The items changed after `since` and the keys deleted after it. When `since` is
+        older than the tracked history (e.g. 0 or from before a restart) the whole
+        collection is returned with full=True.
+        """
+        version = self.update(items)
+        with self._lock:
+            if since < self._floor:
+                return {"version": version, "full": True, "items": list(items.values()), "deleted": []}
+            return {
+                "version": version,
+                "full": False,
+                "items": [items[key] for key, (_, v) in self._items.items() if v > since],
+                "deleted": [key for key, v in self._deleted.items() if v > since],
+            }
+
+_trackers: Dict[str, VersionTracker] = {}
+_trackers_lock = threading.Lock()
+
+def get_tracker(collection: str) -> VersionTracker:
+    with _trackers_lock:
+        tracker = _trackers.get(collection)
+        if tracker is None:
+            tracker = _trackers[collection] = VersionTracker()
+        return tracker
+
+def changes_since(collection: str, items: Dict[str, Any], since: int) -> Dict:
+    return get_tracker(collection).changes_since(items, since)
@@ -1,10 +1,20 @@
 import os
 import subprocess
 import logging
+import io
+import time
+import hashlib
+import threading
+import zipfile
+import bisect
+import heapq
 from datetime import datetime
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterator
 from dotenv import load_dotenv
+import metrics
 import instance_manager
+import network_utils
+import ip_index
 import firewall_manager as instance_firewall_manager
 
 load_dotenv()
@@ -13,6 +23,20 @@ logger = logging.getLogger(__name__)
 # --- Percorsi e Costanti ---
 EASYRSA_DIR = os.getenv("EASYRSA_DIR", "/etc/openvpn/easy-rsa")
 CLIENT_CONFIG_DIR = os.getenv("CLIENT_CONFIG_DIR", "/root")
+CA_PATH = os.path.join(EASYRSA_DIR, "pki/ca.crt")
+PKI_INDEX_PATH = os.path.join(EASYRSA_DIR, "pki/index.txt")
+TLS_CRYPT_PATH = os.path.join(instance_manager.OPENVPN_CONFIG_DIR, "tls-crypt.key")
+# Directory servita da nginx (location internal) per i download via X-Accel-Redirect.
+# Deve essere leggibile dall'utente di nginx, a differenza di CLIENT_CONFIG_DIR (/root).
+ACCEL_CONFIG_DIR = os.getenv("ACCEL_CONFIG_DIR", "/var/lib/vpn-manager/ovpn")
+
+# Endpoint pubblico usato nella direttiva "remote" dei client (hostname o IP).
+# Se vuoto viene rilevato localmente dall'interfaccia della rotta di default.
+PUBLIC_ENDPOINT = os.getenv("PUBLIC_ENDPOINT", "")
+ENDPOINT_CACHE_TTL = int(os.getenv("ENDPOINT_CACHE_TTL", "300"))
+FALLBACK_ENDPOINT = "YOUR_SERVER_IP"
+
+_endpoint_cache = {"value": None, "expires": 0.0}
 
 # --- Funzioni Helper ---
 
@@ -20,7 +44,7 @@ def _run_command(command, env_vars=None):
     """Esegue un comando shell."""
     effective_env = dict(os.environ, **(env_vars or {}))
     try:
-        result = subprocess.run(
+        result = metrics.run(
             command,
             shell=True,
             capture_output=True,
@@ -43,61 +67,211 @@ def _read_file(path):
 def list_clients(instance_id: str) -> List[Dict]:
     """
     Restituisce la lista dei client per una specifica istanza.
-    I client sono filtrati in base all'istanza specifica usando il prefisso del nome.
+    I client sono quelli associati all'istanza con un certificato valido nella PKI.
     """
     instance = instance_manager.get_instance(instance_id)
     if not instance:
         raise ValueError("Instance not found")
 
-    # Get clients associated with this instance
-    instance_client_names = instance_manager.get_instance_clients(instance_id)
-    
-    all_clients_from_pki = _get_all_clients_from_pki()
+    index = get_client_index(instance)
     connected_clients = get_connected_clients(instance.name)
+    return [_client_entry(name, connected_clients) for name in index.names]
 
-    # Filter to only show clients belonging to this instance
-    filtered_clients = []
-    for client in all_clients_from_pki:
-        client_name = client["name"]
-        # Check if this client belongs to this instance
-        if client_name in instance_client_names:
-            if client_name in connected_clients:
-                client["status"] = "connected"
-                client.update(connected_clients[client_name])
-            else:
-                client["status"] = "disconnected"
-            filtered_clients.append(client)
-            
-    return filtered_clients
+def _client_entry(client_name: str, connected_clients: Dict[str, Dict]) -> Dict:
+    client = {"name": client_name}
+    if client_name in connected_clients:
+        client["status"] = "connected"
+        client.update(connected_clients[client_name])
+    else:
+        client["status"] = "disconnected"
+    return client
+
+# --- Indice Client (paginazione e ricerca) ---
+
+CLIENT_STATUS_FILTERS = ["connected", "disconnected"]
+CLIENT_SORT_KEYS = ["name", "traffic", "connected_since"]
+MAX_PAGE_SIZE = 500
+
+class ClientIndex:
+    """
+    Sorted index of an instance's valid clients, keyed by lowercase display name
+    (the name without the "<instance>_" prefix). Supports O(log n) prefix lookups.
+    """
+    def __init__(self, key: tuple, instance_name: str, client_names: List[str]):
+        self.key = key
+        prefix = f"{instance_name}_"
+        pairs = sorted(
+            ((n[len(prefix):] if n.startswith(prefix) else n).lower(), n) for n in client_names
+        )
+        self.keys = [k for k, _ in pairs]
+        self.names = [n for _, n in pairs]
+        self.positions = {n: i for i, n in enumerate(self.names)}
+
+    def prefix_range(self, prefix: str) -> Tuple[int, int]:
+        prefix = prefix.lower()
+        return bisect.bisect_left(self.keys, prefix), bisect.bisect_left(self.keys, prefix + "\uffff")
+
+    def contains_substring(self, position: int, needle: str) -> bool:
+        return needle in self.keys[position]
+
+_client_index_cache: Dict[str, ClientIndex] = {}
+
+def get_client_index(instance: instance_manager.Instance) -> ClientIndex:
+    """Returns the client index of an instance, rebuilt only when instances.json or the PKI index change."""
+    key = (_file_stamp(instance_manager.DATA_FILE), _file_stamp(PKI_INDEX_PATH), len(instance.clients))
+    cached = _client_index_cache.get(instance.id)
+    if cached and cached.key == key:
+        metrics.cache_hit("client_index")
+        return cached
+    metrics.cache_miss("client_index")
+
+    valid_names = _get_valid_pki_names()
+    index = ClientIndex(key, instance.name, [c for c in instance.clients if c in valid_names])
+    _client_index_cache[instance.id] = index
+    return index
+
+def list_clients_page(instance_id: str, page: int = 1, page_size: int = 50, search: Optional[str] = None,
+                      match: str = "prefix", status: Optional[str] = None, group_id: Optional[str] = None,
+                      sort: str = "name", order: str = "asc") -> Dict:
+    """
+    Paginated, filtered client listing. Status data is merged only for the returned page.
+    Name-sorted pages with no filter or a prefix search cost O(log n + page_size).
+    """
+    if page < 1 or not (1 <= page_size <= MAX_PAGE_SIZE):
+        raise ValueError(f"Paginazione non valida: page >= 1, 1 <= page_size <= {MAX_PAGE_SIZE}.")
+    if status and status not in CLIENT_STATUS_FILTERS:
+        raise ValueError(f"Filtro stato non valido: '{status}'.")
+    if sort not in CLIENT_SORT_KEYS:
+        raise ValueError(f"Ordinamento non valido: '{sort}'.")
+    if order not in ["asc", "desc"]:
+        raise ValueError(f"Direzione di ordinamento non valida: '{order}'.")
+    if match not in ["prefix", "substring"]:
+        raise ValueError(f"Tipo di ricerca non valido: '{match}'.")
 
-def _get_all_clients_from_pki():
-    clients = []
-    index_path = os.path.join(EASYRSA_DIR, "pki/index.txt")
-    if not os.path.exists(index_path):
-        return clients
+    instance = instance_manager.get_instance(instance_id)
+    if not instance:
+        raise LookupError("Instance not found")
+
+    index = get_client_index(instance)
+    connected_clients = get_connected_clients(instance.name)
 
-    with open(index_path, "r") as f:
+    # 1. Candidate positions in the index, starting from the most selective source
+    lo, hi = 0, len(index.names)
+    if search and match == "prefix":
+        lo, hi = index.prefix_range(search)
+
+    restrict = None
+    if status == "connected":
+        restrict = connected_clients.keys()
+    if group_id:
+        group = next((g for g in instance_firewall_manager.get_groups(instance_id) if g.id == group_id), None)
+        members = set(group.members) if group else set()
+        restrict = members if restrict is None else members.intersection(restrict)
+
+    if restrict is not None:
+        positions = sorted(index.positions[n] for n in restrict if n in index.positions)
+        positions = [i for i in positions if lo <= i < hi]
+    else:
+        positions = range(lo, hi)
+
+    # 2. Remaining predicates
+    needle = search.lower() if search and match == "substring" else None
+    if needle is not None or status == "disconnected":
+        positions = [
+            i for i in positions
+            if (needle is None or index.contains_substring(i, needle))
+            and (status != "disconnected" or index.names[i] not in connected_clients)
+        ]
+
+    total = len(positions)
+    offset = (page - 1) * page_size
+
+    # 3. Sort and slice
+    if sort == "name":
+        if order == "desc":
+            positions = positions[::-1]
+        page_positions = list(positions[offset:offset + page_size])
+    else:
+        def sort_key(i):
+            data = connected_clients.get(index.names[i])
+            if not data:
+                return -1
+            if sort == "traffic":
+                return _to_int(data.get("bytes_received")) + _to_int(data.get("bytes_sent"))
+            return data.get("connected_since_epoch") or 0
+        select = heapq.nlargest if order == "desc" else heapq.nsmallest
+        page_positions = select(offset + page_size, positions, key=sort_key)[offset:]
+
+    return {
+        "items": [_client_entry(index.names[i], connected_clients) for i in page_positions],
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+    }
+
+def _to_int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+_pki_cache = {"stamp": None, "names": frozenset()}
+
+def _get_valid_pki_names() -> frozenset:
+    """Valid (non-revoked) client CNs from the Easy-RSA index, cached by file mtime."""
+    stamp = _file_stamp(PKI_INDEX_PATH)
+    if stamp is None:
+        return frozenset()
+    if _pki_cache["stamp"] == stamp:
+        metrics.cache_hit("pki_index")
+        return _pki_cache["names"]
+    metrics.cache_miss("pki_index")
+
+    names = set()
+    with open(PKI_INDEX_PATH, "r") as f:
         for line in f:
             parts = line.strip().split()
-            if parts[0] == "V":
+            if parts and parts[0] == "V":
                 client_name = parts[-1].split("=")[-1]
                 if not client_name.startswith("server"):
-                    clients.append({"name": client_name})
-    return clients
+                    names.add(client_name)
+
+    _pki_cache["stamp"] = stamp
+    _pki_cache["names"] = frozenset(names)
+    return _pki_cache["names"]
+
+_status_cache: Dict[str, Tuple[Tuple[int, int], Dict[str, Dict]]] = {}
 
 def get_connected_clients(instance_name: str):
+    """
+    Parses the instance status log. The result is cached by file mtime and shared
+    between callers, so it must not be modified in place.
+    """
+    status_log_path = os.path.join(instance_manager.OPENVPN_LOG_DIR, f"status_{instance_name}.log")
+
+    stamp = _file_stamp(status_log_path)
+    if stamp is None:
+        if _status_cache.pop(status_log_path, None):
+            ip_index.replace_sessions(instance_name, {})
+        return {}
+    cached = _status_cache.get(status_log_path)
+    if cached and cached[0] == stamp:
+        metrics.cache_hit("status_log")
+        return cached[1]
+    metrics.cache_miss("status_log")
+
+    parse_start = time.perf_counter()
     connected_clients = {}
-    status_log_path = f"/var/log/openvpn/status_{instance_name}.log"
-    
-    if not os.path.exists(status_log_path):
-        return connected_clients
-
+    complete = False
     try:
         with open(status_log_path, "r") as f:
             lines = f.readlines()
             
         for line in lines:
             line = line.strip()
+            if line == "END":
+                complete = True
+                break
             if line.startswith("CLIENT_LIST,"):
                 parts = line.split(',')
                 # status-version 2 format:
@@ -110,6 +284,8 @@ def get_connected_clients(instance_name: str):
                     connected_since = parts[7]
                     bytes_received = parts[5]
                     bytes_sent = parts[6]
+                    # Index 8 is "Connected Since (time_t)"
+                    connected_since_epoch = int(parts[8]) if len(parts) > 8 and parts[8].isdigit() else None
 
                     # Handle case where real address has port
                     if ":" in real_address:
@@ -119,12 +295,22 @@ def get_connected_clients(instance_name: str):
                         "virtual_ip": virtual_address,
                         "real_ip": real_address,
                         "connected_since": connected_since,
+                        "connected_since_epoch": connected_since_epoch,
                         "bytes_received": bytes_received,
                         "bytes_sent": bytes_sent
                     }
     except Exception as e:
         logger.error(f"Error reading status log for {instance_name}: {e}")
+        return cached[1] if cached else {}
+
+    # OpenVPN rewrites the log in place: without the END line it was read mid-rewrite,
+    # and a cut line would pass for a reconnect. Keep the previous result.
+    if not complete:
+        return cached[1] if cached else {}
 
+    metrics.status_parse_duration.observe((instance_name,), time.perf_counter() - parse_start)
+    _status_cache[status_log_path] = (stamp, connected_clients)
+    ip_index.replace_sessions(instance_name, {name: data["virtual_ip"] for name, data in connected_clients.items()})
     return connected_clients
 
 def create_client(instance_id: str, client_name: str) -> Tuple[bool, Optional[str]]:
@@ -136,8 +322,7 @@ def create_client(instance_id: str, client_name: str) -> Tuple[bool, Optional[st
     prefixed_client_name = f"{instance.name}_{client_name}"
     
     # 1. Check if client exists
-    existing_clients = _get_all_clients_from_pki()
-    if any(c["name"] == prefixed_client_name for c in existing_clients):
+    if prefixed_client_name in _get_valid_pki_names():
         return False, f"Client '{client_name}' already exists for this instance."
 
     # 2. Create Certificate
@@ -153,9 +338,7 @@ def create_client(instance_id: str, client_name: str) -> Tuple[bool, Optional[st
         return False, f"Error generating config: {e}"
 
     # 4. Save .ovpn file (using original client name for file)
-    config_path = os.path.join(CLIENT_CONFIG_DIR, f"{prefixed_client_name}.ovpn")
-    with open(config_path, "w") as f:
-        f.write(ovpn_content)
+    _write_client_config(prefixed_client_name, ovpn_content)
     
     # 5. Add client to instance's client list
     try:
@@ -193,8 +376,8 @@ def revoke_client(instance_id: str, client_name: str) -> Tuple[bool, str]:
     # Copy CRL to OpenVPN directory
     try:
         crl_src = os.path.join(EASYRSA_DIR, "pki/crl.pem")
-        crl_dest = "/etc/openvpn/crl.pem"
-        subprocess.run(["cp", crl_src, crl_dest], check=True)
+        crl_dest = os.path.join(instance_manager.OPENVPN_CONFIG_DIR, "crl.pem")
+        metrics.run(["cp", crl_src, crl_dest], check=True)
         os.chmod(crl_dest, 0o644)
     except Exception as e:
          return False, f"Error copying CRL: {e}"
@@ -211,39 +394,77 @@ def revoke_client(instance_id: str, client_name: str) -> Tuple[bool, str]:
     except Exception as e:
         logger.error(f"Failed to remove client from firewall groups: {e}")
     
-    # 5. Restart Service to reload CRL
+    # 5. Remove the copy served by nginx
+    accel_copy = os.path.join(ACCEL_CONFIG_DIR, f"{client_name}.ovpn")
+    if os.path.exists(accel_copy):
+        try:
+            os.remove(accel_copy)
+        except OSError as e:
+            logger.error(f"Failed to remove exported config {accel_copy}: {e}")
+
+    # 6. Restart Service to reload CRL
     service_name = f"openvpn@server_{instance.name}"
-    subprocess.run(["/usr/bin/systemctl", "restart", service_name], check=False)
+    metrics.run(["/usr/bin/systemctl", "restart", service_name], check=False)
 
     return True, f"Client {client_name} revoked."
 
 def _generate_ovpn_content(instance: instance_manager.Instance, client_name: str) -> str:
-    # Get Public IP
-    public_ip = _get_public_ip()
-    
-    # Read Certs
-    ca = _read_file(os.path.join(EASYRSA_DIR, "pki/ca.crt"))
-    cert = _read_file(os.path.join(EASYRSA_DIR, f"pki/issued/{client_name}.crt"))
-    key = _read_file(os.path.join(EASYRSA_DIR, f"pki/private/{client_name}.key"))
-    
-    # Extract cert body
+    chunks, _, error = render_client_config(instance, client_name)
+    if error:
+        raise RuntimeError(error)
+    return "".join(chunks)
+
+# --- Template Config Client ---
+
+class OvpnTemplate:
+    """
+    Shared, pre-rendered parts of an instance's client config (options, CA, tls-crypt).
+    Rebuilt only when the endpoint, port/protocol or the CA/tls-crypt files change.
+    """
+    def __init__(self, key: tuple, head: str, tail: str):
+        self.key = key
+        self.head = head # Options + <ca> block
+        self.tail = tail # <tls-crypt> block (may be empty)
+        self.digest = hashlib.sha256((head + tail).encode()).hexdigest()
+
+_template_cache: Dict[str, OvpnTemplate] = {}
+_template_lock = threading.Lock()
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+        return st.st_mtime_ns, st.st_size
+    except OSError:
+        return None
+
+def _extract_certificate(cert: str) -> str:
     if "-----BEGIN CERTIFICATE-----" in cert:
         cert = cert[cert.find("-----BEGIN CERTIFICATE-----") : cert.find("-----END CERTIFICATE-----") + 25]
+    return cert
 
-    # TLS Crypt/Auth
-    tls_crypt = ""
-    tls_auth = ""
-    
-    # Check for tls-crypt key
-    tls_crypt_path = "/etc/openvpn/tls-crypt.key"
-    if os.path.exists(tls_crypt_path):
-        tls_crypt = _read_file(tls_crypt_path)
-    
-    # Template
-    config = f"""client
+def get_ovpn_template(instance: instance_manager.Instance) -> OvpnTemplate:
+    """Returns the cached template for an instance, rebuilding it if any input changed."""
+    endpoint = _get_public_endpoint(instance)
+    key = (instance.protocol, instance.port, endpoint, _file_stamp(CA_PATH), _file_stamp(TLS_CRYPT_PATH))
+
+    cached = _template_cache.get(instance.id)
+    if cached and cached.key == key:
+        metrics.cache_hit("ovpn_template")
+        return cached
+    metrics.cache_miss("ovpn_template")
+
+    with _template_lock:
+        cached = _template_cache.get(instance.id)
+        if cached and cached.key == key:
+            return cached
+
+        ca = _read_file(CA_PATH)
+        tls_crypt = _read_file(TLS_CRYPT_PATH)
+
+        head = f"""client
 dev tun
 proto {instance.protocol}
-remote {public_ip} {instance.port}
+remote {endpoint} {instance.port}
 resolv-retry infinite
 nobind
 persist-key
@@ -257,21 +478,188 @@ verb 3
 <ca>
 {ca}
 </ca>
-<cert>
-{cert}
-</cert>
-<key>
-{key}
-</key>
 """
-    if tls_crypt:
-        config += f"<tls-crypt>\n{tls_crypt}\n</tls-crypt>\n"
-    
-    return config
+        tail = f"<tls-crypt>\n{tls_crypt}\n</tls-crypt>\n" if tls_crypt else ""
+
+        template = OvpnTemplate(key, head, tail)
+        _template_cache[instance.id] = template
+        logger.info(f"Compiled client config template for instance '{instance.name}'")
+        return template
+
+def _is_instance_client(instance: instance_manager.Instance, client_name: str) -> bool:
+    """
+    A valid client certificate (never the server's) belonging to the instance: listed in
+    it, or carrying its prefix while being created.
+    """
+    if client_name not in instance.clients and not client_name.startswith(f"{instance.name}_"):
+        return False
+    return client_name in _get_valid_pki_names()
+
+def render_client_config(instance: instance_manager.Instance, client_name: str) -> Tuple[Optional[List[str]], Optional[str], Optional[str]]:
+    """
+    Renders a client config from the instance template and the client's cert/key.
+    Returns (chunks, etag, error). The ETag is strong: it changes iff the bytes change.
+    """
+    if not _is_instance_client(instance, client_name):
+        return None, None, "Client not found for this instance"
+    cert_path = os.path.join(EASYRSA_DIR, f"pki/issued/{client_name}.crt")
+    key_path = os.path.join(EASYRSA_DIR, f"pki/private/{client_name}.key")
+    if not os.path.exists(cert_path) or not os.path.exists(key_path):
+        return None, None, "Client certificate not found"
+
+    template = get_ovpn_template(instance)
+    cert = _extract_certificate(_read_file(cert_path))
+    key = _read_file(key_path)
+    body = f"<cert>\n{cert}\n</cert>\n<key>\n{key}\n</key>\n"
+
+    etag = hashlib.sha256((template.digest + body).encode()).hexdigest()[:32]
+    return [template.head, body, template.tail], f'"{etag}"', None
+
+def get_client_config_stream(instance: instance_manager.Instance, client_name: str) -> Tuple[Optional[Iterator[bytes]], Optional[str], Optional[str]]:
+    """
+    Returns (iterator, etag, error) for a client config.
+    Renders from the PKI when possible, otherwise streams the saved .ovpn file.
+    """
+    if client_name not in instance.clients:
+        return None, None, "Client not found for this instance"
+    chunks, etag, error = render_client_config(instance, client_name)
+    if not error:
+        return (c.encode() for c in chunks if c), etag, None
+
+    config_path = os.path.join(CLIENT_CONFIG_DIR, f"{client_name}.ovpn")
+    stamp = _file_stamp(config_path)
+    if not stamp:
+        return None, None, "Config not found"
+    return _iter_file(config_path), f'"{stamp[0]:x}-{stamp[1]:x}"', None
+
+def _iter_file(path: str, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+def _write_client_config(client_name: str, content: str, config_dir: str = CLIENT_CONFIG_DIR) -> bool:
+    """Writes the .ovpn file only if its content changed. Returns True if written."""
+    config_path = os.path.join(config_dir, f"{client_name}.ovpn")
+    if _read_file(config_path) == content.strip():
+        return False
+    tmp_path = f"{config_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(content)
+    os.replace(tmp_path, config_path)
+    return True
+
+def export_client_config_file(instance: instance_manager.Instance, client_name: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Makes sure an up-to-date copy of the client config exists in ACCEL_CONFIG_DIR,
+    the directory nginx serves through X-Accel-Redirect. Returns (filename, error).
+    """
+    os.makedirs(ACCEL_CONFIG_DIR, exist_ok=True)
+    filename = f"{client_name}.ovpn"
+
+    chunks, _, error = render_client_config(instance, client_name)
+    if error:
+        content = _read_file(os.path.join(CLIENT_CONFIG_DIR, filename))
+        if not content:
+            return None, "Config not found"
+        content += "\n"
+    else:
+        content = "".join(chunks)
 
-def _get_public_ip():
     try:
-        return subprocess.check_output(["curl", "-s", "https://ifconfig.me"]).decode().strip()
-    except:
-        return "YOUR_SERVER_IP"
+        _write_client_config(client_name, content, ACCEL_CONFIG_DIR)
+    except OSError as e:
+        logger.error(f"Failed to export config for {client_name} to {ACCEL_CONFIG_DIR}: {e}")
+        return None, f"Error exporting config: {e}"
+    return filename, None
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Write-only, non-seekable sink for zipfile; drained after every entry."""
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def iter_client_configs_zip(instance: instance_manager.Instance, client_names: List[str]) -> Iterator[bytes]:
+    """
+    Streams a ZIP archive with the rendered config of each client.
+    Entries are rendered and emitted one at a time, so memory does not grow with the client count.
+    """
+    sink = _ZipStreamBuffer()
+    exported = 0
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED) as zf:
+        for client_name in client_names:
+            chunks, _, error = render_client_config(instance, client_name)
+            if error:
+                logger.warning(f"Skipping '{client_name}' in ZIP export: {error}")
+                continue
+            with zf.open(f"{client_name}.ovpn", mode="w") as entry:
+                for chunk in chunks:
+                    entry.write(chunk.encode())
+            exported += 1
+            yield sink.drain()
+    yield sink.drain()
+    logger.info(f"Exported {exported}/{len(client_names)} client configs for instance '{instance.name}'")
+
+def regenerate_client_configs(instance_id: str) -> int:
+    """
+    Re-renders the saved .ovpn files of all clients of an instance (e.g. after a CA,
+    endpoint or port change). Unchanged files are not rewritten. Returns the number written.
+    """
+    instance = instance_manager.get_instance(instance_id)
+    if not instance:
+        raise ValueError("Instance not found")
 
+    written = 0
+    for client_name in instance.clients:
+        chunks, _, error = render_client_config(instance, client_name)
+        if error:
+            logger.warning(f"Skipping config regeneration for '{client_name}': {error}")
+            continue
+        if _write_client_config(client_name, "".join(chunks)):
+            written += 1
+    logger.info(f"Regenerated {written}/{len(instance.clients)} client configs for instance '{instance.name}'")
+    return written
+
+def _get_public_endpoint(instance: instance_manager.Instance) -> str:
+    """
+    Returns the endpoint for the "remote" directive.
+    Priority: instance override, PUBLIC_ENDPOINT env, cached local detection.
+    Never performs external network calls.
+    """
+    if instance.public_endpoint:
+        return instance.public_endpoint
+    if PUBLIC_ENDPOINT:
+        return PUBLIC_ENDPOINT
+
+    now = time.monotonic()
+    if _endpoint_cache["value"] and now < _endpoint_cache["expires"]:
+        metrics.cache_hit("public_endpoint")
+        return _endpoint_cache["value"]
+    metrics.cache_miss("public_endpoint")
+
+    detected = network_utils.detect_local_endpoint()
+    if not detected:
+        logger.warning("Could not detect local endpoint, set PUBLIC_ENDPOINT or an instance override.")
+        return _endpoint_cache["value"] or FALLBACK_ENDPOINT
+
+    _endpoint_cache["value"] = detected
+    _endpoint_cache["expires"] = now + ENDPOINT_CACHE_TTL
+    return detected
+
+def invalidate_endpoint_cache():
+    """Forces the next config generation to re-detect the local endpoint."""
+    _endpoint_cache["value"] = None
+    _endpoint_cache["expires"] = 0.0
@@ -0,0 +1,530 @@
+"""
+Benchmarks of the API endpoints and of the manager functions behind them, run against
+a synthetic OpenVPN host (see environment.py) with stub executables, so they need
+neither root nor OpenVPN and measure the same data set on every run.
+
+    python benchmarks/bench.py                      # full run, appended to results.jsonl
+    python benchmarks/bench.py --filter firewall    # only benchmarks matching a regex
+    python benchmarks/bench.py --clients 5000 --no-save
+
+Each benchmark runs at least --min-rounds times, then until --rounds or --max-time
+seconds. Results (median, p95, min and external commands per call) are appended to the
+history file with the commit they were measured on and compared with the previous run
+that used the same environment parameters; medians slower by more than --threshold
+are reported as regressions (exit status 1 with --fail-on-regression).
+"""
+import os
+import re
+import sys
+import json
+import math
+import time
+import logging
+import platform
+import argparse
+import tempfile
+import subprocess
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+from environment import API_KEY, BENCHMARKS_DIR, SyntheticEnvironment, load_backend
+
+HISTORY_FILE = os.path.join(BENCHMARKS_DIR, "results.jsonl")
+# Differences below this are noise whatever the ratio
+NOISE_FLOOR_MS = 0.5
+
+# Routes deliberately not benchmarked, with the reason
+SKIPPED_ROUTES = {
+    "GET /api/events": "stream infinito (SSE), misurato dal load test",
+    "POST /api/machine-network/interfaces/{interface_name}/config": "scrive in /etc/netplan dell'host",
+    "POST /api/machine-network/netplan-pending/{change_id}/confirm": "richiede una modifica netplan in attesa",
+    "POST /api/machine-network/netplan-pending/{change_id}/rollback": "richiede una modifica netplan in attesa",
+}
+
+class Benchmark:
+    """
+    A timed call. `setup` runs before each round outside the timing and returns the
+    arguments of `call`; `teardown` receives them after the round.
+    """
+    def __init__(self, name: str, call: Callable, setup: Optional[Callable[[], Dict]] = None,
+                 teardown: Optional[Callable[[Dict], None]] = None, route: Optional[str] = None):
+        self.name = name
+        self.call = call
+        self.setup = setup
+        self.teardown = teardown
+        self.route = route
+
+class Context:
+    """What the benchmark definitions need: the environment, the app client and a few known ids."""
+    def __init__(self, env: SyntheticEnvironment, main):
+        from fastapi.testclient import TestClient
+        self.env = env
+        self.main = main
+        self.client = TestClient(main.app)
+        self.headers = {"X-API-Key": API_KEY}
+        self.instance = next(iter(env.instances))
+        self.subnet = env.instances[self.instance]["subnet"]
+        self.connected = env.connected_clients(self.instance)[0]
+        self.group = next(g for g in env.groups if g["instance_id"] == self.instance)
+        self.sequence = 0
+
+    def unique(self, prefix: str) -> str:
+        self.sequence += 1
+        return f"{prefix}{os.getpid()}x{self.sequence}"
+
+    def request(self, method: str, path: str, headers: Optional[Dict] = None, **kwargs):
+        response = self.client.request(method, path, headers={**self.headers, **(headers or {})}, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {path} -> {response.status_code}: {response.text[:200]}")
+        return response
+
+    def endpoint(self, name: str, method: str, route: str, path: Optional[str] = None,
+                 setup: Optional[Callable[[], Dict]] = None, teardown: Optional[Callable[[Dict], None]] = None,
+                 **kwargs) -> Benchmark:
+        """Benchmark of one request; `setup` may return path/json/params overriding the fixed ones."""
+        def call(**args):
+            request = dict(kwargs)
+            request.update(args)
+            self.request(method, request.pop("path", path or route), **request)
+        return Benchmark(f"{method} {name}", call, setup, teardown, route=f"{method} {route}")
+
+def _touch(path: str):
+    os.utime(path, None)
+
+# --- Benchmark definitions ---
+
+def manager_benchmarks(ctx: Context) -> List[Benchmark]:
+    import vpn_manager
+    import instance_manager
+    import ip_manager
+    import ip_index
+    import versioning
+    import network_utils
+    import netplan_manager
+    import metrics
+    import firewall_manager
+    import session_log
+    from machine_firewall_manager import machine_firewall_manager
+    from traffic_collector import traffic_collector
+    from traffic_accounting import traffic_accounting
+
+    env, name = ctx.env, ctx.instance
+    instance = instance_manager.get_instance(name)
+    status_log = os.path.join(env.log_dir, f"status_{name}.log")
+    ccd_dir = os.path.join(env.openvpn_dir, "ccd", name)
+    clients = {c: {"name": c} for c in instance.clients}
+    member_ip = ip_manager.get_static_ips(name, ctx.subnet)[ctx.group["members"][0]]
+    tick = [1]
+
+    def rewrite_status():
+        tick[0] += 1
+        env.write_status_logs(tick[0])
+        return {}
+
+    return [
+        Benchmark("manager pki index (cold)", vpn_manager._get_valid_pki_names,
+                  setup=lambda: _touch(vpn_manager.PKI_INDEX_PATH) or {}),
+        Benchmark("manager pki index (warm)", vpn_manager._get_valid_pki_names),
+        Benchmark("manager client index (cold)", lambda: vpn_manager.get_client_index(instance),
+                  setup=lambda: _touch(instance_manager.DATA_FILE) or {}),
+        Benchmark("manager status log (cold)", lambda: vpn_manager.get_connected_clients(name),
+                  setup=lambda: _touch(status_log) or {}),
+        Benchmark("manager status log (warm)", lambda: vpn_manager.get_connected_clients(name)),
+        Benchmark("manager list_clients", lambda: vpn_manager.list_clients(name)),
+        Benchmark("manager list_clients_page", lambda: vpn_manager.list_clients_page(name, 1, 50)),
+        Benchmark("manager list_clients_page search", lambda: vpn_manager.list_clients_page(name, 1, 50, search="client01")),
+        Benchmark("manager render_client_config", lambda: vpn_manager.render_client_config(instance, ctx.connected)),
+        Benchmark("manager get_all_instances", instance_manager.get_all_instances),
+        Benchmark("manager static ips (cold)", lambda: ip_manager.get_static_ips(name, ctx.subnet),
+                  setup=lambda: _touch(ccd_dir) or {}),
+        Benchmark("manager static ips (warm)", lambda: ip_manager.get_static_ips(name, ctx.subnet)),
+        Benchmark("manager ip lookup", lambda: ip_index.lookup_ip(member_ip)),
+        Benchmark("manager versioning clients", lambda: versioning.changes_since("benchmark:clients", clients, 0)),
+        Benchmark("manager firewall get_groups", firewall_manager.get_groups),
+        Benchmark("manager firewall get_rules", firewall_manager.get_rules),
+        Benchmark("manager firewall export csv", lambda: firewall_manager.rules_to_csv(firewall_manager.export_rules(None, name))),
+        Benchmark("manager apply_firewall_rules", firewall_manager.apply_firewall_rules),
+        Benchmark("manager machine apply_all_rules", machine_firewall_manager.apply_all_rules),
+        Benchmark("manager accounting install_rules", lambda: traffic_accounting.install_rules(instance_manager.list_instances())),
+        Benchmark("manager accounting sample", traffic_accounting.sample),
+        Benchmark("manager accounting get_usage", lambda: traffic_accounting.get_usage(name)),
+        Benchmark("manager traffic sample (new logs)", traffic_collector.sample, setup=rewrite_status),
+        Benchmark("manager traffic sample (unchanged)", traffic_collector.sample),
+        Benchmark("manager traffic top", lambda: traffic_collector.top(10, 60, "total", "client")),
+        Benchmark("manager sessions (cold)", lambda store: store.query(name, None, int(time.time()) - 86400, int(time.time())),
+                  setup=lambda: {"store": session_log.SessionStore()}),
+        Benchmark("manager sessions (warm)", lambda: session_log.session_store.query(
+            name, None, int(time.time()) - 86400, int(time.time()))),
+        Benchmark("manager network interfaces", network_utils.get_network_interfaces),
+        Benchmark("manager netplan load", netplan_manager.load),
+        Benchmark("manager metrics render", metrics.render),
+    ]
+
+def endpoint_benchmarks(ctx: Context) -> List[Benchmark]:
+    import vpn_manager
+    import instance_manager
+    import ip_manager
+    import firewall_manager
+    from machine_firewall_manager import machine_firewall_manager
+
+    env, inst, client = ctx.env, ctx.instance, ctx.connected
+    group_id = ctx.group["id"]
+    rule_id = f"rule-{env.groups.index(ctx.group):04d}-0"
+    member = ctx.group["members"][0]
+    subnet_info = {"instance_name": inst, "subnet": ctx.subnet}
+    now = int(time.time())
+    rule_body = {"group_id": group_id, "action": "ACCEPT", "protocol": "tcp", "port": "443",
+                 "destination": "192.0.2.0/24", "description": "benchmark"}
+    machine_rule = {"chain": "INPUT", "action": "ACCEPT", "protocol": "tcp", "port": 8443,
+                    "source": "198.51.100.200", "comment": "benchmark"}
+
+    def trace_id():
+        ctx.request("GET", "/api/instances", headers={"X-Trace": "1"})
+        return {"path": f"/api/debug/traces/{ctx.main.tracing.get_traces()[0]['id']}"}
+
+    def new_client():
+        client_name = ctx.unique("bench")
+        vpn_manager.create_client(inst, client_name)
+        return {"path": f"/api/instances/{inst}/clients/{inst}_{client_name}"}
+
+    def new_instance_name():
+        ctx.sequence += 1
+        return ctx.sequence
+
+    def instance_body():
+        n = new_instance_name()
+        return {"json": {"name": f"benchinst{n}", "port": 20000 + n, "subnet": f"10.{200 + n % 50}.{n // 50 % 256}.0/24"}}
+
+    def new_instance():
+        n = new_instance_name()
+        created = instance_manager.create_instance(f"benchdel{n}", 30000 + n, f"172.16.{n % 256}.0/24")
+        return {"path": f"/api/instances/{created.id}"}
+
+    def delete_created_instance(args):
+        for created in instance_manager.get_all_instances():
+            if created.name == args["json"]["name"]:
+                instance_manager.delete_instance(created.id)
+
+    def new_group():
+        group = firewall_manager.create_group(ctx.unique("benchgroup"), inst)
+        return {"path": f"/api/groups/{group.id}"}
+
+    def group_body():
+        return {"json": {"name": ctx.unique("benchgroup"), "instance_id": inst}}
+
+    def delete_created_group(args):
+        group_name = args["json"]["name"]
+        groups = [g for g in firewall_manager.get_groups(inst) if g.name == group_name]
+        for group in groups:
+            firewall_manager.delete_group(group.id)
+
+    def free_member():
+        """A client that is not a member of the benchmark group."""
+        members = set(ctx.group["members"])
+        ctx.sequence += 1
+        candidates = [c for c in env.instances[inst]["clients"] if c not in members]
+        return candidates[ctx.sequence % len(candidates)]
+
+    def member_body():
+        return {"json": {"client_identifier": free_member(), "subnet_info": subnet_info}}
+
+    def remove_added_member(args):
+        firewall_manager.remove_member_from_group(group_id, args["json"]["client_identifier"], inst)
+
+    def bulk_body():
+        add = [free_member() for _ in range(10)]
+        return {"json": {"add": add, "remove": [], "subnet_info": subnet_info}}
+
+    def remove_bulk_members(args):
+        firewall_manager.update_group_members(group_id, [], args["json"]["add"], subnet_info)
+
+    def added_member():
+        client_identifier = free_member()
+        firewall_manager.add_member_to_group(group_id, client_identifier, subnet_info)
+        return {"path": f"/api/groups/{group_id}/members/{client_identifier}", "params": {"instance_name": inst}}
+
+    def new_rule():
+        rule = firewall_manager.add_rule(dict(rule_body))
+        return {"path": f"/api/firewall/rules/{rule.id}"}
+
+    def delete_created_rule(args):
+        for rule in firewall_manager.get_rules(group_id):
+            if rule.description == "benchmark":
+                firewall_manager.delete_rule(rule.id)
+
+    def new_machine_rule():
+        rule = machine_firewall_manager.add_rule(dict(machine_rule))
+        return {"path": f"/api/machine-firewall/rules/{rule['id']}"}
+
+    def delete_machine_rules(args):
+        for rule in machine_firewall_manager.get_all_rules():
+            if rule.get("comment") == "benchmark":
+                machine_firewall_manager.delete_rule(rule["id"])
+
+    def new_reservation():
+        ctx.sequence += 1
+        return f"10.{100 + list(env.instances).index(inst)}.254.{ctx.sequence % 250 + 1}"
+
+    def added_reservation():
+        reservation = new_reservation()
+        ip_manager.add_reservation(inst, ctx.subnet, reservation)
+        return {"params": {"reservation": reservation}}
+
+    def remove_reservation(args):
+        ip_manager.remove_reservation(inst, ctx.subnet, args["json"]["reservation"])
+
+    rules_export = ctx.request("GET", "/api/firewall/rules/export", params={"group_id": group_id}).text
+    machine_order = [{"id": r["id"], "order": r["order"]} for r in machine_firewall_manager.get_all_rules()]
+    e = ctx.endpoint
+    return [
+        e("/metrics", "GET", "/metrics"),
+        e("/api/debug/traces", "GET", "/api/debug/traces"),
+        e("/api/debug/traces/{trace_id}", "GET", "/api/debug/traces/{trace_id}", setup=trace_id),
+        e("/api/instances", "GET", "/api/instances"),
+        e("/api/instances?since=0", "GET", "/api/instances", params={"since": 0}),
+        e("/api/instances/{id}", "GET", "/api/instances/{instance_id}", f"/api/instances/{inst}"),
+        e("/api/instances", "POST", "/api/instances", setup=instance_body, teardown=delete_created_instance),
+        e("/api/instances/{id}", "DELETE", "/api/instances/{instance_id}", setup=new_instance),
+        e("/api/instances/{id}/routes", "PATCH", "/api/instances/{instance_id}/routes",
+          f"/api/instances/{inst}/routes", json={"tunnel_mode": "full"}),
+        e("/api/instances/{id}/firewall-policy", "PATCH", "/api/instances/{instance_id}/firewall-policy",
+          f"/api/instances/{inst}/firewall-policy", json={"default_policy": "ACCEPT"}),
+        e("/api/instances/{id}/endpoint", "PATCH", "/api/instances/{instance_id}/endpoint",
+          f"/api/instances/{inst}/endpoint", json={"public_endpoint": "vpn.example.com"}),
+        e("/api/instances/{id}/ip-reservations", "GET", "/api/instances/{instance_id}/ip-reservations",
+          f"/api/instances/{inst}/ip-reservations"),
+        e("/api/instances/{id}/ip-reservations", "POST", "/api/instances/{instance_id}/ip-reservations",
+          f"/api/instances/{inst}/ip-reservations", setup=lambda: {"json": {"reservation": new_reservation()}},
+          teardown=remove_reservation),
+        e("/api/instances/{id}/ip-reservations", "DELETE", "/api/instances/{instance_id}/ip-reservations",
+          f"/api/instances/{inst}/ip-reservations", setup=added_reservation),
+        e("/api/stats/top-clients", "GET", "/api/stats/top-clients"),
+        e("/api/stats/top-clients?group_by=group&window=60", "GET", "/api/stats/top-clients",
+          params={"group_by": "group", "window": 60, "k": 20}),
+        e("/api/stats/traffic", "GET", "/api/stats/traffic"),
+        e("/api/stats/instances", "GET", "/api/stats/instances"),
+        e("/api/stats/groups", "GET", "/api/stats/groups"),
+        e("/api/instances/{id}/clients/{name}/traffic", "GET", "/api/instances/{instance_id}/clients/{client_name}/traffic",
+          f"/api/instances/{inst}/clients/{client}/traffic"),
+        e("/api/instances/{id}/traffic/archive", "GET", "/api/instances/{instance_id}/traffic/archive",
+          f"/api/instances/{inst}/traffic/archive"),
+        e("/api/instances/{id}/sessions", "GET", "/api/instances/{instance_id}/sessions",
+          f"/api/instances/{inst}/sessions", params={"start": now - 7 * 86400}),
+        e("/api/instances/{id}/clients/{name}/sessions", "GET", "/api/instances/{instance_id}/clients/{client_name}/sessions",
+          f"/api/instances/{inst}/clients/{client}/sessions", params={"start": now - 7 * 86400}),
+        e("/api/instances/{id}/usage", "GET", "/api/instances/{instance_id}/usage", f"/api/instances/{inst}/usage"),
+        e("/api/instances/{id}/clients/{name}/usage", "GET", "/api/instances/{instance_id}/clients/{client_name}/usage",
+          f"/api/instances/{inst}/clients/{member}/usage"),
+        e("/api/lookup/ip/{ip}", "GET", "/api/lookup/ip/{ip}",
+          f"/api/lookup/ip/{ip_manager.get_static_ips(inst, ctx.subnet)[member]}"),
+        e("/api/network/interfaces", "GET", "/api/network/interfaces"),
+        e("/api/instances/{id}/clients", "GET", "/api/instances/{instance_id}/clients", f"/api/instances/{inst}/clients"),
+        e("/api/instances/{id}/clients?page=1", "GET", "/api/instances/{instance_id}/clients",
+          f"/api/instances/{inst}/clients", params={"page": 1, "page_size": 50}),
+        e("/api/instances/{id}/clients?search", "GET", "/api/instances/{instance_id}/clients",
+          f"/api/instances/{inst}/clients", params={"page": 1, "page_size": 50, "search": "client01"}),
+        e("/api/instances/{id}/clients?status=connected&sort=traffic", "GET", "/api/instances/{instance_id}/clients",
+          f"/api/instances/{inst}/clients", params={"page": 1, "page_size": 50, "status": "connected", "sort": "traffic"}),
+        e("/api/instances/{id}/clients?since=0", "GET", "/api/instances/{instance_id}/clients",
+          f"/api/instances/{inst}/clients", params={"since": 0}),
+        e("/api/instances/{id}/clients", "POST", "/api/instances/{instance_id}/clients", f"/api/instances/{inst}/clients",
+          setup=lambda: {"json": {"client_name": ctx.unique("bench")}}),
+        e("/api/instances/{id}/clients/{name}/download", "GET",
+          "/api/instances/{instance_id}/clients/{client_name}/download", f"/api/instances/{inst}/clients/{client}/download"),
+        e("/api/instances/{id}/clients/export?group_id", "GET", "/api/instances/{instance_id}/clients/export",
+          f"/api/instances/{inst}/clients/export", params={"group_id": group_id}),
+        e("/api/instances/{id}/clients/regenerate", "POST", "/api/instances/{instance_id}/clients/regenerate",
+          f"/api/instances/{inst}/clients/regenerate"),
+        e("/api/instances/{id}/clients/{name}", "DELETE", "/api/instances/{instance_id}/clients/{client_name}",
+          setup=new_client),
+        e("/api/groups", "GET", "/api/groups"),
+        e("/api/groups?since=0", "GET", "/api/groups", params={"since": 0}),
+        e("/api/groups", "POST", "/api/groups", setup=group_body, teardown=delete_created_group),
+        e("/api/groups/{id}", "DELETE", "/api/groups/{group_id}", setup=new_group),
+        e("/api/groups/{id}/members", "POST", "/api/groups/{group_id}/members", f"/api/groups/{group_id}/members",
+          setup=member_body, teardown=remove_added_member),
+        e("/api/groups/{id}/members/bulk", "POST", "/api/groups/{group_id}/members/bulk",
+          f"/api/groups/{group_id}/members/bulk", setup=bulk_body, teardown=remove_bulk_members),
+        e("/api/groups/{id}/members/{member}", "DELETE", "/api/groups/{group_id}/members/{client_identifier}",
+          setup=added_member),
+        e("/api/firewall/rules", "GET", "/api/firewall/rules"),
+        e("/api/firewall/rules?since=0", "GET", "/api/firewall/rules", params={"since": 0}),
+        e("/api/firewall/rules", "POST", "/api/firewall/rules", json=rule_body, teardown=delete_created_rule),
+        e("/api/firewall/rules/export?format=csv", "GET", "/api/firewall/rules/export",
+          params={"instance_id": inst, "format": "csv"}),
+        e("/api/firewall/rules/import", "POST", "/api/firewall/rules/import",
+          params={"group_id": group_id, "mode": "replace"}, content=rules_export),
+        e("/api/firewall/rules/{id}", "PUT", "/api/firewall/rules/{rule_id}", f"/api/firewall/rules/{rule_id}",
+          json={**rule_body, "description": ""}),
+        e("/api/firewall/rules/{id}", "DELETE", "/api/firewall/rules/{rule_id}", setup=new_rule),
+        e("/api/firewall/rules/order", "POST", "/api/firewall/rules/order",
+          json=[{"id": rule_id, "order": 0}]),
+        e("/api/machine-firewall/rules", "GET", "/api/machine-firewall/rules"),
+        e("/api/machine-firewall/rules", "POST", "/api/machine-firewall/rules", json=machine_rule,
+          teardown=delete_machine_rules),
+        e("/api/machine-firewall/rules/{id}", "PUT", "/api/machine-firewall/rules/{rule_id}",
+          "/api/machine-firewall/rules/machine-000",
+          json={"chain": "INPUT", "action": "ACCEPT", "protocol": "tcp", "port": 2000, "source": "198.51.100.0"}),
+        e("/api/machine-firewall/rules/{id}", "DELETE", "/api/machine-firewall/rules/{rule_id}", setup=new_machine_rule),
+        e("/api/machine-firewall/rules/apply", "PATCH", "/api/machine-firewall/rules/apply", json=machine_order),
+        e("/api/machine-network/interfaces", "GET", "/api/machine-network/interfaces"),
+        e("/api/machine-network/interfaces/{name}/config", "GET",
+          "/api/machine-network/interfaces/{interface_name}/config", "/api/machine-network/interfaces/eth0/config"),
+        e("/api/machine-network/netplan-pending", "GET", "/api/machine-network/netplan-pending"),
+        e("/api/machine-network/netplan-apply", "POST", "/api/machine-network/netplan-apply"),
+        e("/", "GET", "/"),
+    ]
+
+# --- Measurement ---
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    return sorted_values[max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))]
+
+def measure(bench: Benchmark, env: SyntheticEnvironment, min_rounds: int, rounds: int, max_time: float) -> Dict:
+    timings: List[float] = []
+    commands = Counter()
+    started = time.perf_counter()
+    while len(timings) < rounds and (len(timings) < min_rounds or time.perf_counter() - started < max_time):
+        args = bench.setup() if bench.setup else {}
+        offset = env.stub_offset()
+        start = time.perf_counter()
+        bench.call(**args)
+        timings.append(time.perf_counter() - start)
+        _, calls = env.stub_calls(offset)
+        commands.update(calls)
+        if bench.teardown:
+            bench.teardown(args)
+    timings.sort()
+    n = len(timings)
+    return {
+        "rounds": n,
+        "median_ms": round(percentile(timings, 0.5) * 1000, 3),
+        "p95_ms": round(percentile(timings, 0.95) * 1000, 3),
+        "min_ms": round(timings[0] * 1000, 3),
+        "mean_ms": round(sum(timings) / n * 1000, 3),
+        "commands": round(sum(commands.values()) / n, 1),
+        "commands_by_type": {name: round(count / n, 1) for name, count in sorted(commands.items())},
+    }
+
+# --- History ---
+
+def _git(*args: str) -> str:
+    try:
+        return subprocess.run(["git", *args], cwd=BENCHMARKS_DIR, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def load_previous(path: str, parameters: Dict) -> Optional[Dict]:
+    """The latest recorded run with the same environment parameters."""
+    previous = None
+    try:
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    if record.get("parameters") == parameters:
+                        previous = record
+    except FileNotFoundError:
+        pass
+    return previous
+
+def compare(result: Dict, before: Optional[Dict], threshold: float) -> Tuple[Optional[float], bool]:
+    """
+    Ratio of a median to the previous run's (None if not measured before) and whether it
+    regressed: the minimum must be slower too, so one noisy round does not count.
+    """
+    if not before or not before.get("median_ms") or not before.get("min_ms"):
+        return None, False
+    ratio = result["median_ms"] / before["median_ms"]
+    regressed = (ratio > threshold and result["min_ms"] / before["min_ms"] > threshold
+                 and result["median_ms"] - before["median_ms"] > NOISE_FLOOR_MS)
+    return ratio, regressed
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmark degli endpoint API e dei manager su un host sintetico.")
+    parser.add_argument("--filter", help="esegue solo i benchmark il cui nome corrisponde alla regex")
+    parser.add_argument("--instances", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=50000, help="voci nell'index.txt della PKI")
+    parser.add_argument("--sessions", type=int, default=5000, help="client connessi nei log di stato")
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--rules-per-group", type=int, default=3)
+    parser.add_argument("--members-per-group", type=int, default=5)
+    parser.add_argument("--min-rounds", type=int, default=3)
+    parser.add_argument("--rounds", type=int, default=50)
+    parser.add_argument("--max-time", type=float, default=2.0, help="secondi per benchmark dopo --min-rounds")
+    parser.add_argument("--history", default=HISTORY_FILE, help="file JSONL dello storico dei risultati")
+    parser.add_argument("--threshold", type=float, default=1.25, help="rapporto sulla mediana oltre cui segnalare una regressione")
+    parser.add_argument("--no-save", action="store_true", help="non aggiunge il run allo storico")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="non cancella l'ambiente sintetico")
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)  # the stubs make some commands "fail" on purpose
+    env = SyntheticEnvironment(tempfile.mkdtemp(prefix="vpn-bench-"), instances=args.instances, clients=args.clients,
+                               sessions=args.sessions, groups=args.groups, rules_per_group=args.rules_per_group,
+                               members_per_group=args.members_per_group)
+    build_start = time.perf_counter()
+    env.build()
+    print(f"Synthetic environment in {env.root} ({time.perf_counter() - build_start:.1f}s): {env.parameters()}")
+    try:
+        ctx = Context(env, load_backend(env))
+        benchmarks = manager_benchmarks(ctx) + endpoint_benchmarks(ctx)
+
+        covered = {b.route for b in benchmarks if b.route}
+        for route in ctx.main.app.routes:
+            for method in sorted(getattr(route, "methods", None) or ()):
+                key = f"{method} {route.path}"
+                if method != "HEAD" and key not in covered and route.path.startswith(("/api", "/metrics", "/")) \
+                        and not route.path.startswith(("/docs", "/openapi", "/redoc")):
+                    print(f"  not benchmarked: {key} ({SKIPPED_ROUTES.get(key, 'nessun benchmark definito')})")
+
+        if args.filter:
+            pattern = re.compile(args.filter)
+            benchmarks = [b for b in benchmarks if pattern.search(b.name)]
+
+        previous = load_previous(args.history, env.parameters())
+        if previous:
+            print(f"Comparing with the run of {previous['timestamp']} ({previous['commit']})")
+        results, errors, regressions = {}, {}, []
+        print(f"{'benchmark':<72} {'median':>10} {'p95':>10} {'cmds':>7} {'vs prev':>8}")
+        for bench in benchmarks:
+            try:
+                result = measure(bench, env, args.min_rounds, args.rounds, args.max_time)
+            except Exception as e:
+                errors[bench.name] = str(e)
+                print(f"{bench.name:<72} ERROR {e}")
+                continue
+            results[bench.name] = result
+            ratio, regressed = compare(result, (previous or {}).get("results", {}).get(bench.name), args.threshold)
+            if regressed:
+                regressions.append(bench.name)
+            flag = " REGRESSION" if regressed else ""
+            change = f"{ratio:.2f}x" if ratio else "-"
+            print(f"{bench.name:<72} {result['median_ms']:>8.2f}ms {result['p95_ms']:>8.2f}ms "
+                  f"{result['commands']:>7g} {change:>8}{flag}")
+    finally:
+        if not args.keep:
+            env.cleanup()
+
+    if not args.no_save and not args.filter:
+        record = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "commit": _git("rev-parse", "--short", "HEAD") + ("-dirty" if _git("status", "--porcelain", "--", "../backend") else ""),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "parameters": env.parameters(),
+            "results": results,
+            "errors": errors,
+        }
+        with open(args.history, "a") as f:
+            f.write(json.dumps(record, sort_keys=True) + "\n")
+        print(f"Results appended to {args.history}")
+
+    if errors:
+        print(f"{len(errors)} benchmark(s) failed")
+    if regressions:
+        print(f"{len(regressions)} regression(s) over {args.threshold}x: {', '.join(regressions)}")
+    return 1 if (errors or regressions) and args.fail_on_regression else 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,479 @@
+"""
+Load test of the API: concurrent virtual users replay what the dashboard and the
+administrators do, against the same synthetic OpenVPN host as the benchmarks (see
+environment.py), with the background services running and the status logs rewritten
+as OpenVPN would.
+
+    python benchmarks/loadtest.py                                   # "mixed" mix, 60s, in-process
+    python benchmarks/loadtest.py --mix onboarding --duration 120
+    python benchmarks/loadtest.py --users dashboard=200,live=50 --transport socket
+    python benchmarks/loadtest.py --think-scale 0                   # no pauses: saturation
+
+Users:
+    dashboard   polls /api/instances (incrementally) and /api/stats/top-clients
+    instance    the instance page: client list (incrementally) and connected clients by traffic
+    live        keeps /api/events (Server-Sent Events) open and counts the events
+    admin       creates clients and downloads their profile, edits rules, searches, revokes
+    onboarding  creates a team of clients one by one, then adds them to a group in one bulk request
+
+With --transport asgi (default) the requests are passed to the app in the same event
+loop; with --transport socket uvicorn serves the app on a local port from its own
+thread and the users connect over HTTP. The report gives throughput and p50/p99
+latency per request, the event-loop lag of the server (how late a timer fires: async
+endpoints doing blocking work show up here) and the external commands run.
+"""
+import os
+import json
+import time
+import random
+import socket
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+from collections import Counter, defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from bench import percentile
+from environment import API_KEY, SyntheticEnvironment, load_backend
+
+# Seconds between two polls of a page, and pauses of the administrators between actions
+POLL_INTERVAL = 5.0
+ADMIN_PAUSE = 10.0
+ONBOARDING_PAUSE = 0.5
+# How often the lag probe fires, and how often "OpenVPN" rewrites the status logs
+LAG_INTERVAL = 0.05
+STATUS_REWRITE_INTERVAL = 10.0
+
+MIXES = {
+    "dashboards": {"dashboard": 50, "live": 20},
+    "mixed": {"dashboard": 20, "instance": 5, "live": 10, "admin": 2},
+    "onboarding": {"dashboard": 10, "live": 5, "onboarding": 2},
+}
+
+class Recorder:
+    """Latencies and failures per request, event-loop lag samples and SSE events received."""
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.failures = Counter()
+        self.lag: List[float] = []
+        self.events = Counter()
+
+    def observe(self, name: str, seconds: float, ok: bool):
+        self.latencies[name].append(seconds)
+        if not ok:
+            self.failures[name] += 1
+
+class LoadTest:
+    """State shared by the virtual users: the HTTP client, the environment and the stop signal."""
+    def __init__(self, env: SyntheticEnvironment, client: httpx.AsyncClient,
+                 stream: Callable[[str, Callable[[bytes], None]], Awaitable[None]],
+                 think_scale: float = 1.0, poll_interval: float = POLL_INTERVAL, batch: int = 20, seed: int = 1):
+        self.env = env
+        self.client = client
+        self.stream = stream
+        self.think_scale = think_scale
+        self.poll_interval = poll_interval
+        self.batch = batch
+        self.random = random.Random(seed)
+        self.recorder = Recorder()
+        self.stop = asyncio.Event()
+        self.sequence = 0
+
+    @property
+    def stopped(self) -> bool:
+        return self.stop.is_set()
+
+    def unique(self, prefix: str) -> str:
+        self.sequence += 1
+        return f"{prefix}{os.getpid()}x{self.sequence}"
+
+    def instance(self, n: int) -> str:
+        """Instance name for the n-th user of a kind, so the users spread over the instances."""
+        names = list(self.env.instances)
+        return names[n % len(names)]
+
+    def groups(self, instance_name: str) -> List[int]:
+        """Indexes (in env.groups) of the groups of an instance."""
+        return [i for i, g in enumerate(self.env.groups) if g["instance_id"] == instance_name]
+
+    async def request(self, name: str, method: str, path: str, **kwargs) -> Optional[httpx.Response]:
+        """Times one request under `name`; returns the response, or None if it failed."""
+        start = time.perf_counter()
+        try:
+            response = await self.client.request(method, path, **kwargs)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            response, ok = None, False
+        self.recorder.observe(name, time.perf_counter() - start, ok)
+        return response if ok else None
+
+    async def think(self, seconds: float):
+        """Pause of about `seconds` (scaled, with jitter), cut short when the run ends."""
+        delay = seconds * self.think_scale * self.random.uniform(0.5, 1.5)
+        if delay <= 0:
+            await asyncio.sleep(0)
+            return
+        try:
+            await asyncio.wait_for(self.stop.wait(), timeout=delay)
+        except asyncio.TimeoutError:
+            pass
+
+# --- Virtual users ---
+
+async def dashboard_user(t: LoadTest, n: int):
+    version = 0
+    while not t.stopped:
+        response = await t.request("GET /api/instances?since", "GET", "/api/instances", params={"since": version})
+        if response:
+            version = response.json()["version"]
+        await t.request("GET /api/stats/top-clients", "GET", "/api/stats/top-clients")
+        await t.think(t.poll_interval)
+
+async def instance_user(t: LoadTest, n: int):
+    inst = t.instance(n)
+    await t.request("GET /api/instances/{id}", "GET", f"/api/instances/{inst}")
+    version = 0
+    while not t.stopped:
+        response = await t.request("GET /api/instances/{id}/clients?since", "GET", f"/api/instances/{inst}/clients",
+                                   params={"since": version})
+        if response:
+            version = response.json()["version"]
+        await t.request("GET /api/instances/{id}/clients?status=connected&sort=traffic", "GET",
+                        f"/api/instances/{inst}/clients",
+                        params={"status": "connected", "sort": "traffic", "order": "desc", "page": 1})
+        await t.think(t.poll_interval)
+
+async def live_user(t: LoadTest, n: int):
+    start = time.perf_counter()
+    pending = b""
+
+    def on_chunk(chunk: bytes):
+        nonlocal pending
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            if line.startswith(b"event: "):
+                event = line[7:].decode()
+                if event == "snapshot":
+                    t.recorder.observe("GET /api/events (snapshot)", time.perf_counter() - start, True)
+                t.recorder.events[event] += 1
+
+    try:
+        await t.stream("/api/events", on_chunk)
+    except (httpx.HTTPError, RuntimeError):
+        t.recorder.observe("GET /api/events (snapshot)", time.perf_counter() - start, False)
+
+async def admin_user(t: LoadTest, n: int):
+    inst = t.instance(n)
+    subnet = t.env.instances[inst]["subnet"]
+    groups = t.groups(inst)
+    created: List[str] = []
+    while not t.stopped:
+        action = t.random.choices(("create", "edit_rule", "search", "revoke"), weights=(3, 2, 4, 1))[0]
+        if action == "create":
+            client_name = t.unique("admin")
+            if await t.request("POST /api/instances/{id}/clients", "POST", f"/api/instances/{inst}/clients",
+                               json={"client_name": client_name}):
+                created.append(f"{inst}_{client_name}")
+                await t.request("GET /api/instances/{id}/clients/{name}/download", "GET",
+                                f"/api/instances/{inst}/clients/{inst}_{client_name}/download")
+        elif action == "edit_rule" and groups:
+            g = t.random.choice(groups)
+            await t.request("PUT /api/firewall/rules/{id}", "PUT", f"/api/firewall/rules/rule-{g:04d}-0", json={
+                "group_id": t.env.groups[g]["id"], "action": "ACCEPT", "protocol": "tcp",
+                "port": str(t.random.randrange(1024, 65536)), "destination": subnet, "description": "load test"})
+        elif action == "revoke" and created:
+            await t.request("DELETE /api/instances/{id}/clients/{name}", "DELETE",
+                            f"/api/instances/{inst}/clients/{created.pop(0)}")
+        else:
+            await t.request("GET /api/instances/{id}/clients?search", "GET", f"/api/instances/{inst}/clients",
+                            params={"search": f"{inst}_client{t.random.randrange(1000):03d}", "page": 1})
+        await t.think(ADMIN_PAUSE)
+
+async def onboarding_user(t: LoadTest, n: int):
+    inst = t.instance(n)
+    groups = t.groups(inst)
+    subnet_info = {"instance_name": inst, "subnet": t.env.instances[inst]["subnet"]}
+    while not t.stopped:
+        team = []
+        for _ in range(t.batch):
+            if t.stopped:
+                break
+            client_name = t.unique("team")
+            if await t.request("POST /api/instances/{id}/clients", "POST", f"/api/instances/{inst}/clients",
+                               json={"client_name": client_name}):
+                team.append(f"{inst}_{client_name}")
+            await t.think(ONBOARDING_PAUSE)
+        if team and groups and not t.stopped:
+            group_id = t.env.groups[groups[n % len(groups)]]["id"]
+            await t.request("POST /api/groups/{id}/members/bulk", "POST", f"/api/groups/{group_id}/members/bulk",
+                            json={"add": team, "remove": [], "subnet_info": subnet_info})
+        await t.think(ADMIN_PAUSE)
+
+USERS: Dict[str, Callable[[LoadTest, int], Awaitable[None]]] = {
+    "dashboard": dashboard_user,
+    "instance": instance_user,
+    "live": live_user,
+    "admin": admin_user,
+    "onboarding": onboarding_user,
+}
+
+# --- Transports ---
+
+def asgi_stream(app, headers: Dict[str, str]):
+    """
+    Streams a GET from the app in-process: httpx's ASGI transport buffers the whole body,
+    which never ends for Server-Sent Events. Runs until cancelled.
+    """
+    async def stream(path: str, on_chunk: Callable[[bytes], None]):
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+            "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+            "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 80),
+        }
+        requested = False
+        disconnected = asyncio.Event()
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start" and message["status"] >= 400:
+                raise RuntimeError(f"GET {path} -> {message['status']}")
+            if message["type"] == "http.response.body":
+                on_chunk(message.get("body", b""))
+
+        await app(scope, receive, send)
+    return stream
+
+def http_stream(client: httpx.AsyncClient):
+    async def stream(path: str, on_chunk: Callable[[bytes], None]):
+        async with client.stream("GET", path) as response:
+            response.raise_for_status()
+            async for chunk in response.aiter_raw():
+                on_chunk(chunk)
+    return stream
+
+class ServerThread:
+    """uvicorn serving the app (with its lifespan) on a local port from its own thread and event loop."""
+    def __init__(self, app, port: int = 0):
+        import uvicorn
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind(("127.0.0.1", port))
+        self.server = uvicorn.Server(uvicorn.Config(app, lifespan="on", log_level="warning", access_log=False))
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="loadtest-server", daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.socket.getsockname()
+        return f"http://{host}:{port}"
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.server.serve(sockets=[self.socket]))
+
+    def start(self, timeout: float = 30.0):
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("uvicorn non si è avviato")
+            time.sleep(0.05)
+
+    def stop(self):
+        self.server.should_exit = True
+        self._thread.join(timeout=10)
+
+# --- Measurement ---
+
+async def probe_loop_lag(samples: List[float], interval: float = LAG_INTERVAL):
+    """Records how late a timer due every `interval` seconds fires in the running loop. Runs until cancelled."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+def rewrite_status_logs(env: SyntheticEnvironment, stop: threading.Event, interval: float = STATUS_REWRITE_INTERVAL):
+    """The OpenVPN side: rewrites the status logs with growing byte counters, as the daemons do."""
+    tick = 2
+    while not stop.wait(interval):
+        env.write_status_logs(tick)
+        tick += 1
+
+def parse_users(spec: str) -> Dict[str, int]:
+    users = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        kind, _, count = item.partition("=")
+        if kind not in USERS or not count.isdigit():
+            raise argparse.ArgumentTypeError(f"utente non valido: {item!r} (tipi: {', '.join(USERS)})")
+        users[kind] = int(count)
+    return users
+
+def summarize(recorder: Recorder, elapsed: float, commands: Counter) -> Dict:
+    requests = {}
+    for name, timings in sorted(recorder.latencies.items()):
+        timings = sorted(timings)
+        requests[name] = {
+            "count": len(timings),
+            "throughput": round(len(timings) / elapsed, 2),
+            "p50_ms": round(percentile(timings, 0.5) * 1000, 3),
+            "p99_ms": round(percentile(timings, 0.99) * 1000, 3),
+            "max_ms": round(timings[-1] * 1000, 3),
+            "errors": recorder.failures[name],
+        }
+    everything = sorted(t for timings in recorder.latencies.values() for t in timings)
+    lag = sorted(recorder.lag) or [0.0]
+    return {
+        "elapsed_s": round(elapsed, 2),
+        "requests": requests,
+        "total": {
+            "count": len(everything),
+            "throughput": round(len(everything) / elapsed, 2),
+            "p50_ms": round(percentile(everything, 0.5) * 1000, 3) if everything else 0,
+            "p99_ms": round(percentile(everything, 0.99) * 1000, 3) if everything else 0,
+            "errors": sum(recorder.failures.values()),
+        },
+        "loop_lag_ms": {
+            "samples": len(recorder.lag),
+            "p50": round(percentile(lag, 0.5) * 1000, 3),
+            "p99": round(percentile(lag, 0.99) * 1000, 3),
+            "max": round(lag[-1] * 1000, 3),
+        },
+        "events": dict(sorted(recorder.events.items())),
+        "commands": {
+            "total": sum(commands.values()),
+            "per_second": round(sum(commands.values()) / elapsed, 2),
+            "by_type": dict(sorted(commands.items())),
+        },
+    }
+
+def print_report(report: Dict):
+    print(f"{'request':<64} {'count':>7} {'req/s':>8} {'p50':>10} {'p99':>10} {'max':>10} {'errors':>6}")
+    rows = list(report["requests"].items()) + [("total", report["total"])]
+    for name, r in rows:
+        max_ms = f"{r['max_ms']:>8.1f}ms" if "max_ms" in r else f"{'':>10}"
+        print(f"{name:<64} {r['count']:>7} {r['throughput']:>8.2f} {r['p50_ms']:>8.1f}ms {r['p99_ms']:>8.1f}ms "
+              f"{max_ms} {r['errors']:>6}")
+    lag = report["loop_lag_ms"]
+    print(f"event loop lag: p50 {lag['p50']:.1f}ms, p99 {lag['p99']:.1f}ms, max {lag['max']:.1f}ms ({lag['samples']} samples)")
+    if report["events"]:
+        print("SSE events: " + ", ".join(f"{name}={count}" for name, count in report["events"].items()))
+    commands = report["commands"]
+    print(f"external commands: {commands['total']} ({commands['per_second']:.1f}/s)"
+          + "".join(f", {name}={count}" for name, count in commands["by_type"].items()))
+
+# --- Run ---
+
+async def run(env: SyntheticEnvironment, main, users: Dict[str, int], duration: float, transport: str,
+              think_scale: float, poll_interval: float, batch: int, seed: int) -> Dict:
+    headers = {"X-API-Key": API_KEY}
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    lag_samples: List[float] = []
+    server = None
+    if transport == "socket":
+        server = ServerThread(main.app)
+        server.start()
+        client = httpx.AsyncClient(base_url=server.url, headers=headers, timeout=None, limits=limits)
+        stream = http_stream(client)
+        lag = asyncio.run_coroutine_threadsafe(probe_loop_lag(lag_samples), server.loop)
+    else:
+        lifespan = main.lifespan(main.app)
+        await lifespan.__aenter__()
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest",
+                                   headers=headers, timeout=None)
+        stream = asgi_stream(main.app, headers)
+        lag = asyncio.ensure_future(probe_loop_lag(lag_samples))
+
+    t = LoadTest(env, client, stream, think_scale=think_scale, poll_interval=poll_interval, batch=batch, seed=seed)
+    t.recorder.lag = lag_samples
+    rewriting = threading.Event()
+    threading.Thread(target=rewrite_status_logs, args=(env, rewriting), name="loadtest-openvpn", daemon=True).start()
+    offset = env.stub_offset()
+
+    async def user(kind: str, n: int):
+        # Users arrive over the first poll interval instead of all at once
+        await t.think(poll_interval / 2)
+        await USERS[kind](t, n)
+
+    started = time.perf_counter()
+    tasks = {asyncio.ensure_future(user(kind, n)): kind for kind, count in users.items() for n in range(count)}
+    try:
+        await asyncio.sleep(duration)
+        t.stop.set()
+        # Every user finishes the step it is in; the live streams never end on their own
+        for task, kind in tasks.items():
+            if kind == "live":
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        elapsed = time.perf_counter() - started
+    finally:
+        rewriting.set()
+        lag.cancel()
+        await client.aclose()
+        if server:
+            server.stop()
+        else:
+            await lifespan.__aexit__(None, None, None)
+    _, commands = env.stub_calls(offset)
+    return summarize(t.recorder, elapsed, commands)
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Load test dell'API con utenti concorrenti su un host sintetico.")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed", help="composizione predefinita degli utenti")
+    parser.add_argument("--users", type=parse_users, help="utenti per tipo, es. dashboard=100,admin=2 (sostituisce --mix)")
+    parser.add_argument("--duration", type=float, default=60.0, help="secondi di carico")
+    parser.add_argument("--transport", choices=("asgi", "socket"), default="asgi",
+                        help="asgi: in-process; socket: uvicorn su una porta locale")
+    parser.add_argument("--think-scale", type=float, default=1.0, help="moltiplicatore delle pause degli utenti (0 = nessuna pausa)")
+    parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help="secondi tra due aggiornamenti delle pagine")
+    parser.add_argument("--batch", type=int, default=20, help="client creati per ciclo di onboarding")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--instances", type=int, default=3)
+    parser.add_argument("--clients", type=int, default=50000, help="voci nell'index.txt della PKI")
+    parser.add_argument("--sessions", type=int, default=5000, help="client connessi nei log di stato")
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--rules-per-group", type=int, default=3)
+    parser.add_argument("--members-per-group", type=int, default=5)
+    parser.add_argument("--json", help="scrive anche il report in questo file JSON")
+    parser.add_argument("--keep", action="store_true", help="non cancella l'ambiente sintetico")
+    args = parser.parse_args()
+
+    logging.disable(logging.ERROR)  # the stubs make some commands "fail" on purpose
+    users = args.users or MIXES[args.mix]
+    env = SyntheticEnvironment(tempfile.mkdtemp(prefix="vpn-load-"), instances=args.instances, clients=args.clients,
+                               sessions=args.sessions, groups=args.groups, rules_per_group=args.rules_per_group,
+                               members_per_group=args.members_per_group, seed=args.seed)
+    env.build()
+    print(f"Synthetic environment in {env.root}: {env.parameters()}")
+    print(f"Users: {', '.join(f'{kind}={count}' for kind, count in users.items())}; "
+          f"{args.duration:g}s over {args.transport}, think scale {args.think_scale:g}")
+    try:
+        main = load_backend(env)
+        report = asyncio.run(run(env, main, users, args.duration, args.transport, args.think_scale,
+                                 args.poll_interval, args.batch, args.seed))
+    finally:
+        if not args.keep:
+            env.cleanup()
+
+    print_report(report)
+    if args.json:
+        report.update(parameters=env.parameters(), users=users, duration=args.duration, transport=args.transport,
+                      think_scale=args.think_scale)
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == "__main__":
+    main_cli()
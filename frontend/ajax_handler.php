@@ -24,7 +24,8 @@ switch ($action) {
         break;
 
     case 'get_instances':
-        $response = get_instances();
+        $since = isset($_GET['since']) && $_GET['since'] !== '' ? $_GET['since'] : null;
+        $response = get_instances($since);
         echo json_encode($response);
         break;
 
@@ -95,7 +96,11 @@ switch ($action) {
             echo json_encode(['success' => false, 'body' => ['detail' => 'ID istanza mancante.']]);
             exit;
         }
-        $response = get_clients($instance_id);
+        $list_params = array_filter(
+            array_intersect_key($_GET, array_flip(['page', 'page_size', 'search', 'match', 'status', 'group_id', 'sort', 'order', 'since'])),
+            fn($v) => $v !== ''
+        );
+        $response = get_clients($instance_id, $list_params);
         echo json_encode($response);
         break;
 
@@ -117,8 +122,14 @@ switch ($action) {
             echo json_encode(['success' => false, 'body' => ['detail' => 'Dati non validi.']]);
             exit;
         }
-        $response = download_client_config($instance_id, $client_name);
-        if ($response['success']) {
+        // Chiede al backend solo l'autorizzazione: nginx servirà il file via X-Accel-Redirect
+        $response = download_client_config($instance_id, $client_name, true);
+        $accel_location = $response['success'] ? get_response_header($response, 'X-Accel-Redirect') : null;
+        if ($accel_location) {
+            header('Content-Type: application/x-openvpn-profile');
+            header('Content-Disposition: attachment; filename="' . $client_name . '.ovpn"');
+            header('X-Accel-Redirect: ' . $accel_location);
+        } elseif ($response['success']) {
             header('Content-Type: application/x-openvpn-profile');
             header('Content-Disposition: attachment; filename="' . $client_name . '.ovpn"');
             echo $response['body'];
@@ -139,7 +150,11 @@ switch ($action) {
         break;
 
     case 'get_top_clients':
-        $response = get_top_clients();
+        $top_params = array_filter(
+            array_intersect_key($_GET, array_flip(['k', 'window', 'direction', 'group_by'])),
+            fn($v) => $v !== ''
+        );
+        $response = get_top_clients($top_params);
         echo json_encode($response);
         break;
 
@@ -147,7 +162,8 @@ switch ($action) {
 
     case 'get_groups':
         $instance_id = $_GET['instance_id'] ?? null;
-        $response = get_groups($instance_id);
+        $since = isset($_GET['since']) && $_GET['since'] !== '' ? $_GET['since'] : null;
+        $response = get_groups($instance_id, $since);
         echo json_encode($response);
         break;
 
@@ -196,7 +212,8 @@ switch ($action) {
 
     case 'get_rules':
         $group_id = $_GET['group_id'] ?? null;
-        $response = get_rules($group_id);
+        $since = isset($_GET['since']) && $_GET['since'] !== '' ? $_GET['since'] : null;
+        $response = get_rules($group_id, $since);
         echo json_encode($response);
         break;
         
@@ -287,7 +304,8 @@ switch ($action) {
     // --- Machine Firewall Rules Cases ---
 
     case 'get_machine_firewall_rules':
-        $response = get_machine_firewall_rules();
+        $since = isset($_GET['since']) && $_GET['since'] !== '' ? $_GET['since'] : null;
+        $response = get_machine_firewall_rules($since);
         echo json_encode($response);
         break;
 
@@ -360,7 +378,19 @@ switch ($action) {
             echo json_encode(['success' => false, 'body' => ['detail' => 'Dati mancanti per aggiornare la configurazione interfaccia.']]);
             exit;
         }
-        $response = update_machine_network_interface_config($interface_name, $data);
+        $rollback_timeout = intval($_GET['rollback_timeout'] ?? 0);
+        $response = update_machine_network_interface_config($interface_name, $data, $rollback_timeout);
+        echo json_encode($response);
+        break;
+
+    case 'confirm_netplan_change':
+    case 'rollback_netplan_change':
+        $change_id = $_GET['change_id'] ?? '';
+        if (empty($change_id)) {
+            echo json_encode(['success' => false, 'body' => ['detail' => 'ID modifica mancante.']]);
+            exit;
+        }
+        $response = $action === 'confirm_netplan_change' ? confirm_netplan_change($change_id) : rollback_netplan_change($change_id);
         echo json_encode($response);
         break;
 
@@ -78,9 +78,11 @@ function get_network_interfaces()
     return api_request('/network/interfaces');
 }
 
-function get_instances()
+function get_instances($since = null)
 {
-    return api_request('/instances');
+    // $since: restituisce solo le istanze cambiate/eliminate dopo quella versione
+    $query = $since !== null ? '?since=' . intval($since) : '';
+    return api_request('/instances' . $query);
 }
 
 function get_instance($instance_id)
@@ -115,9 +117,11 @@ function update_instance_routes($instance_id, $tunnel_mode, $routes, $dns_server
     ]);
 }
 
-function get_clients($instance_id)
+function get_clients($instance_id, $params = [])
 {
-    return api_request('/instances/' . urlencode($instance_id) . '/clients');
+    // $params: page, page_size, search, match, status, group_id, sort, order, since (opzionali)
+    $query = $params ? '?' . http_build_query($params) : '';
+    return api_request('/instances/' . urlencode($instance_id) . '/clients' . $query);
 }
 
 function create_client($instance_id, $client_name)
@@ -125,9 +129,24 @@ function create_client($instance_id, $client_name)
     return api_request('/instances/' . urlencode($instance_id) . '/clients', 'POST', ['client_name' => $client_name]);
 }
 
-function download_client_config($instance_id, $client_name)
+function download_client_config($instance_id, $client_name, $accel = false)
 {
-    return api_request("/instances/$instance_id/clients/$client_name/download", 'GET', [], true);
+    $query = $accel ? '?accel=true' : '';
+    return api_request("/instances/$instance_id/clients/$client_name/download" . $query, 'GET', [], true);
+}
+
+// Estrae un header dalla risposta grezza di api_request (null se assente)
+function get_response_header($response, $name)
+{
+    if (empty($response['header'])) {
+        return null;
+    }
+    foreach (explode("\r\n", $response['header']) as $line) {
+        if (stripos($line, $name . ':') === 0) {
+            return trim(substr($line, strlen($name) + 1));
+        }
+    }
+    return null;
 }
 
 function revoke_client($instance_id, $client_name)
@@ -135,18 +154,18 @@ function revoke_client($instance_id, $client_name)
     return api_request('/instances/' . urlencode($instance_id) . '/clients/' . urlencode($client_name), 'DELETE');
 }
 
-function get_top_clients()
+function get_top_clients($params = [])
 {
-    return api_request('/stats/top-clients');
+    // $params: k, window, direction, group_by (opzionali)
+    $query = $params ? '?' . http_build_query($params) : '';
+    return api_request('/stats/top-clients' . $query);
 }
 
 // --- Groups & Firewall Functions ---
 
-function get_groups($instance_id = null) {
-    $url = '/groups';
-    if ($instance_id) {
-        $url .= '?instance_id=' . urlencode($instance_id);
-    }
+function get_groups($instance_id = null, $since = null) {
+    $params = array_filter(['instance_id' => $instance_id, 'since' => $since], fn($v) => $v !== null);
+    $url = '/groups' . ($params ? '?' . http_build_query($params) : '');
     return api_request($url);
 }
 
@@ -178,11 +197,9 @@ function remove_group_member($group_id, $client_identifier, $instance_name) {
     return api_request('/groups/' . urlencode($group_id) . '/members/' . urlencode($client_identifier) . '?instance_name=' . urlencode($instance_name), 'DELETE');
 }
 
-function get_rules($group_id = null) {
-    $url = '/firewall/rules';
-    if ($group_id) {
-        $url .= '?group_id=' . urlencode($group_id);
-    }
+function get_rules($group_id = null, $since = null) {
+    $params = array_filter(['group_id' => $group_id, 'since' => $since], fn($v) => $v !== null);
+    $url = '/firewall/rules' . ($params ? '?' . http_build_query($params) : '');
     return api_request($url);
 }
 
@@ -226,8 +243,9 @@ function update_instance_firewall_policy($instance_id, $new_policy) {
 
 // --- Machine Firewall Rules Functions ---
 
-function get_machine_firewall_rules() {
-    return api_request('/machine-firewall/rules');
+function get_machine_firewall_rules($since = null) {
+    $query = $since !== null ? '?since=' . intval($since) : '';
+    return api_request('/machine-firewall/rules' . $query);
 }
 
 function add_machine_firewall_rule($rule_data) {
@@ -256,8 +274,17 @@ function get_machine_network_interface_config($interface_name) {
     return api_request('/machine-network/interfaces/' . urlencode($interface_name) . '/config');
 }
 
-function update_machine_network_interface_config($interface_name, $config_data) {
-    return api_request('/machine-network/interfaces/' . urlencode($interface_name) . '/config', 'POST', $config_data);
+function update_machine_network_interface_config($interface_name, $config_data, $rollback_timeout = 0) {
+    $query = $rollback_timeout ? '?rollback_timeout=' . intval($rollback_timeout) : '';
+    return api_request('/machine-network/interfaces/' . urlencode($interface_name) . '/config' . $query, 'POST', $config_data);
+}
+
+function confirm_netplan_change($change_id) {
+    return api_request('/machine-network/netplan-pending/' . urlencode($change_id) . '/confirm', 'POST');
+}
+
+function rollback_netplan_change($change_id) {
+    return api_request('/machine-network/netplan-pending/' . urlencode($change_id) . '/rollback', 'POST');
 }
 
 function apply_global_netplan_config() {
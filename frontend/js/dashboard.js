@@ -1,48 +1,65 @@
 // js/dashboard.js
 
+let instancesVersion = null;
+
+function renderInstanceCard(inst) {
+    const statusColor = inst.status === 'running' ? 'bg-success' : 'bg-danger';
+    return `
+        <div class="col-md-6 col-lg-4" data-instance-col="${inst.id}">
+            <div class="card instance-card" data-instance-id="${inst.id}" onclick='location.href="instance.php?id=${inst.id}"'>
+                <div class="card-body">
+                    <div class="d-flex align-items-center mb-3">
+                        <span class="status-dot ${statusColor} me-2" data-field="status"></span>
+                        <h3 class="card-title m-0">${inst.name}</h3>
+                    </div>
+                    <div class="text-muted">
+                        <div><strong>Porta:</strong> ${inst.port}</div>
+                        <div><strong>Subnet:</strong> ${inst.subnet}</div>
+                        <div class="mt-2 text-dark">
+                            <span class="badge ${inst.tunnel_mode === 'full' ? 'bg-primary-lt' : 'bg-warning-lt'}">
+                                ${inst.tunnel_mode === 'full' ? 'Full Tunnel' : 'Split Tunnel'}
+                            </span>
+                        </div>
+                        <div class="d-flex align-items-center mt-2">
+                            <i class="ti ti-users me-1"></i>
+                            <strong data-field="connected_clients">${inst.connected_clients || 0}</strong> &nbsp;Client Attivi
+                        </div>
+                        <div class="small mt-1" data-field="traffic"></div>
+                    </div>
+                </div>
+            </div>
+        </div>
+    `;
+}
+
+// Fetches only what changed since the last load and patches the cards in place
 async function loadInstances() {
     try {
-        const response = await fetch(`${API_AJAX_HANDLER}?action=get_instances`);
+        const response = await fetch(`${API_AJAX_HANDLER}?action=get_instances&since=${instancesVersion ?? 0}`);
         const result = await response.json();
         const container = document.getElementById('instances-container');
-        container.innerHTML = '';
 
         if (result.success) {
-            const instances = result.body;
-            if (instances.length === 0) {
-                container.innerHTML = '<div class="col-12 text-center text-muted p-5">Nessuna istanza configurata. Creane una nuova.</div>';
-                return;
+            const delta = result.body;
+            if (delta.full) {
+                container.innerHTML = '';
             }
-
-            instances.forEach(inst => {
-                const statusColor = inst.status === 'running' ? 'bg-success' : 'bg-danger';
-                const html = `
-                    <div class="col-md-6 col-lg-4">
-                        <div class="card instance-card" onclick='location.href="instance.php?id=${inst.id}"'>
-                            <div class="card-body">
-                                <div class="d-flex align-items-center mb-3">
-                                    <span class="status-dot ${statusColor} me-2"></span>
-                                    <h3 class="card-title m-0">${inst.name}</h3>
-                                </div>
-                                <div class="text-muted">
-                                    <div><strong>Porta:</strong> ${inst.port}</div>
-                                    <div><strong>Subnet:</strong> ${inst.subnet}</div>
-                                    <div class="mt-2 text-dark">
-                                        <span class="badge ${inst.tunnel_mode === 'full' ? 'bg-primary-lt' : 'bg-warning-lt'}">
-                                            ${inst.tunnel_mode === 'full' ? 'Full Tunnel' : 'Split Tunnel'}
-                                        </span>
-                                    </div>
-                                    <div class="d-flex align-items-center mt-2">
-                                        <i class="ti ti-users me-1"></i>
-                                        <strong>${inst.connected_clients || 0}</strong> &nbsp;Client Attivi
-                                    </div>
-                                </div>
-                            </div>
-                        </div>
-                    </div>
-                `;
-                container.innerHTML += html;
+            container.querySelector('[data-placeholder]')?.remove();
+
+            delta.deleted.forEach(id => container.querySelector(`[data-instance-col="${id}"]`)?.remove());
+            delta.items.forEach(inst => {
+                const existing = container.querySelector(`[data-instance-col="${inst.id}"]`);
+                if (existing) {
+                    existing.outerHTML = renderInstanceCard(inst);
+                } else {
+                    container.insertAdjacentHTML('beforeend', renderInstanceCard(inst));
+                }
             });
+            instancesVersion = delta.version;
+
+            if (!container.querySelector('[data-instance-col]')) {
+                container.innerHTML = '<div class="col-12 text-center text-muted p-5" data-placeholder>Nessuna istanza configurata. Creane una nuova.</div>';
+            }
         } else {
             showNotification('danger', 'Errore caricamento istanze: ' + (result.body.detail || 'Sconosciuto'));
         }
@@ -215,9 +232,60 @@ async function createInstance() {
     }
 }
 
+// --- Live updates ---
+
+// Updates an instance card in place; returns false if the card is not rendered
+function applyInstanceState(state) {
+    const card = document.querySelector(`[data-instance-id="${state.id}"]`);
+    if (!card) return false;
+
+    const dot = card.querySelector('[data-field="status"]');
+    dot.classList.toggle('bg-success', state.status === 'running');
+    dot.classList.toggle('bg-danger', state.status !== 'running');
+    card.querySelector('[data-field="connected_clients"]').textContent = state.connected_clients || 0;
+    if (state.rx_rate !== undefined) {
+        applyInstanceTraffic(card, state);
+    }
+    return true;
+}
+
+function applyInstanceTraffic(card, rates) {
+    const traffic = card.querySelector('[data-field="traffic"]');
+    traffic.innerHTML = `<i class="ti ti-arrow-down icon-sm text-green"></i> ${formatBytes(rates.rx_rate)}/s
+        <i class="ti ti-arrow-up icon-sm text-blue ms-2"></i> ${formatBytes(rates.tx_rate)}/s`;
+}
+
+const reloadInstances = debounce(loadInstances);
+const reloadTopClients = debounce(loadTopClients, 2000);
+
+function subscribeDashboardEvents() {
+    subscribeEvents({
+        snapshot: data => data.instances.forEach(applyInstanceState),
+        instance_status: state => {
+            // A card that is not rendered yet means a new instance
+            if (!applyInstanceState(state)) reloadInstances();
+        },
+        instance_removed: () => reloadInstances(),
+        client_connected: () => reloadTopClients(),
+        client_disconnected: () => reloadTopClients(),
+        traffic: data => {
+            document.querySelectorAll('[data-instance-id]').forEach(card => {
+                const name = card.querySelector('.card-title').textContent;
+                if (data.instances[name]) applyInstanceTraffic(card, data.instances[name]);
+            });
+        },
+        resync: () => {
+            instancesVersion = null;
+            reloadInstances();
+            reloadTopClients();
+        }
+    });
+}
+
 document.addEventListener('DOMContentLoaded', () => {
     loadInstances();
     loadTopClients();
+    subscribeDashboardEvents();
 
     // Real-time validation for instance name
     const instanceNameInput = document.getElementById('instanceNameInput');
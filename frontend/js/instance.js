@@ -42,87 +42,123 @@ function renderInstanceDetails() {
 
 // --- CLIENTS ---
 
+let clientsVersion = null;
+
+function renderAvailableClientRow(client, displayName) {
+    const fullName = client.name;
+    return `
+        <tr data-client-row="${fullName}">
+            <td>
+                <div class="d-flex align-items-center">
+                    ${client.status === 'connected' ? '<span class="status-dot status-dot-animated status-green me-2"></span>' : ''}
+                    ${displayName}
+                </div>
+            </td>
+            <td>
+                <div class="d-flex gap-2 justify-content-end">
+                    <button class="btn btn-primary btn-sm btn-icon" onclick="downloadClient('${fullName}')" title="Scarica Configurazione">
+                        <i class="ti ti-download"></i>
+                    </button>
+                    <button class="btn btn-danger btn-sm btn-icon" onclick="revokeClient('${fullName}')" title="Revoca Client">
+                        <i class="ti ti-trash"></i>
+                    </button>
+                </div>
+            </td>
+        </tr>
+    `;
+}
+
+function renderConnectedClientRow(client, displayName) {
+    const fullName = client.name;
+    return `
+        <tr data-client-row="${fullName}">
+            <td>
+                <div class="d-flex align-items-center gap-2">
+                    <span class="status-indicator status-green status-indicator-animated">
+                        <span class="status-indicator-circle"></span>
+                        <span class="status-indicator-circle"></span>
+                        <span class="status-indicator-circle"></span>
+                    </span>
+                    ${displayName}
+                </div>
+            </td>
+            <td>
+                <div>${client.real_ip || '-'}</div>
+                <div class="small text-muted">VPN: ${client.virtual_ip || '-'}</div>
+            </td>
+            <td class="text-muted">
+                <div><i class="ti ti-arrow-down icon-sm text-green"></i> ${formatBytes(client.bytes_received)}</div>
+                <div><i class="ti ti-arrow-up icon-sm text-blue"></i> ${formatBytes(client.bytes_sent)}</div>
+                <div class="small" data-client-rate="${fullName}"></div>
+            </td>
+            <td>${formatDateTime(client.connected_since)}</td>
+            <td>
+                <button class="btn btn-danger btn-sm btn-icon" onclick="revokeClient('${fullName}')">
+                    <i class="ti ti-trash"></i>
+                </button>
+            </td>
+        </tr>
+    `;
+}
+
+// Replaces the row of a client, or inserts it keeping the table sorted by name
+function upsertClientRow(tbody, name, html) {
+    const existing = tbody.querySelector(`tr[data-client-row="${name}"]`);
+    if (existing) {
+        existing.outerHTML = html;
+        return;
+    }
+    const next = Array.from(tbody.querySelectorAll('tr[data-client-row]')).find(row => row.dataset.clientRow > name);
+    if (next) {
+        next.insertAdjacentHTML('beforebegin', html);
+    } else {
+        tbody.insertAdjacentHTML('beforeend', html);
+    }
+}
+
+function setEmptyPlaceholder(tbody, colspan, message) {
+    tbody.querySelector('tr[data-placeholder]')?.remove();
+    if (!tbody.querySelector('tr[data-client-row]')) {
+        tbody.innerHTML = `<tr data-placeholder><td colspan="${colspan}" class="text-center text-muted">${message}</td></tr>`;
+    }
+}
+
+// Fetches only the clients changed since the last load and patches both tables in place
 async function fetchAndRenderClients() {
     if (!currentInstance) return;
 
     try {
-        const response = await fetch(`${API_AJAX_HANDLER}?action=get_clients&instance_id=${currentInstance.id}`);
+        const response = await fetch(`${API_AJAX_HANDLER}?action=get_clients&instance_id=${currentInstance.id}&since=${clientsVersion ?? 0}`);
         const result = await response.json();
 
         const availBody = document.getElementById('availableClientsTableBody');
         const connBody = document.getElementById('connectedClientsTableBody');
-        availBody.innerHTML = '';
-        connBody.innerHTML = '';
 
         if (result.success) {
-            const clients = result.body;
+            const delta = result.body;
+            if (delta.full) {
+                availBody.innerHTML = '';
+                connBody.innerHTML = '';
+            }
 
-            clients.forEach(client => {
-                const displayName = client.name.replace(`${currentInstance.name}_`, '');
-                const fullName = client.name;
-
-                // Always render to Available Clients list (Left Side)
-                availBody.innerHTML += `
-                    <tr>
-                        <td>
-                            <div class="d-flex align-items-center">
-                                ${client.status === 'connected' ? '<span class="status-dot status-dot-animated status-green me-2"></span>' : ''}
-                                ${displayName}
-                            </div>
-                        </td>
-                        <td>
-                            <div class="d-flex gap-2 justify-content-end">
-                                <button class="btn btn-primary btn-sm btn-icon" onclick="downloadClient('${fullName}')" title="Scarica Configurazione">
-                                    <i class="ti ti-download"></i>
-                                </button>
-                                <button class="btn btn-danger btn-sm btn-icon" onclick="revokeClient('${fullName}')" title="Revoca Client">
-                                    <i class="ti ti-trash"></i>
-                                </button>
-                            </div>
-                        </td>
-                    </tr>
-                `;
+            delta.deleted.forEach(name => {
+                availBody.querySelector(`tr[data-client-row="${name}"]`)?.remove();
+                connBody.querySelector(`tr[data-client-row="${name}"]`)?.remove();
+            });
 
-                // If connected, ALSO render to Connected Clients list (Right Side)
+            delta.items.forEach(client => {
+                const displayName = client.name.replace(`${currentInstance.name}_`, '');
+                upsertClientRow(availBody, client.name, renderAvailableClientRow(client, displayName));
                 if (client.status === 'connected') {
-                    connBody.innerHTML += `
-                        <tr>
-                            <td>
-                                <div class="d-flex align-items-center gap-2">
-                                    <span class="status-indicator status-green status-indicator-animated">
-                                        <span class="status-indicator-circle"></span>
-                                        <span class="status-indicator-circle"></span>
-                                        <span class="status-indicator-circle"></span>
-                                    </span>
-                                    ${displayName}
-                                </div>
-                            </td>
-                            <td>
-                                <div>${client.real_ip || '-'}</div>
-                                <div class="small text-muted">VPN: ${client.virtual_ip || '-'}</div>
-                            </td>
-                            <td class="text-muted">
-                                <div><i class="ti ti-arrow-down icon-sm text-green"></i> ${formatBytes(client.bytes_received)}</div>
-                                <div><i class="ti ti-arrow-up icon-sm text-blue"></i> ${formatBytes(client.bytes_sent)}</div>
-                            </td>
-                            <td>${formatDateTime(client.connected_since)}</td>
-                            <td>
-                                <button class="btn btn-danger btn-sm btn-icon" onclick="revokeClient('${fullName}')">
-                                    <i class="ti ti-trash"></i>
-                                </button>
-                            </td>
-                        </tr>
-                    `;
+                    upsertClientRow(connBody, client.name, renderConnectedClientRow(client, displayName));
+                } else {
+                    connBody.querySelector(`tr[data-client-row="${client.name}"]`)?.remove();
                 }
             });
+            clientsVersion = delta.version;
 
-            if (clients.length === 0) {
-                availBody.innerHTML = '<tr><td colspan="2" class="text-center text-muted">Nessun client.</td></tr>';
-            }
-            if (connBody.innerHTML === '') {
-                connBody.innerHTML = '<tr><td colspan="5" class="text-center text-muted">Nessun client connesso.</td></tr>';
-            }
-
+            setEmptyPlaceholder(availBody, 2, 'Nessun client.');
+            setEmptyPlaceholder(connBody, 5, 'Nessun client connesso.');
         } else {
             showNotification('danger', 'Errore caricamento client: ' + (result.body.detail || 'Sconosciuto'));
         }
@@ -495,6 +531,33 @@ async function deleteInstanceAction() {
     }
 }
 
+// --- Live updates ---
+
+const reloadClients = debounce(fetchAndRenderClients);
+
+function isCurrentInstanceEvent(data) {
+    return currentInstance && data.instance_name === currentInstance.name;
+}
+
+function subscribeInstanceEvents() {
+    subscribeEvents({
+        client_connected: data => { if (isCurrentInstanceEvent(data)) reloadClients(); },
+        client_disconnected: data => { if (isCurrentInstanceEvent(data)) reloadClients(); },
+        traffic: data => {
+            data.clients.filter(isCurrentInstanceEvent).forEach(client => {
+                const cell = document.querySelector(`[data-client-rate="${client.client_name}"]`);
+                if (cell) {
+                    cell.textContent = `${formatBytes(client.rx_rate)}/s ↓ · ${formatBytes(client.tx_rate)}/s ↑`;
+                }
+            });
+        },
+        resync: () => {
+            clientsVersion = null;
+            reloadClients();
+        }
+    });
+}
+
 // Init
 document.addEventListener('DOMContentLoaded', () => {
     // Read instance ID from query string logic (handled in page script usually, or here)
@@ -502,6 +565,7 @@ document.addEventListener('DOMContentLoaded', () => {
     const instanceId = urlParams.get('id');
     if (instanceId) {
         loadInstanceDetails(instanceId);
+        subscribeInstanceEvents();
     }
 
     // Real-time validation for client name
@@ -3,6 +3,7 @@ let machineFirewallRules = [];
 let networkInterfaces = [];
 let currentEditingInterface = null; // Stores the interface being edited
 let sortableInstance = null; // To hold the SortableJS instance
+const NETPLAN_ROLLBACK_TIMEOUT = 60; // Seconds before an unconfirmed interface change is reverted
 
 const chainOptionsMap = {
     filter: ['INPUT', 'OUTPUT', 'FORWARD'],
@@ -370,7 +371,7 @@ function toggleMachinePortInput(protocol, modalType) {
 
 async function loadNetworkInterfaces() {
     const tbody = document.getElementById('network-interfaces-table-body');
-    tbody.innerHTML = '<tr><td colspan="7" class="text-center text-muted">Caricamento interfacce...</td></tr>';
+    tbody.innerHTML = '<tr><td colspan="8" class="text-center text-muted">Caricamento interfacce...</td></tr>';
     
     try {
         const response = await fetch(`${API_AJAX_HANDLER}?action=get_machine_network_interfaces`);
@@ -381,11 +382,11 @@ async function loadNetworkInterfaces() {
             renderNetworkInterfaces();
         } else {
             showNotification('danger', 'Errore caricamento interfacce di rete: ' + (result.body.detail || 'Sconosciuto'));
-            tbody.innerHTML = '<tr><td colspan="7" class="text-center text-danger">Errore caricamento.</td></tr>';
+            tbody.innerHTML = '<tr><td colspan="8" class="text-center text-danger">Errore caricamento.</td></tr>';
         }
     } catch (e) {
         showNotification('danger', 'Errore di connessione caricando interfacce di rete: ' + e.message);
-        tbody.innerHTML = '<tr><td colspan="7" class="text-center text-danger">Errore di connessione.</td></tr>';
+        tbody.innerHTML = '<tr><td colspan="8" class="text-center text-danger">Errore di connessione.</td></tr>';
     }
 }
 
@@ -394,7 +395,7 @@ function renderNetworkInterfaces() {
     tbody.innerHTML = '';
 
     if (networkInterfaces.length === 0) {
-        tbody.innerHTML = '<tr><td colspan="7" class="text-center text-muted">Nessuna interfaccia di rete trovata.</td></tr>';
+        tbody.innerHTML = '<tr><td colspan="8" class="text-center text-muted">Nessuna interfaccia di rete trovata.</td></tr>';
         return;
     }
 
@@ -415,6 +416,13 @@ function renderNetworkInterfaces() {
             }
         }
         
+        // Rates are sampled by the backend in bit/s
+        let trafficDisplay = 'N/A';
+        if (iface.traffic) {
+            trafficDisplay = `<i class="ti ti-arrow-down"></i> ${formatBytes(iface.traffic.rx_bps / 8)}/s
+                <i class="ti ti-arrow-up ms-2"></i> ${formatBytes(iface.traffic.tx_bps / 8)}/s`;
+        }
+
         tr.innerHTML = `
             <td>${iface.name}</td>
             <td>${iface.mac_address || 'N/A'}</td>
@@ -422,6 +430,7 @@ function renderNetworkInterfaces() {
             <td>${ipDisplay}</td>
             <td>${cidrDisplay}</td>
             <td>${netmaskDisplay}</td>
+            <td class="text-nowrap">${trafficDisplay}</td>
             <td class="text-end">
                 <button class="btn btn-sm btn-primary" onclick="openEditNetworkInterfaceModal('${iface.name}')">
                     <i class="ti ti-edit"></i> Configura
@@ -547,7 +556,8 @@ async function saveNetworkInterfaceConfig() {
     }
     
     try {
-        const response = await fetch(`${API_AJAX_HANDLER}?action=update_machine_network_interface_config&interface_name=${encodeURIComponent(interfaceName)}`, {
+        // Applied like `netplan try`: the backend reverts it unless confirmed in time
+        const response = await fetch(`${API_AJAX_HANDLER}?action=update_machine_network_interface_config&interface_name=${encodeURIComponent(interfaceName)}&rollback_timeout=${NETPLAN_ROLLBACK_TIMEOUT}`, {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify(netplanConfig)
@@ -555,8 +565,14 @@ async function saveNetworkInterfaceConfig() {
         const result = await response.json();
 
         if (result.success) {
-            showNotification('success', 'Configurazione interfaccia salvata e applicata con successo.');
             bootstrap.Modal.getInstance(document.getElementById('modal-edit-network-interface')).hide();
+            if (!result.body.changed) {
+                showNotification('info', 'Nessuna modifica alla configurazione, niente da applicare.');
+            } else if (result.body.pending_rollback) {
+                await confirmNetplanChange(result.body.pending_rollback);
+            } else {
+                showNotification('success', 'Configurazione interfaccia salvata e applicata con successo.');
+            }
             loadNetworkInterfaces();
         } else {
             showNotification('danger', 'Errore salvataggio configurazione: ' + (result.body.detail || 'Sconosciuto'));
@@ -566,6 +582,22 @@ async function saveNetworkInterfaceConfig() {
     }
 }
 
+async function confirmNetplanChange(pending) {
+    const keep = confirm(`Configurazione applicata. Mantenerla?\nSe non confermi entro ${pending.expires_in} secondi verrà ripristinata automaticamente.`);
+    const action = keep ? 'confirm_netplan_change' : 'rollback_netplan_change';
+    try {
+        const response = await fetch(`${API_AJAX_HANDLER}?action=${action}&change_id=${encodeURIComponent(pending.id)}`, { method: 'POST' });
+        const result = await response.json();
+        if (result.success) {
+            showNotification('success', keep ? 'Configurazione interfaccia confermata.' : 'Configurazione precedente ripristinata.');
+        } else {
+            showNotification('danger', 'Errore: ' + (result.body.detail || 'Sconosciuto'));
+        }
+    } catch (e) {
+        showNotification('danger', 'Errore di connessione: ' + e.message);
+    }
+}
+
 // Global notification function (assuming it's defined in header or a common utils)
 // function showNotification(type, message) { ... }
 
@@ -32,6 +32,28 @@ function showNotification(message, type = 'success') {
     }, 3000);
 }
 
+// Live updates from the backend (Server-Sent Events, proxied by nginx with the API key).
+// handlers: { eventName: data => ... }. EventSource reconnects on its own.
+function subscribeEvents(handlers) {
+    if (!window.EventSource) return null;
+    const source = new EventSource('/api/events');
+    Object.entries(handlers).forEach(([event, handler]) => {
+        source.addEventListener(event, e => {
+            if (e.data) handler(JSON.parse(e.data));
+        });
+    });
+    return source;
+}
+
+// Runs fn at most once per `wait` ms, after the last call.
+function debounce(fn, wait = 500) {
+    let timer = null;
+    return (...args) => {
+        clearTimeout(timer);
+        timer = setTimeout(() => fn(...args), wait);
+    };
+}
+
 function formatDateTime(isoString) {
     if (!isoString) return '-';
     // Remove nanoseconds if present to ensure compatibility
@@ -85,11 +85,12 @@ require_once 'includes/header.php';
                                                             <th>IP</th>
                                                             <th>CIDR</th>
                                                             <th>Netmask</th>
+                                                            <th>Traffico</th>
                                                             <th class="w-1"></th>
                                                         </tr>
                                                     </thead>
                                                     <tbody id="network-interfaces-table-body">
-                                                        <tr><td colspan="7" class="text-center text-muted">Caricamento interfacce...</td></tr>
+                                                        <tr><td colspan="8" class="text-center text-muted">Caricamento interfacce...</td></tr>
                                                     </tbody>
                                                 </table>
                                             </div>
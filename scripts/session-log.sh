@@ -0,0 +1,22 @@
+#!/bin/sh
+# OpenVPN client-connect / client-disconnect hook: appends one session record to the
+# log given as first argument (installed by the backend in the instance config).
+# Records are tab-separated lines, written with a single O_APPEND write:
+#   C  time_unix  common_name  real_ip  virtual_ip
+#   D  time_unix  common_name  real_ip  virtual_ip  duration  bytes_received  bytes_sent
+# time_unix is the connection start in both records. The hook always exits 0:
+# a failing client-connect script would refuse the client.
+
+LOG_FILE="$1"
+REAL_IP="${trusted_ip:-$trusted_ip6}"
+
+case "$script_type" in
+    client-connect)
+        printf 'C\t%s\t%s\t%s\t%s\n' "$time_unix" "$common_name" "$REAL_IP" "$ifconfig_pool_remote_ip" >> "$LOG_FILE" 2>/dev/null
+        ;;
+    client-disconnect)
+        printf 'D\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n' "$time_unix" "$common_name" "$REAL_IP" "$ifconfig_pool_remote_ip" \
+            "$time_duration" "$bytes_received" "$bytes_sent" >> "$LOG_FILE" 2>/dev/null
+        ;;
+esac
+exit 0
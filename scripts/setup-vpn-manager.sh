@@ -188,6 +188,7 @@ mkdir -p /opt/vpn-manager/scripts
 cp -r ../scripts/* /opt/vpn-manager/scripts/
 chmod +x /opt/vpn-manager/scripts/revoke-client.sh
 chmod +x /opt/vpn-manager/scripts/create-client.sh
+chmod 755 /opt/vpn-manager/scripts/session-log.sh # Eseguito da OpenVPN come utente nobody
 
 # Installa le dipendenze
 log_info "Installazione delle dipendenze Python..."
@@ -345,6 +346,16 @@ if [[ $? -ne 0 ]]; then
   exit 1
 fi
 
+# La location /api/events inoltra lo stream SSE con la chiave API: il file la contiene
+sed -i "s|X-API-Key \"mysecretkey\"|X-API-Key \"$API_KEY\"|" /etc/nginx/sites-available/vpn-dashboard.conf
+chmod 600 /etc/nginx/sites-available/vpn-dashboard.conf
+
+# Directory dei file .ovpn serviti da Nginx via X-Accel-Redirect (ACCEL_CONFIG_DIR)
+log_info "Creazione della directory per i download dei client..."
+mkdir -p /var/lib/vpn-manager/ovpn
+chown root:www-data /var/lib/vpn-manager/ovpn
+chmod 750 /var/lib/vpn-manager/ovpn
+
 # Rimuove il sito Nginx di default e abilita il nostro
 log_info "Abilitazione della configurazione Nginx..."
 rm -f /etc/nginx/sites-enabled/default
@@ -0,0 +1,37 @@
+import pytest
+
+import session_log
+
+
+@pytest.fixture
+def write_log(tmp_path, monkeypatch):
+    monkeypatch.setattr(session_log, "SESSION_LOG_DIR", str(tmp_path))
+
+    def write(*records):
+        with open(session_log.log_path("office"), "a") as f:
+            f.write("".join("\t".join(map(str, record)) + "\n" for record in records))
+    return write
+
+
+def _sessions(store, client_name=None):
+    result = store.query("office", client_name, 0, 10_000)
+    return [(s["start"], s["end"], s["end_unknown"]) for s in result["sessions"]]
+
+
+def test_next_connection_closes_session_without_disconnect(write_log):
+    store = session_log.SessionStore()
+    write_log(("C", 100, "alice", "198.51.100.7", "10.8.0.2"))
+    assert _sessions(store) == [(100, None, False)]
+
+    # OpenVPN was killed: no D record, then the client connects again
+    write_log(("C", 500, "alice", "198.51.100.7", "10.8.0.2"))
+    assert _sessions(store, "alice") == [(500, None, False), (100, 500, True)]
+    assert [s["start"] for s in store.query("office", None, 510, 520)["sessions"]] == [500]
+
+
+def test_late_disconnect_sets_real_end(write_log):
+    store = session_log.SessionStore()
+    write_log(("C", 100, "bob", "198.51.100.8", "10.8.0.3"),
+              ("C", 600, "bob", "198.51.100.8", "10.8.0.3"),
+              ("D", 100, "bob", "198.51.100.8", "10.8.0.3", 490, 5, 7))
+    assert _sessions(store, "bob") == [(600, None, False), (100, 590, False)]
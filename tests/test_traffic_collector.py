@@ -0,0 +1,64 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import firewall_manager
+import instance_manager
+import vpn_manager
+from traffic_collector import TrafficCollector
+
+
+def _write_status_log(log_dir, instance_name, clients, since):
+    lines = [
+        "TITLE,OpenVPN 2.6.9 x86_64-pc-linux-gnu",
+        "HEADER,CLIENT_LIST,Common Name,Real Address,Virtual Address,Virtual IPv6 Address,Bytes Received,"
+        "Bytes Sent,Connected Since,Connected Since (time_t),Username,Client ID,Peer ID,Data Channel Cipher",
+    ]
+    for n, client_name in enumerate(clients):
+        lines.append(f"CLIENT_LIST,{client_name},203.0.113.{n + 1}:40000,10.8.0.{n + 2},,"
+                     f"1000,3000,2026-01-01 00:00:00,{since},UNDEF,{n},{n},AES-256-GCM")
+    lines.append("END")
+    with open(os.path.join(log_dir, f"status_{instance_name}.log"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+@pytest.fixture
+def instances(tmp_path, monkeypatch):
+    """Two instances with a status log each; tests set their systemd status."""
+    instances = {name: SimpleNamespace(id=name, name=name, status="running") for name in ("office", "dev")}
+    monkeypatch.setattr(instance_manager, "OPENVPN_LOG_DIR", str(tmp_path))
+    monkeypatch.setattr(instance_manager, "list_instances", lambda: list(instances.values()))
+    monkeypatch.setattr(instance_manager, "get_all_instances", lambda: list(instances.values()))
+    monkeypatch.setattr(firewall_manager, "get_groups", lambda: [])
+    monkeypatch.setattr(vpn_manager, "_status_cache", {})
+    since = int(time.time()) - 3600
+    _write_status_log(tmp_path, "office", ["office_alice", "office_bob"], since)
+    _write_status_log(tmp_path, "dev", ["dev_carol"], since)
+    return instances
+
+
+def _connected(collector):
+    return {(r["instance_name"], r["client_name"]) for r in collector.get_rates() if r["connected"]}
+
+
+def test_stopped_instance_with_leftover_status_log(instances):
+    collector = TrafficCollector()
+    collector.sample()
+    assert _connected(collector) == {("office", "office_alice"), ("office", "office_bob"), ("dev", "dev_carol")}
+
+    # The service stops (or crashes) and its last status log stays on disk
+    instances["office"].status = "stopped"
+    collector.sample()
+    assert _connected(collector) == {("dev", "dev_carol")}
+    stats = {s["instance_name"]: s["connected_clients"] for s in collector.get_instance_stats()}
+    assert stats == {"office": 0, "dev": 1}
+
+    collector.sample()
+    assert _connected(collector) == {("dev", "dev_carol")}
+
+    # Back up with the same, unchanged log: its clients are read again
+    instances["office"].status = "running"
+    collector.sample()
+    assert _connected(collector) == {("office", "office_alice"), ("office", "office_bob"), ("dev", "dev_carol")}